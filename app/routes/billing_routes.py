@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from typing import List
 from fastapi.responses import FileResponse
 from dotenv import load_dotenv
@@ -10,33 +11,21 @@ import os
 import uuid, pathlib
 import json
 
-from openai import AsyncOpenAI
 from reportlab.lib import colors
 
 from app.utils.session_manager import session_manager
+from app.utils import aufmass_store
 from app.services.lv_matcher     import best_matches_batch, parse_aufmass
 from app.invoices.builder       import make_invoice
 from app.services.lv_loader import load_lv
 from app.services.lv_matcher import best_matches_batch, parse_aufmass, _classify_line
-
-from langsmith.wrappers import wrap_openai
+from app.services import prompt_templates
+from app.services.llm_client import chat_completion
+from app.services.llm_limiter import BATCH
 
 # Lädt automatisch die .env-Datei aus dem aktuellen Verzeichnis
 load_dotenv()
 
-# Langsmith-key
-os.environ["LANGSMITH_TRACING"] = "true"
-os.environ["LANGSMITH_ENDPOINT"] = "https://api.smith.langchain.com"
-os.getenv("LANGSMITH_API_KEY")
-os.getenv("LANGSMITH_PROJECT")
-os.environ["LANGSMITH_DEBUG"] = "true"
-
-
-# OpenAI-Key
-async_client = wrap_openai(AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://openrouter.ai/api/v1"
-))
 
 router = APIRouter()  
 
@@ -51,43 +40,44 @@ class InvoiceRequest(BaseModel):
     mapping   : List[dict]
 
 # ---------- GPT-Helfer ----------
+_PROMPT_DIMS = prompt_templates.register("extract-dims", static=(
+    "Du bist ein Assistent für Bauaufmaße.\n"
+    "Extrahiere aus dem Aufmaßtext (Nutzernachricht) die Maße als JSON mit den "
+    "Feldern L, B, T (in Meter, falls vorhanden).\n"
+    "Antworte nur mit JSON, z.B. {\"L\": 5.0, \"B\": 1.0, \"T\": 2.0}"
+), dynamic="{line}")
+
 async def extract_dims_gpt(line: str) -> dict:
-    prompt = (
-        "Extrahiere aus folgendem Aufmaßtext die Maße als JSON mit den "
-        "Feldern L, B, T (in Meter, falls vorhanden):\n"
-        f"{line}\n"
-        "Antworte nur mit JSON, z.B. {\"L\": 5.0, \"B\": 1.0, \"T\": 2.0}"
-    )
-    resp = await async_client.chat.completions.create(
+    content = await chat_completion(
         model            = "openai/gpt-4o-mini",
+        timeout          = 20,
+        priority         = BATCH,
         temperature      = 0.0,
         response_format  = {"type": "json_object"},
-        messages = [
-            {"role": "system", "content": "Du bist ein Assistent für Bauaufmaße."},
-            {"role": "user",   "content": prompt},
-        ],
+        messages         = _PROMPT_DIMS.messages(line=line),
         max_tokens = 100,
     )
-    return json.loads(resp.choices[0].message.content)
+    return json.loads(content)
 
 # ---------- /match-lv ----------
-@router.post("/match-lv")
-async def match_lv(req: MatchRequest):
-    sess = session_manager.get_session(req.session_id)
-    if not sess.get("elements"):
+def _load_aufmass(session_id: str) -> tuple[dict, list[str]]:
+    """Session + volle Aufmaßzeilen (blockierendes Store-I/O → Threadpool)."""
+    sess = session_manager.get_session(session_id)
+    if not sess or not sess.get("elements"):
         raise HTTPException(404, "Session unknown oder empty")
 
-
-    # Manuellen Override bevorzugen, sonst letzten Auto-Aufmaßblock
-    manual = next((e["lines"] for e in reversed(sess["elements"])
-                if e.get("type") == "aufmass_override"), None)
+    # Manuellen Override bevorzugen, sonst generierten Aufmaßblock
+    manual = aufmass_store.get_manual_lines(sess)
     if manual:
-        lines_full = [l for l in manual if l.strip()]          # volle Zeilen
-    else:
-        texts = [e["text"] for e in sess["elements"] if e.get("type") == "aufmass"]
-        if not texts:
-            raise HTTPException(400, "Aufmaß fehlt – zuerst DXF erstellen")
-        lines_full = _split_full_lines(texts[-1])              # volle Zeilen
+        return sess, manual                                     # volle Zeilen
+    text = aufmass_store.get_auto_aufmass(session_id, sess)
+    if not text:
+        raise HTTPException(400, "Aufmaß fehlt oder ist veraltet – zuerst DXF erstellen")
+    return sess, _split_full_lines(text)                        # volle Zeilen
+
+@router.post("/match-lv")
+async def match_lv(req: MatchRequest):
+    sess, lines_full = await run_in_threadpool(_load_aufmass, req.session_id)
 
     # für Backward-Compat: Hash-Key = Teil NACH dem Doppelpunkt
     lines_key = [_after_colon(l) for l in lines_full]
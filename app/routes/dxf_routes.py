@@ -3,6 +3,7 @@ from fastapi.responses import FileResponse
 import os, pathlib, uuid
 
 from app.utils.session_manager import session_manager    
+from app.utils import aufmass_store
 from app.services.dxf_service  import DXFService
 
 router      = APIRouter()
@@ -12,20 +13,16 @@ dxf_service = DXFService()
 def generate_dxf_by_session(session_id: str = Query(...)):
     """
     Erzeugt eine DXF-Datei aus der aktuellen Session
-    und hängt den Aufmaß-Block in `session_manager` an.
+    und legt den Aufmaß-Block als Nebendokument der Session ab.
     """
     session = session_manager.get_session(session_id)
-    if not session["elements"]:
+    if not session or not session["elements"]:
         raise HTTPException(400, "Session leer – erst Elemente anlegen")
 
     try:
         dxf_path, aufmass_txt = dxf_service.generate_dxf(session)
 
-        session["elements"].append({
-            "type": "aufmass",
-            "text": aufmass_txt
-        })
-        session_manager.update_session(session_id, session)
+        aufmass_store.set_auto_aufmass(session_id, session, aufmass_txt)
 
         return FileResponse(
             dxf_path,
@@ -2,11 +2,11 @@ from __future__ import annotations
 from collections import defaultdict
 from typing import Optional, List, Dict, Any
 
-from fastapi import APIRouter, Query, HTTPException         
+from fastapi import APIRouter, Query, HTTPException, Header, Response
 from pydantic import BaseModel                              
 from hashlib import sha1                                    
 
-from app.utils.session_manager import session_manager
+from app.utils.session_manager import session_manager, etag
 from app.services.lv_loader import search_lv, load_lv
 
 router = APIRouter()
@@ -80,10 +80,9 @@ def get_lv(
     return {"tabs": tabs}
 
 @router.post("/lv-link")
-def set_lv_link(req: LVLinkRequest):
-    sess = session_manager.get_session(req.session_id)
-    if not sess:
-        raise HTTPException(404, "Session unknown")
+def set_lv_link(req: LVLinkRequest, response: Response,
+                if_match: Optional[str] = Header(None)):
+    sess, rev = session_manager.get_session_rev(req.session_id, if_match, create=True)
     items = load_lv()
     item  = next((x for x in items if x["code"] == req.code), None)
     if not item:
@@ -92,5 +91,7 @@ def set_lv_link(req: LVLinkRequest):
     h = sha1(req.line.strip().encode("utf-8")).hexdigest()
     links = sess.setdefault("lv_links", {})
     links[h] = req.code
-    session_manager.update_session(req.session_id, sess)
+    rev = session_manager.update_session(req.session_id, sess, expected_rev=rev, event="lv-link",
+                                         inputs={"line": req.line, "code": req.code})
+    response.headers["ETag"] = etag(rev)
     return {"status": "ok", "code": req.code}
\ No newline at end of file
@@ -0,0 +1,199 @@
+import os
+import re
+import threading
+import time
+
+from app.utils.element_index import ElementIndex, Kind, _int
+
+# -----------------------------------------------------
+# Lokaler Parser für häufige /add-element-Formulierungen
+# -----------------------------------------------------
+# Deckt die Standardfälle ab, deren Regeln im Add-Prompt stehen:
+#   "Baugraben 5x5x2 m"                       (optional Tiefe links/rechts, GOK)
+#   "drei Baugräben 5x5x2, 10x5x2 und 20x5x2" / "drei Baugräben mit 5x5x2 m"
+#   "Druckrohr DN150 in BG 2"                 (optional Länge, Versatz)
+#   "Durchstich l=2 zwischen BG 1 und 2"      / "Verbinde Baugraben 1 und 2 mit Durchstich l=2"
+#
+# Vorgehen: Text normalisieren, bekannte Satzteile (Slots) herausschneiden;
+# bleibt danach etwas anderes als Füllwörter übrig, ist die Eingabe nicht
+# eindeutig → None, und der Aufrufer fragt wie bisher das LLM.
+
+LOCAL_PARSER = os.getenv("ADD_LOCAL_PARSER", "1") not in ("0", "false", "no")
+
+_NUM = r"(\d+(?:\.\d+)?)"
+_DIM = re.compile(rf"{_NUM}\s*x\s*{_NUM}(?:\s*x\s*{_NUM})?(?:\s*m\b)?")
+
+_COUNT_WORDS = {
+    "ein": 1, "eine": 1, "einen": 1, "zwei": 2, "drei": 3, "vier": 4, "fuenf": 5,
+    "sechs": 6, "sieben": 7, "acht": 8, "neun": 9, "zehn": 10,
+}
+_COUNT = re.compile(r"\b(\d+|" + "|".join(_COUNT_WORDS) + r")\s+(?=baugr|bg\b)")
+
+_FILLER = {
+    "zeichne", "zeichnen", "erstelle", "erstellen", "erzeuge", "lege", "leg", "an", "fuege",
+    "hinzu", "bitte", "mir", "uns", "noch", "neuen", "neue", "neuer", "mit", "m", "meter",
+    "und", "einer", "von", "den", "dem", "der", "die", "das", "ein", "eine", "einen",
+}
+
+_TRENCH_KW  = re.compile(r"\b(?:baugraeben|baugraben|bg)\b")
+_PIPE_KW    = re.compile(r"\b(?:druck|abwasser|kg|pe|pvc|schutz)?rohr\b")
+_PASS_KW    = re.compile(r"\bdurchstich\b")
+_FOREIGN_KW = re.compile(r"oberflaech|pflaster|platten|verbindung|verbund|entfern|loesch|aender|"
+                         r"erster|ersten|zweit|dritt|viert|fuenft|letzt|\bwurde\b|\bist\b")
+
+_DEPTH_LR = re.compile(rf"tiefe\s+links\s+{_NUM}\s*m?\s*(?:,|und)?\s*(?:tiefe\s+)?rechts\s+{_NUM}\s*m?")
+_DEPTH    = re.compile(rf"tiefe\s*(?:=|von)?\s*{_NUM}\s*m?")
+_GOK      = re.compile(rf"(?:gok|gelaendeoberkante|ok\s+gelaende)\s*([+-]?)\s*{_NUM}\s*(mm|cm|m)?\b")
+_DN       = re.compile(r"\bdn\s*(\d+)\b")
+_IN_BG    = re.compile(r"\b(?:in|im|zu|fuer|an)\s+(?:den\s+|dem\s+)?(?:bg|baugraben)\s*(\d+)\b")
+_LENGTH   = re.compile(rf"(?:laenge|\bl)\s*(?:=|von)?\s*{_NUM}\s*m?|{_NUM}\s*m\s+laenge")
+_OFFSET   = re.compile(rf"(?:versatz|offset)\s*(?:=|von)?\s*{_NUM}\s*m?")
+_FULL     = re.compile(r"(?:ueber|auf)\s+(?:die\s+)?(?:gesamte|volle|ganze|komplette)n?\s+laenge")
+_BETWEEN  = re.compile(r"zwischen\s+(?:bg|baugraben)\s*(\d+)\s+und\s+(?:bg\s*|baugraben\s*)?(\d+)")
+_CONNECT  = re.compile(r"verbinde\s+(?:bg|baugraben)\s*(\d+)\s+und\s+(?:bg\s*|baugraben\s*)?(\d+)\s+mit")
+
+def _normalize(text: str) -> str:
+    t = (text or "").strip().lower()
+    t = t.replace("ä", "ae").replace("ö", "oe").replace("ü", "ue").replace("ß", "ss")
+    t = re.sub(r"[×*·]", "x", t)
+    t = re.sub(r"(\d),(\d)", r"\1.\2", t)          # Dezimalkomma, Listenkomma bleibt
+    return re.sub(r"\s+", " ", t).strip(" .!")
+
+def _take(rx: re.Pattern, t: str):
+    """Erstes Vorkommen herausschneiden → (match | None, Rest)."""
+    m = rx.search(t)
+    if not m:
+        return None, t
+    return m, t[:m.start()] + " " + t[m.end():]
+
+def _only_filler(rest: str) -> bool:
+    return all(w in _FILLER for w in re.findall(r"[a-z0-9_.+-]+", rest))
+
+def _f(v: str) -> float:
+    return float(v)
+
+# --- Baugräben -----------------------------------------------------------
+def _parse_trenches(t: str, ix: ElementIndex) -> dict | None:
+    m_cnt, t = _take(_COUNT, t)
+    count = None
+    if m_cnt:
+        w = m_cnt.group(1)
+        count = int(w) if w.isdigit() else _COUNT_WORDS[w]
+
+    m_lr, t = _take(_DEPTH_LR, t)
+    m_d, t = _take(_DEPTH, t)
+    m_gok, t = _take(_GOK, t)
+    dims = list(_DIM.finditer(t))
+    t = _DIM.sub(" ", t)
+    t = _TRENCH_KW.sub(" ", t, count=1)
+    t = t.replace(",", " ")
+    if not dims or not _only_filler(t):
+        return None
+
+    if count is None:
+        count = len(dims)
+    elif len(dims) not in (1, count):
+        return None                     # Stückzahl passt nicht zur Maßliste → LLM
+
+    extra: dict = {}
+    if m_lr:
+        dl, dr = _f(m_lr.group(1)), _f(m_lr.group(2))
+        extra.update(depth_left=dl, depth_right=dr, depth=max(dl, dr))
+    elif m_d:
+        extra["depth"] = _f(m_d.group(1))
+    if m_gok:
+        v = _f(m_gok.group(2)) / {"mm": 1000.0, "cm": 100.0}.get(m_gok.group(3) or "m", 1.0)
+        extra["gok"] = -v if m_gok.group(1) == "-" else v
+
+    nxt = max((_int(e.get("trench_index")) for e in ix.of_kind(Kind.TRENCH)), default=0) + 1
+    out = []
+    for i in range(count):
+        d = dims[i if len(dims) > 1 else 0]
+        el = {"type": "Baugraben", "trench_index": nxt + i,
+              "length": _f(d.group(1)), "width": _f(d.group(2))}
+        if d.group(3) is not None:
+            el["depth"] = _f(d.group(3))
+            if extra.get("depth", el["depth"]) != el["depth"]:
+                return None             # Tiefe im Maß und als Feld, widersprüchlich → LLM
+        el.update(extra)
+        if "depth" not in el:
+            return None                 # nur L×B ohne Tiefe → LLM
+        el.setdefault("gok", 0.0)
+        out.append(el)
+    word = "Baugraben" if count == 1 else "Baugräben"
+    refs = ", ".join(f"BG {e['trench_index']}" for e in out)
+    return {"new_elements": out, "answer": f"{count} {word} angelegt ({refs})."}
+
+# --- Rohr ----------------------------------------------------------------
+def _parse_pipe(t: str, ix: ElementIndex) -> dict | None:
+    m_dn, t = _take(_DN, t)
+    m_bg, t = _take(_IN_BG, t)
+    m_full, t = _take(_FULL, t)
+    m_len, t = _take(_LENGTH, t)
+    m_off, t = _take(_OFFSET, t)
+    t = _PIPE_KW.sub(" ", t, count=1)
+    if not (m_dn and m_bg) or not _only_filler(t):
+        return None
+    bg = int(m_bg.group(1))
+    if bg not in ix.trench_by_index:
+        return None                     # unbekannter Baugraben → LLM formuliert die Absage
+
+    el = {"type": "Rohr", "for_trench": bg, "diameter": int(m_dn.group(1)) / 1000.0}
+    if m_len and not m_full:
+        el["length"] = _f(m_len.group(1) or m_len.group(2))
+    else:
+        el["full_span"] = True
+    if m_off:
+        el["offset"] = _f(m_off.group(1))
+    what = f"{el['length']:g} m" if "length" in el else "über die gesamte Länge"
+    return {"new_elements": [el],
+            "answer": f"Rohr DN{m_dn.group(1)} in BG {bg} angelegt ({what})."}
+
+# --- Durchstich ----------------------------------------------------------
+def _parse_pass(t: str, ix: ElementIndex) -> dict | None:
+    m_bw, t = _take(_BETWEEN, t)
+    if not m_bw:
+        m_bw, t = _take(_CONNECT, t)
+    m_len, t = _take(_LENGTH, t)
+    t = _PASS_KW.sub(" ", t, count=1)
+    if not (m_bw and m_len) or not _only_filler(t):
+        return None
+    a, b = int(m_bw.group(1)), int(m_bw.group(2))
+    if abs(a - b) != 1 or a not in ix.trench_by_index or b not in ix.trench_by_index:
+        return None
+    el = {"type": "Durchstich", "length": _f(m_len.group(1) or m_len.group(2)), "between": min(a, b)}
+    return {"new_elements": [el],
+            "answer": f"Durchstich ({el['length']:g} m) zwischen BG {min(a, b)} und {max(a, b)} angelegt."}
+
+# -----------------------------------------------------
+# Einstieg + Trefferquote
+# -----------------------------------------------------
+_lock = threading.Lock()
+_stats = {"requests": 0, "local_hits": 0, "llm_fallbacks": 0, "parse_us_total": 0}
+
+def parse_add(text: str, ix: ElementIndex) -> dict | None:
+    """{"new_elements": [...], "answer": …} wie vom LLM – oder None (nicht eindeutig)."""
+    if not LOCAL_PARSER:
+        return None
+    t0 = time.perf_counter()
+    result = None
+    t = _normalize(text)
+    if t and not _FOREIGN_KW.search(t):
+        if _PASS_KW.search(t):
+            result = _parse_pass(t, ix)
+        elif _PIPE_KW.search(t):
+            result = _parse_pipe(t, ix)
+        elif _TRENCH_KW.search(t):
+            result = _parse_trenches(t, ix)
+    us = int((time.perf_counter() - t0) * 1e6)
+    with _lock:
+        _stats["requests"] += 1
+        _stats["local_hits" if result else "llm_fallbacks"] += 1
+        _stats["parse_us_total"] += us
+    return result
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+    s["hit_rate"] = round(s["local_hits"] / s["requests"], 4) if s["requests"] else 0.0
+    return s
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from hashlib import sha256
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+# -----------------------------------------------------
+# Cache für LLM-Antworten (inhaltsadressiert)
+# -----------------------------------------------------
+# Alle Aufrufe laufen mit temperature=0.0 – gleiche Eingabe, gleiche Antwort.
+# Schlüssel = sha256 über Modell, normalisierte Nachrichten und die übrigen
+# Parameter (max_tokens, response_format …). Zwei Stufen:
+#   1. In-Memory-LRU (LLM_CACHE_ENTRIES)
+#   2. SQLite-Datei (LLM_CACHE_PATH, Standard aus) – überlebt Neustarts,
+#      wird von allen Workern eines Hosts geteilt; Datei erst beim ersten
+#      Zugriff angelegt, Zugriffe im Threadpool (blockiert nie die Event-Loop)
+# Einträge sind LLM_CACHE_TTL_SECONDS ab dem Schreiben gültig.
+
+LLM_CACHE         = os.getenv("LLM_CACHE", "1") not in ("0", "false", "no")
+LLM_CACHE_ENTRIES = int(os.getenv("LLM_CACHE_ENTRIES", "1000"))
+LLM_CACHE_TTL     = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_PATH    = os.getenv("LLM_CACHE_PATH", "")      # z. B. temp/llm_cache.db
+
+def _norm(text: str) -> str:
+    # Einrückung / Zeilenumbrüche der Prompt-Templates sind für den Schlüssel egal
+    return " ".join((text or "").split())
+
+def cache_key(model: str, messages: list[dict], **params) -> str:
+    norm = [{"role": m.get("role"), "content": _norm(m.get("content", ""))} for m in messages]
+    raw = json.dumps({"model": model, "messages": norm, "params": params},
+                     sort_keys=True, ensure_ascii=False)
+    return sha256(raw.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    def __init__(self, max_entries: int = LLM_CACHE_ENTRIES, ttl: float = LLM_CACHE_TTL,
+                 path: str | None = LLM_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path or None
+        self._mem: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ready = False
+        self.stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "stores": 0, "expired": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        if not self._ready:
+            self._init_db()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self) -> None:
+        with self._lock:
+            if self._ready:
+                return
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " ts REAL NOT NULL,"
+                " model TEXT,"
+                " content TEXT NOT NULL)"
+            )
+            conn.close()
+            self._ready = True
+
+    def _fresh(self, ts: float) -> bool:
+        return not self.ttl or time.time() - ts <= self.ttl
+
+    def get(self, key: str) -> str | None:
+        hit = self.get_memory(key)
+        if hit is None and self.path:
+            hit = self.get_disk(key)
+        if hit is None:
+            self.miss()
+        return hit
+
+    def get_memory(self, key: str) -> str | None:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if self._fresh(item[0]):
+                    self._mem.move_to_end(key)
+                    self.stats["hits_memory"] += 1
+                    return item[1]
+                del self._mem[key]
+                self.stats["expired"] += 1
+        return None
+
+    def get_disk(self, key: str) -> str | None:
+        """Blockierend (SQLite) – aus async-Code nur über den Threadpool."""
+        row = self._conn().execute("SELECT ts, content FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row and self._fresh(row[0]):
+            self._remember(key, row[0], row[1])
+            with self._lock:
+                self.stats["hits_disk"] += 1
+            return row[1]
+        if row:
+            self._conn().execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            with self._lock:
+                self.stats["expired"] += 1
+        return None
+
+    def miss(self) -> None:
+        with self._lock:
+            self.stats["misses"] += 1
+
+    def put(self, key: str, content: str, model: str = "") -> None:
+        ts = self.put_memory(key, content)
+        if self.path:
+            self.put_disk(key, ts, content, model)
+
+    def put_memory(self, key: str, content: str) -> float:
+        ts = time.time()
+        self._remember(key, ts, content)
+        with self._lock:
+            self.stats["stores"] += 1
+        return ts
+
+    def put_disk(self, key: str, ts: float, content: str, model: str = "") -> None:
+        """Blockierend (SQLite) – aus async-Code nur über den Threadpool."""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO llm_cache (key, ts, model, content) VALUES (?, ?, ?, ?)",
+            (key, ts, model, content),
+        )
+
+    def _remember(self, key: str, ts: float, content: str) -> None:
+        with self._lock:
+            self._mem[key] = (ts, content)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            s = {"entries_memory": len(self._mem), "max_entries": self.max_entries,
+                 "ttl_seconds": self.ttl, "disk": bool(self.path), **self.stats}
+        hits = s["hits_memory"] + s["hits_disk"]
+        s["hit_rate"] = round(hits / (hits + s["misses"]), 4) if hits + s["misses"] else 0.0
+        return s
+
+llm_cache = LLMCache()
+
+async def lookup(model: str, messages: list[dict], params: dict) -> tuple[str | None, str | None]:
+    """(Schlüssel, Treffer). Schlüssel None = Aufruf ist nicht cachebar.
+
+    Nur deterministische Aufrufe (temperature 0) werden gecacht.
+    """
+    if not LLM_CACHE or params.get("temperature", 1.0) != 0:
+        return None, None
+    key = cache_key(model, messages, **params)
+    hit = llm_cache.get_memory(key)
+    if hit is None and llm_cache.path:
+        hit = await run_in_threadpool(llm_cache.get_disk, key)
+    if hit is None:
+        llm_cache.miss()
+    return key, hit
+
+async def store(key: str | None, content: str | None, model: str, params: dict) -> None:
+    """Antwort ablegen; bei response_format json_object nur parsebares JSON."""
+    if key is None or not content:
+        return
+    if (params.get("response_format") or {}).get("type") == "json_object":
+        try:
+            json.loads(content)
+        except ValueError:
+            return
+    ts = llm_cache.put_memory(key, content)
+    if llm_cache.path:
+        await run_in_threadpool(llm_cache.put_disk, key, ts, content, model)
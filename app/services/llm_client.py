@@ -0,0 +1,185 @@
+import importlib.util
+import os
+import threading
+import time
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from app.services import llm_cache, llm_resilience, llm_tracing, prompt_templates, token_budget
+from app.services.llm_limiter import limiter, INTERACTIVE
+from app.utils.single_flight import SingleFlight
+
+# -----------------------------------------------------
+# Gemeinsamer LLM-Client (ein Verbindungspool für die ganze App)
+# -----------------------------------------------------
+# main.py, billing_routes und lv_matcher holen sich den Client hier statt
+# je einen eigenen AsyncOpenAI zu bauen. Ein httpx-Pool mit langem
+# Keep-Alive hält TLS-Verbindungen zu OpenRouter über Leerlaufphasen
+# hinweg offen; HTTP/2, sobald das Paket "h2" installiert ist.
+#
+# chat_completion() ist der einzige Weg zum Modell:
+#   Cache → Token-Budget → Single-Flight → Limiter → Deadline/Retry/Breaker
+#   (llm_resilience) → Upstream.
+# Der Slot wird vor der Resilience-Schicht geholt und über Retries gehalten:
+# Wartezeit in der Warteschlange verbraucht zwar die Deadline, läuft sie
+# dort ab, kommt aber 429 (LLMBusy) statt eines Breaker-Fehlers.
+# Tracing (llm_tracing) zeichnet außen herum auf, nur wenn eingeschaltet.
+# Das SDK selbst wiederholt nichts (max_retries=0), sonst zählte der
+# Breaker falsch und Retries multiplizierten sich.
+
+load_dotenv()
+
+LLM_BASE_URL        = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE   = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "300"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT    = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+_lock = threading.Lock()
+_client = None
+_flights = SingleFlight()
+
+def _build():
+    http_client = httpx.AsyncClient(
+        http2=_HTTP2,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=LLM_BASE_URL,
+        http_client=http_client,
+        max_retries=0,
+    )
+
+def get_client():
+    """Der eine AsyncOpenAI-Client der App (lazy, damit .env vorher geladen ist)."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build()
+    return _client
+
+async def _once(model: str, messages: list[dict], params: dict, budget: float,
+                estimated: int) -> str:
+    resp = await get_client().chat.completions.create(
+        model=model, messages=messages, timeout=budget, **params)
+    usage = getattr(resp, "usage", None)
+    prompt_templates.record_usage(messages, usage)
+    token_budget.record(model, messages, estimated, usage)
+    return resp.choices[0].message.content
+
+async def _fetch(model: str, messages: list[dict], timeout: float | None, priority: int,
+                 params: dict, key: str | None, estimated: int) -> str:
+    deadline = time.monotonic() + (timeout or llm_resilience.LLM_DEADLINE_SECONDS)
+    async with limiter.slot(priority, deadline):
+        content = await llm_resilience.call(
+            lambda budget: _once(model, messages, params, budget, estimated),
+            model=model, deadline=deadline, can_hedge=limiter.idle,
+            hedge_slot=lambda: limiter.slot(priority, deadline),
+        )
+    await llm_cache.store(key, content, model, params)
+    return content
+
+async def _complete(model: str, messages: list[dict], timeout: float | None, priority: int,
+                    params: dict) -> str:
+    key, hit = await llm_cache.lookup(model, messages, params)
+    if hit is not None:
+        return hit
+    estimated = token_budget.preflight(model, messages, params)
+    # identische Aufrufe, die gerade laufen, teilen sich einen Upstream-Aufruf
+    # (Deadline/Priorität des ersten gelten dann für alle)
+    flight = key or llm_cache.cache_key(model, messages, **params)
+    content, _ = await _flights.do(
+        flight, lambda: _fetch(model, messages, timeout, priority, params, key, estimated))
+    return content
+
+async def chat_completion(*, model: str, messages: list[dict], timeout: float | None = None,
+                          priority: int = INTERACTIVE, **params) -> str:
+    """Antworttext einer Chat-Completion.
+
+    timeout  = Deadline für diesen Aufruf in Sekunden, alle Versuche zusammen
+    priority = Rang in der Warteschlange (llm_limiter.INTERACTIVE / BATCH)
+    """
+    if not llm_tracing.sampled():
+        return await _complete(model, messages, timeout, priority, params)
+    start = time.time()
+    try:
+        content = await _complete(model, messages, timeout, priority, params)
+    except Exception as e:
+        _trace("chat_completion", model, messages, params, None, start, priority, e)
+        raise
+    _trace("chat_completion", model, messages, params, content, start, priority)
+    return content
+
+def _trace(name: str, model: str, messages: list[dict], params: dict, output: str | None,
+           start: float, priority: int, error: BaseException | None = None) -> None:
+    llm_tracing.record(name, model=model, messages=messages, params=params, output=output,
+                       start=start, end=time.time(), error=error, priority=priority)
+
+async def _stream_once(model: str, messages: list[dict], params: dict, budget: float,
+                       estimated: int):
+    stream = await get_client().chat.completions.create(
+        model=model, messages=messages, timeout=budget, stream=True,
+        stream_options={"include_usage": True}, **params)
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        if getattr(chunk, "usage", None) is not None:
+            prompt_templates.record_usage(messages, chunk.usage)
+            token_budget.record(model, messages, estimated, chunk.usage)
+
+async def _stream(model: str, messages: list[dict], timeout: float | None, priority: int,
+                  params: dict):
+    key, hit = await llm_cache.lookup(model, messages, params)
+    if hit is not None:
+        yield hit
+        return
+    estimated = token_budget.preflight(model, messages, params)
+    deadline = time.monotonic() + (timeout or llm_resilience.LLM_DEADLINE_SECONDS)
+    parts = []
+    # Slot bleibt belegt, bis der Stream zu Ende gelesen ist
+    async with limiter.slot(priority, deadline):
+        async for piece in llm_resilience.stream(
+                lambda budget: _stream_once(model, messages, params, budget, estimated),
+                model=model, deadline=deadline):
+            parts.append(piece)
+            yield piece
+    await llm_cache.store(key, "".join(parts), model, params)
+
+async def stream_completion(*, model: str, messages: list[dict], timeout: float | None = None,
+                            priority: int = INTERACTIVE, **params):
+    """Wie chat_completion(), liefert den Antworttext aber stückweise (Async-Generator).
+
+    Cache-Treffer kommen als ein Stück; vollständige Antworten werden gecacht.
+    """
+    gen = _stream(model, messages, timeout, priority, params)
+    if not llm_tracing.sampled():
+        async for piece in gen:
+            yield piece
+        return
+    start = time.time()
+    parts = []
+    try:
+        async for piece in gen:
+            parts.append(piece)
+            yield piece
+    except Exception as e:
+        _trace("stream_completion", model, messages, params, "".join(parts) or None, start, priority, e)
+        raise
+    _trace("stream_completion", model, messages, params, "".join(parts), start, priority)
+
+def stats() -> dict:
+    return {"http2": _HTTP2, "max_connections": LLM_MAX_CONNECTIONS,
+            "max_keepalive": LLM_MAX_KEEPALIVE, "keepalive_seconds": LLM_KEEPALIVE_SECONDS,
+            "initialized": _client is not None, "single_flight": _flights.snapshot()}
@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+# -----------------------------------------------------
+# Begrenzung gleichzeitiger LLM-Aufrufe
+# -----------------------------------------------------
+# Alle Aufrufe an das Modell (llm_client.chat_completion) holen sich hier
+# einen Slot. Höchstens LLM_MAX_CONCURRENCY laufen gleichzeitig, optional
+# zusätzlich gedrosselt durch einen Token-Bucket (LLM_RATE_PER_SEC).
+# Wartende werden nach Priorität bedient (kleiner = früher), damit
+# interaktive Add/Edit/Remove-Aufrufe nicht hinter dem LV-Abgleich hängen.
+# Ist die Warteschlange voll (LLM_MAX_QUEUE), kommt sofort 429; ebenso,
+# wenn die Deadline des Aufrufs schon in der Warteschlange abläuft. Das
+# ist lokale Auslastung und zählt nie für den Circuit-Breaker.
+#
+# Ein Limiter pro Worker-Prozess und Event-Loop.
+
+INTERACTIVE = 0
+BATCH       = 10
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE       = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_RATE_PER_SEC    = float(os.getenv("LLM_RATE_PER_SEC", "0"))      # 0 = ohne Token-Bucket
+LLM_RATE_BURST      = int(os.getenv("LLM_RATE_BURST", str(max(1, LLM_MAX_CONCURRENCY))))
+
+class LLMBusy(HTTPException):
+    """Warteschlange für LLM-Aufrufe ist voll."""
+
+    def __init__(self, retry_after: int = 2):
+        super().__init__(429, "LLM ausgelastet – bitte in Kürze erneut versuchen.",
+                         headers={"Retry-After": str(retry_after)})
+
+class LLMLimiter:
+    def __init__(self, concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 rate: float = LLM_RATE_PER_SEC, burst: int = LLM_RATE_BURST):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refill_ts = time.monotonic()
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._queued: dict[int, int] = {}
+        self._seq = itertools.count()
+        self.stats = {"granted": 0, "rejected": 0, "timed_out": 0, "max_queue_seen": 0,
+                      "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, deadline: float | None = None):
+        """deadline = time.monotonic()-Zeitpunkt, bis zu dem höchstens gewartet wird."""
+        t0 = time.monotonic()
+        try:
+            await self._acquire(priority, None if deadline is None else max(0.0, deadline - t0))
+        except asyncio.TimeoutError:
+            self.stats["timed_out"] += 1
+            raise LLMBusy() from None
+        try:
+            await self._take_token()
+            waited = (time.monotonic() - t0) * 1000
+            self.stats["granted"] += 1
+            self.stats["wait_ms_total"] += waited
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], waited)
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int, timeout: float | None = None) -> None:
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            return
+        if sum(self._queued.values()) >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise LLMBusy()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._queued[priority] = self._queued.get(priority, 0) + 1
+        self.stats["max_queue_seen"] = max(self.stats["max_queue_seen"], sum(self._queued.values()))
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if fut.done() and not fut.cancelled():
+                self._release()          # Slot war schon übergeben
+            else:
+                self._queued[priority] -= 1
+            raise
+
+    def _release(self) -> None:
+        # Slot direkt an den nächsten (nicht abgebrochenen) Wartenden weitergeben
+        while self._waiters:
+            prio, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._queued[prio] -= 1
+            fut.set_result(None)
+            return
+        self._active -= 1
+
+    def idle(self) -> bool:
+        """Freier Slot ohne Wartende (z. B. für Hedge-Aufrufe)."""
+        return self._active < self.concurrency and not self._waiters
+
+    async def _take_token(self) -> None:
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refill_ts) * self.rate)
+            self._refill_ts = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def snapshot(self) -> dict:
+        return {"in_flight": self._active, "queued": sum(self._queued.values()),
+                "queued_by_priority": {str(p): n for p, n in self._queued.items() if n},
+                "concurrency": self.concurrency, "max_queue": self.max_queue,
+                "rate_per_sec": self.rate, **self.stats}
+
+limiter = LLMLimiter()
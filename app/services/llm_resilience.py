@@ -0,0 +1,296 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+import openai
+from fastapi import HTTPException
+
+# -----------------------------------------------------
+# Deadlines, Retries, Hedging und Circuit-Breaker für LLM-Aufrufe
+# -----------------------------------------------------
+# llm_client.chat_completion() reicht jeden Upstream-Aufruf durch call():
+#   • Deadline: Gesamtbudget pro Aufruf (timeout-Argument bzw.
+#     LLM_DEADLINE_SECONDS), gilt über alle Versuche inkl. Wartezeit
+#   • Retries: vorübergehende Fehler (Timeout, Verbindung, 408/409/429/5xx)
+#     bis zu LLM_RETRIES-mal, Backoff exponentiell mit Full Jitter
+#   • Hedging (LLM_HEDGE=1): läuft ein Versuch länger als das p95 der
+#     letzten Antworten dieses Modells, startet ein zweiter; der schnellere
+#     gewinnt, der andere wird abgebrochen
+#   • Der Limiter-Slot wird vom Aufrufer außerhalb geholt – Wartezeit in der
+#     lokalen Warteschlange ist kein Fehler des Providers
+#   • Circuit-Breaker: nach LLM_BREAKER_FAILURES Fehlern in Folge wird
+#     LLM_BREAKER_COOLDOWN Sekunden lang sofort mit 503 abgelehnt, danach
+#     entscheidet ein einzelner Probe-Aufruf
+# stream() macht dasselbe für gestreamte Antworten (ohne Hedging).
+#
+# Zustand pro Worker-Prozess, wie beim Limiter.
+
+LLM_DEADLINE_SECONDS  = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+LLM_RETRIES           = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF_BASE      = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX       = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_HEDGE             = os.getenv("LLM_HEDGE", "0") not in ("0", "false", "no")
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_BREAKER_FAILURES  = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN  = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+class LLMUnavailable(HTTPException):
+    """Circuit-Breaker offen – Provider gilt als gestört."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(503, "LLM-Provider derzeit gestört – bitte später erneut versuchen.",
+                         headers={"Retry-After": str(max(1, int(retry_after + 0.999)))})
+
+class LLMTimeout(HTTPException):
+    def __init__(self):
+        super().__init__(504, "LLM hat nicht rechtzeitig geantwortet.")
+
+class LLMUpstreamError(HTTPException):
+    def __init__(self, exc: Exception):
+        super().__init__(502, f"LLM-Fehler: {exc}")
+
+_RETRY_STATUS = {408, 409, 429}
+
+def _retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, openai.APIConnectionError)):   # inkl. APITimeoutError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in _RETRY_STATUS or exc.status_code >= 500
+    return False
+
+def _is_timeout(exc: BaseException | None) -> bool:
+    return isinstance(exc, (asyncio.TimeoutError, openai.APITimeoutError))
+
+def _backoff(attempt: int, exc: BaseException) -> float:
+    pause = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    # 429 mit Retry-After: nicht früher wiederkommen als verlangt
+    if isinstance(exc, openai.APIStatusError):
+        try:
+            pause = max(pause, float(exc.response.headers.get("retry-after", 0)))
+        except (TypeError, ValueError):
+            pass
+    return pause
+
+# -----------------------------------------------------
+# Latenzfenster (p95 pro Modell)
+# -----------------------------------------------------
+class LatencyWindow:
+    def __init__(self, size: int = 200, min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        self.size = size
+        self.min_samples = min_samples
+        self._by_model: dict[str, deque] = {}
+
+    def add(self, model: str, seconds: float) -> None:
+        self._by_model.setdefault(model, deque(maxlen=self.size)).append(seconds)
+
+    def p95(self, model: str) -> float | None:
+        xs = self._by_model.get(model)
+        if not xs or len(xs) < self.min_samples:
+            return None
+        xs = sorted(xs)
+        return xs[int(0.95 * (len(xs) - 1))]
+
+    def snapshot(self) -> dict:
+        out = {}
+        for model, xs in self._by_model.items():
+            s = sorted(xs)
+            out[model] = {"samples": len(s), "p50_ms": round(s[len(s) // 2] * 1000),
+                          "p95_ms": round(s[int(0.95 * (len(s) - 1))] * 1000)}
+        return out
+
+# -----------------------------------------------------
+# Circuit-Breaker
+# -----------------------------------------------------
+class CircuitBreaker:
+    def __init__(self, threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"            # closed | open | half_open
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def before(self) -> None:
+        """Vor jedem Versuch; wirft LLMUnavailable, solange offen."""
+        if self.state == "open":
+            left = self.cooldown - (time.monotonic() - self._opened_at)
+            if left > 0:
+                self.stats["rejected"] += 1
+                raise LLMUnavailable(left)
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            if self._probing:
+                self.stats["rejected"] += 1
+                raise LLMUnavailable(1)
+            self._probing = True
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or (self.threshold and self.failures >= self.threshold):
+            if self.state != "open":
+                self.stats["opened"] += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+    def abandon(self) -> None:
+        # Versuch ohne Aussage über den Provider (Abbruch, 4xx) → Probe freigeben
+        self._probing = False
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures,
+                "threshold": self.threshold, "cooldown_seconds": self.cooldown, **self.stats}
+
+latency = LatencyWindow()
+breaker = CircuitBreaker()
+_stats = {"calls": 0, "streams": 0, "retries": 0, "hedges": 0, "hedges_won": 0,
+          "timeouts": 0, "upstream_errors": 0}
+
+# -----------------------------------------------------
+# Einstieg
+# -----------------------------------------------------
+async def _attempt(fn, model: str, budget: float, can_hedge, hedge_slot) -> str:
+    end = time.monotonic() + budget
+
+    async def timed(b: float):
+        t0 = time.monotonic()
+        result = await fn(b)
+        latency.add(model, time.monotonic() - t0)
+        return result
+
+    async def hedged(b: float):
+        if hedge_slot is None:
+            return await timed(b)
+        async with hedge_slot():
+            return await timed(end - time.monotonic())
+
+    tasks = [asyncio.ensure_future(timed(budget))]
+    try:
+        delay = latency.p95(model) if LLM_HEDGE else None
+        if delay is not None and delay < budget:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and can_hedge() and breaker.state == "closed":
+                _stats["hedges"] += 1
+                tasks.append(asyncio.ensure_future(hedged(end - time.monotonic())))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, end - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+            for t in done:
+                if t.exception() is None:
+                    if t is not tasks[0]:
+                        _stats["hedges_won"] += 1
+                    return t.result()
+        raise tasks[0].exception()
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+async def call(fn, *, model: str, deadline: float, can_hedge=lambda: True, hedge_slot=None) -> str:
+    """fn(budget) liefert die Coroutine eines einzelnen Versuchs.
+
+    deadline   = time.monotonic()-Zeitpunkt, bis zu dem alles fertig sein muss
+    hedge_slot = () → Async-Contextmanager, den ein Hedge-Versuch zusätzlich belegt
+    """
+    _stats["calls"] += 1
+    last: BaseException | None = None
+    for attempt in range(LLM_RETRIES + 1):
+        budget = deadline - time.monotonic()
+        if budget <= 0:
+            break
+        breaker.before()
+        try:
+            result = await _attempt(fn, model, budget, can_hedge, hedge_slot)
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as e:
+            if not _retryable(e):
+                breaker.abandon()
+                if isinstance(e, openai.APIStatusError):
+                    raise LLMUpstreamError(e) from e
+                raise
+            breaker.failure()
+            last = e
+            if attempt == LLM_RETRIES:
+                break
+            pause = _backoff(attempt, e)
+            if time.monotonic() + pause >= deadline:
+                break
+            _stats["retries"] += 1
+            await asyncio.sleep(pause)
+            continue
+        breaker.success()
+        return result
+
+    _give_up(last)
+
+async def stream(fn, *, model: str, deadline: float):
+    """Wie call(), aber fn(budget) ist ein Async-Generator von Textstücken.
+
+    Wiederholt wird nur, solange noch nichts weitergereicht wurde; kein Hedging.
+    """
+    _stats["streams"] += 1
+    last: BaseException | None = None
+    for attempt in range(LLM_RETRIES + 1):
+        budget = deadline - time.monotonic()
+        if budget <= 0:
+            break
+        breaker.before()
+        gen = fn(budget)
+        sent = False
+        try:
+            while True:
+                try:
+                    piece = await asyncio.wait_for(gen.__anext__(), max(0.0, deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                sent = True
+                yield piece
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.abandon()
+            raise
+        except Exception as e:
+            if not _retryable(e):
+                breaker.abandon()
+                if isinstance(e, openai.APIStatusError):
+                    raise LLMUpstreamError(e) from e
+                raise
+            breaker.failure()
+            last = e
+            if sent or attempt == LLM_RETRIES:
+                break
+            pause = _backoff(attempt, e)
+            if time.monotonic() + pause >= deadline:
+                break
+            _stats["retries"] += 1
+            await asyncio.sleep(pause)
+            continue
+        finally:
+            await gen.aclose()
+        breaker.success()
+        return
+    _give_up(last)
+
+def _give_up(last: BaseException | None):
+    if last is None or _is_timeout(last):
+        _stats["timeouts"] += 1
+        raise LLMTimeout()
+    _stats["upstream_errors"] += 1
+    raise LLMUpstreamError(last)
+
+def snapshot() -> dict:
+    return {**_stats, "max_retries": LLM_RETRIES, "deadline_seconds": LLM_DEADLINE_SECONDS,
+            "hedge": LLM_HEDGE, "breaker": breaker.snapshot(), "latency": latency.snapshot()}
@@ -0,0 +1,272 @@
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.services.llm_cache import cache_key
+from app.services.prompt_context import estimate_tokens
+
+# -----------------------------------------------------
+# OpenAI-kompatibler LLM-Stub (Record/Replay, ohne Netz)
+# -----------------------------------------------------
+# Beantwortet POST …/chat/completions aus einer Aufnahmedatei (JSONL,
+# eine Zeile je Antwort). Schlüssel = llm_cache.cache_key über Modell,
+# Nachrichten und Parameter – derselbe Hash wie beim Antwort-Cache.
+# Die App merkt davon nichts, umgestellt wird nur die Base-URL:
+#
+#   python -m app.services.llm_stub --recordings temp/llm_recordings.jsonl \
+#          --latency lognormal:0.8,0.4 --port 8099
+#   LLM_BASE_URL=http://127.0.0.1:8099/v1 uvicorn main:app
+#
+# Aufnehmen: mit --upstream https://openrouter.ai/api/v1 werden unbekannte
+# Anfragen (mit dem Authorization-Header der App) weitergereicht und die
+# Antworten angehängt. Ohne Upstream: unbekannt → 404, oder --default als
+# feste Antwort (für reine Durchsatzmessungen).
+#
+# Latenz (--latency): fixed:S | uniform:A,B | normal:MU,SIGMA | lognormal:MEDIAN,SIGMA
+# in Sekunden, mit --seed reproduzierbar. Bei stream=true kommt die Antwort
+# danach in Stücken (--chunk-delay dazwischen). usage enthält geschätzte
+# Tokens; eine schon gesehene system-Nachricht gilt als gecacht (Prefix-Cache).
+#
+# In Tests wie FakeRedisServer:
+#   stub = LLMStubServer(recordings=…).start();  …  stub.stop()
+
+_IGNORED = ("stream", "stream_options", "user")
+
+def request_key(body: dict) -> str:
+    params = {k: v for k, v in body.items() if k not in ("model", "messages", *_IGNORED)}
+    return cache_key(body.get("model", ""), body.get("messages") or [], **params)
+
+def parse_latency(spec: str | None):
+    """'lognormal:0.8,0.4' → Funktion rng → Sekunden."""
+    if not spec:
+        return lambda rng: 0.0
+    kind, _, args = spec.partition(":")
+    a = [float(x) for x in args.split(",") if x]
+    if kind == "fixed":
+        return lambda rng: a[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(a[0], a[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(a[0], a[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(a[0]), a[1])
+    raise ValueError(f"Unbekannte Latenzverteilung: {spec}")
+
+class _Recordings:
+    def __init__(self, path: str | None):
+        self.path = path
+        self._data: dict[str, str] = {}
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            rec = json.loads(line)
+                            self._data[rec["key"]] = rec["content"]
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str) -> str | None:
+        return self._data.get(key)
+
+    def add(self, key: str, model: str, content: str) -> None:
+        with self._lock:
+            self._data[key] = content
+            if self.path:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "model": model, "content": content},
+                                       ensure_ascii=False) + "\n")
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._json(200, self.server.snapshot())
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        srv: LLMStubServer = self.server
+        key = request_key(body)
+        content = srv.recordings.get(key)
+        if content is not None:
+            srv.count("hits")
+        elif srv.upstream:
+            try:
+                content = srv.forward(body, self.headers.get("Authorization"))
+            except urllib.error.HTTPError as e:
+                srv.count("upstream_errors")
+                return self._json(e.code, json.loads(e.read() or b"{}"))
+            srv.recordings.add(key, body.get("model", ""), content)
+            srv.count("recorded")
+        elif srv.default is not None:
+            content = srv.default
+            srv.count("defaults")
+        else:
+            srv.count("misses")
+            return self._json(404, {"error": {"message": f"keine Aufnahme für {key}",
+                                              "type": "stub_miss"}})
+
+        time.sleep(srv.delay())
+        usage = _usage(body, content, srv.cached_prefix(body))
+        if body.get("stream"):
+            self._stream(body, content, usage)
+        else:
+            self._json(200, _completion(body, content, usage))
+
+    def _json(self, status: int, data: dict) -> None:
+        raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _stream(self, body: dict, content: str, usage: dict) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        step = self.server.chunk_chars
+        for i in range(0, len(content), step):
+            if i:
+                time.sleep(self.server.chunk_delay)
+            self._chunk(_chunk(cid, body, {"content": content[i:i + step]}, None))
+        self._chunk(_chunk(cid, body, {}, "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._chunk({**_chunk(cid, body, {}, None), "choices": [], "usage": usage})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _chunk(self, data: dict) -> None:
+        self._write_chunk(b"data: " + json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n\n")
+
+    def _write_chunk(self, raw: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(raw), raw))
+        self.wfile.flush()
+
+def _usage(body: dict, content: str, cached: int) -> dict:
+    prompt = sum(estimate_tokens(m.get("content") or "") for m in body.get("messages") or [])
+    completion = estimate_tokens(content)
+    return {"prompt_tokens": prompt, "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "prompt_tokens_details": {"cached_tokens": cached}}
+
+def _completion(body: dict, content: str, usage: dict) -> dict:
+    return {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+            "created": int(time.time()), "model": body.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": usage}
+
+def _chunk(cid: str, body: dict, delta: dict, finish: str | None) -> dict:
+    return {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+class LLMStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, recordings: str | None = None,
+                 upstream: str | None = None, default: str | None = None, latency: str | None = None,
+                 seed: int | None = None, chunk_chars: int = 16, chunk_delay: float = 0.0):
+        super().__init__((host, port), _Handler)
+        self.recordings = _Recordings(recordings)
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.default = default
+        self.chunk_chars = max(1, chunk_chars)
+        self.chunk_delay = chunk_delay
+        self._latency = parse_latency(latency)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._prefixes: set[str] = set()
+        self._thread: threading.Thread | None = None
+        self.stats = {"hits": 0, "misses": 0, "defaults": 0, "recorded": 0, "upstream_errors": 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def delay(self) -> float:
+        with self._lock:
+            return self._latency(self._rng)
+
+    def cached_prefix(self, body: dict) -> int:
+        """Prefix-Caching nachbilden: bekannte system-Nachricht zählt als gecacht."""
+        msgs = body.get("messages") or []
+        if not msgs or msgs[0].get("role") != "system":
+            return 0
+        static = msgs[0].get("content") or ""
+        with self._lock:
+            seen = static in self._prefixes
+            self._prefixes.add(static)
+        return estimate_tokens(static) if seen else 0
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def forward(self, body: dict, auth: str | None) -> str:
+        """Anfrage ohne Streaming an den echten Provider; liefert den Antworttext."""
+        req = urllib.request.Request(
+            f"{self.upstream}/chat/completions",
+            data=json.dumps({**body, "stream": False}).encode("utf-8"),
+            headers={"Content-Type": "application/json", **({"Authorization": auth} if auth else {})},
+        )
+        with urllib.request.urlopen(req, timeout=120) as r:
+            return json.loads(r.read())["choices"][0]["message"]["content"]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"recordings": len(self.recordings), **self.stats}
+
+    def start(self) -> "LLMStubServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="llm-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="OpenAI-kompatibler Record/Replay-Stub")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--recordings", default="temp/llm_recordings.jsonl")
+    ap.add_argument("--upstream", help="aufnehmen: unbekannte Anfragen hierhin weiterreichen")
+    ap.add_argument("--default", help="Antworttext für unbekannte Anfragen (statt 404)")
+    ap.add_argument("--latency", help="z. B. fixed:0.5 oder lognormal:0.8,0.4")
+    ap.add_argument("--seed", type=int)
+    ap.add_argument("--chunk-chars", type=int, default=16)
+    ap.add_argument("--chunk-delay", type=float, default=0.0)
+    a = ap.parse_args()
+    srv = LLMStubServer(a.host, a.port, recordings=a.recordings, upstream=a.upstream,
+                        default=a.default, latency=a.latency, seed=a.seed,
+                        chunk_chars=a.chunk_chars, chunk_delay=a.chunk_delay)
+    print(f"LLM-Stub auf {srv.url} ({len(srv.recordings)} Aufnahmen)")
+    srv.serve_forever()
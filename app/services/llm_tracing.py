@@ -0,0 +1,92 @@
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+# -----------------------------------------------------
+# LangSmith-Tracing der LLM-Aufrufe (opt-in, gesampelt, im Hintergrund)
+# -----------------------------------------------------
+# Standard ist aus: dann kostet ein LLM-Aufruf genau eine Abfrage von
+# sampled(), kein Wrapper um den Client, keine Serialisierung.
+# Eingeschaltet (LLM_TRACING=1 oder LANGSMITH_TRACING=true in der Umgebung)
+# wird nur ein Anteil LLM_TRACE_SAMPLE der Aufrufe aufgezeichnet. Die Runs
+# landen in einer begrenzten Queue (LLM_TRACE_QUEUE); ein Daemon-Thread
+# schickt sie an LangSmith. Ist die Queue voll, wird verworfen statt
+# gewartet – Requests blockieren nie am Tracing.
+#
+# Endpoint/Key/Projekt wie gehabt über LANGSMITH_ENDPOINT, LANGSMITH_API_KEY,
+# LANGSMITH_PROJECT.
+
+load_dotenv()
+
+_ON = ("1", "true", "yes", "on")
+
+LLM_TRACING      = os.getenv("LLM_TRACING", os.getenv("LANGSMITH_TRACING", "false")).lower() in _ON
+LLM_TRACE_SAMPLE = float(os.getenv("LLM_TRACE_SAMPLE", "1.0"))
+LLM_TRACE_QUEUE  = int(os.getenv("LLM_TRACE_QUEUE", "1000"))
+
+log = logging.getLogger(__name__)
+
+_queue: queue.Queue = queue.Queue(maxsize=max(1, LLM_TRACE_QUEUE))
+_lock = threading.Lock()
+_worker: threading.Thread | None = None
+_stats = {"sampled": 0, "exported": 0, "dropped": 0, "failed": 0}
+
+def sampled() -> bool:
+    """Diesen Aufruf aufzeichnen?"""
+    if not LLM_TRACING:
+        return False
+    return LLM_TRACE_SAMPLE >= 1 or random.random() < LLM_TRACE_SAMPLE
+
+def record(name: str, *, model: str, messages: list[dict], params: dict, output: str | None,
+           start: float, end: float, error: BaseException | None = None, **metadata) -> None:
+    """Run einreihen (start/end = time.time()); bei voller Queue verwerfen."""
+    run = {"name": name, "model": model, "messages": messages, "params": params,
+           "output": output, "start": start, "end": end,
+           "error": repr(error) if error is not None else None, "metadata": metadata}
+    try:
+        _queue.put_nowait(run)
+    except queue.Full:
+        _stats["dropped"] += 1
+        return
+    _stats["sampled"] += 1
+    _ensure_worker()
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is not None:
+        return
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_export_loop, name="llm-tracing", daemon=True)
+            _worker.start()
+
+def _ts(t: float) -> datetime:
+    return datetime.fromtimestamp(t, tz=timezone.utc)
+
+def _export_loop() -> None:
+    from langsmith import Client           # erst hier – ohne Tracing wird nichts geladen
+    client = Client()
+    project = os.getenv("LANGSMITH_PROJECT")
+    while True:
+        run = _queue.get()
+        try:
+            client.create_run(
+                name=run["name"], run_type="llm", project_name=project,
+                inputs={"messages": run["messages"], "model": run["model"], **run["params"]},
+                outputs={"content": run["output"]} if run["output"] is not None else None,
+                error=run["error"], start_time=_ts(run["start"]), end_time=_ts(run["end"]),
+                extra={"metadata": {"ls_model_name": run["model"], **run["metadata"]}},
+            )
+            _stats["exported"] += 1
+        except Exception:
+            _stats["failed"] += 1
+            log.debug("LangSmith-Export fehlgeschlagen", exc_info=True)
+
+def stats() -> dict:
+    return {"enabled": LLM_TRACING, "sample_rate": LLM_TRACE_SAMPLE, "queue_max": LLM_TRACE_QUEUE,
+            "queued": _queue.qsize(), **_stats}
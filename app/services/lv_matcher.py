@@ -6,30 +6,19 @@ from pathlib import Path
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 
-from openai import AsyncOpenAI
 
 from app.services.lv_loader import load_lv
-
-from langsmith.wrappers import wrap_openai
+from app.services import prompt_templates, model_router, token_budget
+from app.services.llm_limiter import BATCH
 
 # Lädt automatisch die .env-Datei aus dem aktuellen Verzeichnis
 load_dotenv()
 
-# Langsmith-key
-os.environ["LANGSMITH_TRACING"] = "true"
-os.environ["LANGSMITH_ENDPOINT"] = "https://api.smith.langchain.com"
-os.getenv("LANGSMITH_API_KEY")
-os.getenv("LANGSMITH_PROJECT")
-os.environ["LANGSMITH_DEBUG"] = "true"
-
-# OpenAI-Key
-async_client = wrap_openai(AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://openrouter.ai/api/v1"
-))
-
 CATALOG: List[Dict[str, Any]] = load_lv()
 
+# gleichzeitige Abgleich-Aufrufe je Batch (der globale Limiter begrenzt zusätzlich)
+LV_MATCH_PARALLEL = int(os.getenv("LV_MATCH_PARALLEL", "4"))
+
 # -----------------  simple Vorfilter  ------------------
 def _rough_filter(line: str, *, dims: Dict[str, Any] | None = None, kind: str | None = None) -> List[Dict[str, Any]]:
     """
@@ -83,40 +72,71 @@ Regeln (wichtig):
 }
 """
 
+_PROMPT_MATCH = prompt_templates.register("match-lv", static=SYSTEM_PROMPT, dynamic="""\
+Aufmaßzeile:
+{line}
+
+Hinweise (JSON): {hints}
+
+LV-Auszug (JSON-Liste):
+{catalog}""")
+
 async def _match_line(line: str, hint: Dict[str, Any] | None = None) -> Dict[str, Any]:
     hint = hint or {}
     dims = hint.get("dims") or {}
     kind = hint.get("kind") or _classify_line(line)
 
     cat = _rough_filter(line, dims=dims, kind=kind)
+    hints = json.dumps({'kind': kind, 'dims': dims}, ensure_ascii=False)
 
-    user_prompt = (
-        f"Aufmaßzeile:\n{line}\n\n"
-        f"Hinweise (JSON): {json.dumps({'kind': kind, 'dims': dims}, ensure_ascii=False)}\n\n"
-        f"LV-Auszug (JSON-Liste):\n{json.dumps(cat, ensure_ascii=False)}"
-    )
+    # Kandidaten sind nach Rang sortiert → von hinten kürzen, bis der Prompt ins Budget passt
+    room = token_budget.available(SYSTEM_PROMPT, _PROMPT_MATCH.dynamic, line, hints, max_tokens=500)
+    cat, dropped = token_budget.fit_prefix(cat, lambda c: json.dumps(c, ensure_ascii=False), room)
+    token_budget.trimmed(_PROMPT_MATCH.name, dropped)
 
-    resp = await async_client.chat.completions.create(
-        model="openai/gpt-4o-mini",
-        temperature=0.0,
-        response_format={"type": "json_object"},
-        messages=[{"role": "system", "content": SYSTEM_PROMPT},
-                  {"role": "user", "content": user_prompt}],
-        max_tokens=500,
+    messages = _PROMPT_MATCH.messages(
+        line=line,
+        hints=hints,
+        catalog=json.dumps(cat, ensure_ascii=False),
     )
-    
-    # ---- DEBUG -------------------------------------------------
-    print("Aufmaßzeile:", line)
-    
-    result = json.loads(resp.choices[0].message.content)
-    print("▶︎ GPT-Ergebnis:", json.dumps(result, indent=2, ensure_ascii=False))
-    # ------------------------------------------------------------
-
-    return json.loads(resp.choices[0].message.content)
+    # Baugraben: Regelabgleich über B/T → schnelle Stufe; Rest braucht Semantik
+    route = model_router.route("match", line, simple=(kind == "baugraben"))
+    while True:
+        content = await model_router.complete(
+            route,
+            timeout=30,
+            priority=BATCH,
+            temperature=0.0,
+            response_format={"type": "json_object"},
+            messages=messages,
+            max_tokens=500,
+        )
+        try:
+            result = json.loads(content)
+        except ValueError:
+            result = {}
+        # "match": null ist eine gültige Antwort (keine passende Position) – eskaliert
+        # wird nur, wenn die Ausgabe unbrauchbar ist
+        ok = isinstance(result, dict) and "match" in result
+        model_router.outcome(route, ok)
+        nxt = None if ok else model_router.escalate(route)
+        if nxt is None:
+            break
+        route = nxt
+
+    # auch auf der letzten Stufe unbrauchbar → ohne Treffer zur Prüfung statt 500
+    return {"match": None, "confidence": 0.0, "alternatives": [],
+            **(result if isinstance(result, dict) else {})}
 
 async def best_matches_batch(lines: list[str], hints: list[dict] | None = None) -> list[dict]:
     hints = hints or [{} for _ in lines]
-    return await asyncio.gather(*(_match_line(l, h) for l, h in zip(lines, hints)))
+    # nicht alle Zeilen auf einmal in die LLM-Warteschlange schieben
+    sem = asyncio.Semaphore(LV_MATCH_PARALLEL)
+
+    async def one(l, h):
+        async with sem:
+            return await _match_line(l, h)
+    return await asyncio.gather(*(one(l, h) for l, h in zip(lines, hints)))
 
 def best_matches_batch_sync(lines: List[str], hints: List[dict] | None = None) -> List[Dict[str, Any]]:
     import anyio
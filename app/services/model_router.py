@@ -0,0 +1,138 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from app.services import llm_client
+from app.services.prompt_context import estimate_tokens
+
+# -----------------------------------------------------
+# Modell-Router: schnelle Stufe für einfache, genaue Stufe für komplexe Eingaben
+# -----------------------------------------------------
+# Lokale Einstufung ohne Modellaufruf, nach
+#   • Länge (Token-Schätzung)
+#   • Anzahl genannter Objekte (BG, Rohr, Durchstich …) und Zahlen
+#   • Ordinal-/Mengenwörtern ("zweiter", "alle", "drei" …)
+#   • Aufzählungen ("und", "sowie", Kommas)
+# Score ≤ ROUTER_FAST_MAX_SCORE → Stufe "fast", sonst "accurate".
+# "Tiefe BG 2 auf 1,5 m" landet so beim schnellen Modell.
+#
+# Modelle je Aufgabe und Stufe: LLM_MODEL_<AUFGABE>_<STUFE>, sonst
+# LLM_MODEL_FAST / LLM_MODEL_ACCURATE. Der LV-Abgleich bleibt ohne eigene
+# Konfiguration auf beiden Stufen bei gpt-4o-mini.
+#
+# Ist eine Antwort der schnellen Stufe unbrauchbar, fragt der Aufrufer
+# einmal die genaue Stufe (escalate). Je Aufgabe/Stufe werden Latenz und
+# Trefferquote (brauchbare Antworten) gezählt.
+
+LLM_ROUTER            = os.getenv("LLM_ROUTER", "1") not in ("0", "false", "no")
+ROUTER_FAST_MAX_SCORE = float(os.getenv("ROUTER_FAST_MAX_SCORE", "3"))
+
+FAST, ACCURATE = "fast", "accurate"
+
+LLM_MODEL_FAST     = os.getenv("LLM_MODEL_FAST", "openai/gpt-4o-mini")
+LLM_MODEL_ACCURATE = os.getenv("LLM_MODEL_ACCURATE", "qwen/qwen3-coder")
+
+_DEFAULTS = {
+    "add":    {FAST: LLM_MODEL_FAST, ACCURATE: LLM_MODEL_ACCURATE},
+    "edit":   {FAST: LLM_MODEL_FAST, ACCURATE: LLM_MODEL_ACCURATE},
+    "remove": {FAST: LLM_MODEL_FAST, ACCURATE: LLM_MODEL_ACCURATE},
+    "match":  {FAST: "openai/gpt-4o-mini", ACCURATE: "openai/gpt-4o-mini"},
+}
+
+def _model(task: str, tier: str) -> str:
+    return os.getenv(f"LLM_MODEL_{task.upper()}_{tier.upper()}") or _DEFAULTS[task][tier]
+
+MODELS = {task: {tier: _model(task, tier) for tier in (FAST, ACCURATE)} for task in _DEFAULTS}
+
+# --- Merkmale -------------------------------------------------------------
+_ENTITY   = re.compile(r"\b(?:bg|baugr[aä]ben\w*|rohr\w*|leitung\w*|durchstich\w*|oberfl\w*|"
+                       r"pflaster\w*|platten\w*|verbindung\w*|gok)\b", re.I)
+_NUMBER   = re.compile(r"\d+(?:[.,]\d+)?")
+_ORDINAL  = re.compile(r"\b(?:erst|zweit|dritt|viert|f[uü]nft|sechst|letzt|vorletzt)\w*\b", re.I)
+_QUANTITY = re.compile(r"\b(?:alle|s[aä]mtliche\w*|jeweils|jede[nmrs]?|beide[n]?|mehrere|zwei|drei|"
+                       r"vier|f[uü]nf|sechs|sieben|acht|neun|zehn)\b", re.I)
+_CLAUSE   = re.compile(r"\b(?:und|sowie|au[sß]erdem|dann|danach)\b|;|,(?!\d)", re.I)
+
+def features(text: str) -> dict:
+    t = text or ""
+    return {"tokens": estimate_tokens(t), "entities": len(_ENTITY.findall(t)),
+            "numbers": len(_NUMBER.findall(t)), "ordinals": len(_ORDINAL.findall(t)),
+            "quantities": len(_QUANTITY.findall(t)), "clauses": len(_CLAUSE.findall(t))}
+
+def score(f: dict) -> float:
+    return (f["tokens"] / 12 + max(0, f["entities"] - 1) + max(0, f["numbers"] - 3) * 0.5
+            + 2 * f["ordinals"] + 2 * f["quantities"] + f["clauses"])
+
+class Route:
+    __slots__ = ("task", "tier", "model", "score")
+
+    def __init__(self, task: str, tier: str, score: float):
+        self.task = task
+        self.tier = tier
+        self.model = MODELS[task][tier]
+        self.score = score
+
+def route(task: str, text: str, simple: bool | None = None) -> Route:
+    """Stufe wählen; simple=True/False übersteuert die Einstufung."""
+    s = score(features(text))
+    if not LLM_ROUTER:
+        tier = ACCURATE
+    elif simple is not None:
+        tier = FAST if simple else ACCURATE
+    else:
+        tier = FAST if s <= ROUTER_FAST_MAX_SCORE else ACCURATE
+    _count(task, tier, "requests")
+    return Route(task, tier, s)
+
+def escalate(r: Route) -> Route | None:
+    """Nächsthöhere Stufe – None, wenn es keine (andere) gibt."""
+    if r.tier == ACCURATE or MODELS[r.task][ACCURATE] == r.model:
+        return None
+    _count(r.task, r.tier, "escalated")
+    _count(r.task, ACCURATE, "requests")
+    return Route(r.task, ACCURATE, r.score)
+
+async def complete(r: Route, **kwargs) -> str:
+    """llm_client.chat_completion mit dem Modell der Route; misst die Latenz."""
+    t0 = time.monotonic()
+    content = await llm_client.chat_completion(model=r.model, **kwargs)
+    observe(r, time.monotonic() - t0)
+    return content
+
+# -----------------------------------------------------
+# Zähler je Aufgabe/Stufe
+# -----------------------------------------------------
+_lock = threading.Lock()
+_stats: dict[tuple[str, str], dict] = {}
+_lat: dict[tuple[str, str], deque] = {}
+
+def _slot(task: str, tier: str) -> dict:
+    return _stats.setdefault((task, tier), {"requests": 0, "ok": 0, "failed": 0, "escalated": 0})
+
+def _count(task: str, tier: str, key: str) -> None:
+    with _lock:
+        _slot(task, tier)[key] += 1
+
+def observe(r: Route, seconds: float) -> None:
+    with _lock:
+        _lat.setdefault((r.task, r.tier), deque(maxlen=500)).append(seconds)
+
+def outcome(r: Route, ok: bool) -> None:
+    _count(r.task, r.tier, "ok" if ok else "failed")
+
+def stats() -> dict:
+    out: dict = {"enabled": LLM_ROUTER, "fast_max_score": ROUTER_FAST_MAX_SCORE, "models": MODELS,
+                 "tiers": {}}
+    with _lock:
+        for (task, tier), s in sorted(_stats.items()):
+            lat = sorted(_lat.get((task, tier), ()))
+            judged = s["ok"] + s["failed"]
+            out["tiers"][f"{task}/{tier}"] = {
+                **s,
+                "accuracy": round(s["ok"] / judged, 4) if judged else None,
+                "p50_ms": round(lat[len(lat) // 2] * 1000) if lat else None,
+                "p95_ms": round(lat[int(0.95 * (len(lat) - 1))] * 1000) if lat else None,
+            }
+    return out
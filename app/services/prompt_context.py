@@ -0,0 +1,135 @@
+import json
+import os
+import random
+import re
+import threading
+
+from app.utils.element_index import ElementIndex, Kind, _int
+
+# -----------------------------------------------------
+# Kompakter Bestands-Kontext für Prompts
+# -----------------------------------------------------
+# Statt json.dumps(session, indent=2) (Einrückung, lv_links-Hashes,
+# Aufmaß-Texte …) bekommt das Modell nur, was es zum Anlegen neuer
+# Elemente braucht: Baugräben mit Maßen, vorhandene Rohre/Oberflächen/
+# Durchstiche/Verbindungen und den nächsten freien Baugraben-Index.
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """Grobe Token-Schätzung (BPE-ähnlich): Wortstücke à ~4 Zeichen + Satzzeichen."""
+    n = 0
+    for m in _TOKEN_RE.finditer(text or ""):
+        w = m.group(0)
+        n += (len(w) + 3) // 4 if w[0].isalnum() or w[0] == "_" else 1
+    return n
+
+def _m(v) -> str:
+    # Meter kompakt: 1.5 → "1.5", 2.0 → "2"
+    try:
+        return f"{float(v):g}"
+    except (TypeError, ValueError):
+        return str(v)
+
+def _attrs(e: dict, keys: tuple[str, ...]) -> str:
+    return " ".join(f"{k}={_m(e[k])}" for k in keys if e.get(k) not in (None, ""))
+
+def build_add_context(session: dict, ix: ElementIndex | None = None, max_tokens: int | None = None,
+                      count=estimate_tokens) -> str:
+    """Bestand als Textblock; mit max_tokens werden die ältesten Baugräben samt
+    Rohren/Oberflächen/Durchstichen zusammengefasst, bis der Block passt."""
+    ix = ix or ElementIndex(session.get("elements", []))
+    trenches = ix.of_kind(Kind.TRENCH)
+    next_idx = max((_int(t.get("trench_index")) for t in trenches), default=0) + 1
+
+    head = f"Baugräben: {len(trenches)} (nächster freier trench_index: {next_idx})"
+    rows: list[tuple[int, str]] = []           # (Baugraben, Zeile)
+    for t in trenches:
+        dims = "x".join(_m(t.get(k, 0)) for k in ("length", "width", "depth"))
+        extra = _attrs(t, ("depth_left", "depth_right"))
+        gok = t.get("gok")
+        if gok not in (None, "", 0, 0.0):
+            extra = f"{extra} gok={_m(gok)}".strip()
+        rows.append((_int(t.get("trench_index")), f"- BG {_int(t.get('trench_index'))}: {dims} m {extra}".rstrip()))
+
+    for p in ix.of_kind(Kind.PIPE):
+        span = "full_span" if p.get("full_span") else _attrs(p, ("length",))
+        rows.append((_int(p.get("for_trench")), f"- Rohr BG {_int(p.get('for_trench'))}: "
+                     f"{_attrs(p, ('diameter',))} {span} {_attrs(p, ('offset',))}".rstrip()))
+    for s in ix.of_kind(Kind.SURFACE):
+        rows.append((_int(s.get("for_trench")), f"- Oberfläche BG {_int(s.get('for_trench'))}: "
+                     f"{_attrs(s, ('seq', 'offset', 'length'))} {s.get('material') or ''}".rstrip()))
+    for d in ix.of_kind(Kind.PASS):
+        b = _int(d.get("between"))
+        rows.append((b, f"- Durchstich {b}-{b + 1}: {_attrs(d, ('length',))}".rstrip()))
+    seams = sorted(ix.join_seams())
+    tail = ["- Verbindungen: " + ", ".join(f"{b}-{b + 1}" for b in seams)] if seams else []
+
+    def render(upto: int) -> str:
+        # Zeilen zu Baugräben ≤ upto weglassen (älteste zuerst)
+        kept = [line for bg, line in rows if bg > upto]
+        skipped = [f"- BG bis {upto}: Details ausgelassen (Token-Budget)"] if upto else []
+        return "\n".join([head, *skipped, *kept, *tail])
+
+    text = render(0)
+    if max_tokens is None or count(text) <= max_tokens:
+        return text
+    # kleinste Grenze, bei der der Block passt (Länge fällt mit upto → Bisektion)
+    bounds = sorted({bg for bg, _ in rows})
+    lo, hi = 0, len(bounds) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if count(render(bounds[mid])) <= max_tokens:
+            hi = mid
+        else:
+            lo = mid + 1
+    return render(bounds[lo])
+
+# -----------------------------------------------------
+# Ersparnis-Zähler (für /metrics)
+# -----------------------------------------------------
+# Vergleichsbasis ist der alte Prompt: json.dumps(session, indent=2) mit dem
+# Aufmaß-Block, den jede DXF früher als Element an die Session hängte.
+# Die Schätzung (estimate_tokens) läuft je Request; der exakte Tokenizer
+# nur für einen Anteil PROMPT_SAVING_SAMPLE (Summen gelten für die Stichprobe).
+PROMPT_SAVING_SAMPLE = float(os.getenv("PROMPT_SAVING_SAMPLE", "0.05"))
+
+_lock = threading.Lock()
+_stats = {"requests": 0, "tokens_full": 0, "tokens_compact": 0,
+          "exact_sampled": 0, "exact_full": 0, "exact_compact": 0}
+
+def legacy_payload(session: dict, aufmass: str | None = None) -> str:
+    """Bestand, wie ihn der alte Add-Prompt einbettete."""
+    if aufmass:
+        session = {**session, "elements": [*session.get("elements", []),
+                                           {"type": "aufmass", "text": aufmass}]}
+    return json.dumps(session, indent=2)
+
+def record_saving(session: dict, compact: str, aufmass: str | None = None, count=None) -> dict:
+    """Vergleicht mit dem bisherigen Vollkontext; liefert die Zahlen dieses Requests.
+
+    count = exakter Tokenzähler für die Stichprobe (z. B. token_budget.count_tokens)
+    """
+    full_text = legacy_payload(session, aufmass)
+    full = estimate_tokens(full_text)
+    comp = estimate_tokens(compact)
+    exact = count is not None and (PROMPT_SAVING_SAMPLE >= 1 or random.random() < PROMPT_SAVING_SAMPLE)
+    if exact:
+        exact_full, exact_comp = count(full_text), count(compact)
+    with _lock:
+        _stats["requests"] += 1
+        _stats["tokens_full"] += full
+        _stats["tokens_compact"] += comp
+        if exact:
+            _stats["exact_sampled"] += 1
+            _stats["exact_full"] += exact_full
+            _stats["exact_compact"] += exact_comp
+    return {"tokens_full": full, "tokens_compact": comp, "tokens_saved": full - comp}
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+    s["sample_rate"] = PROMPT_SAVING_SAMPLE
+    s["tokens_saved"] = s["tokens_full"] - s["tokens_compact"]
+    s["exact_saved"] = s["exact_full"] - s["exact_compact"]
+    return s
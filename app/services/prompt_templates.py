@@ -0,0 +1,80 @@
+import threading
+from hashlib import sha256
+
+from app.services.prompt_context import estimate_tokens
+
+# -----------------------------------------------------
+# Prompt-Vorlagen mit statischem Präfix
+# -----------------------------------------------------
+# Provider cachen den Prompt-Anfang (Prefix-Caching), aber nur, wenn er
+# Byte für Byte gleich ist. Jede Vorlage besteht deshalb aus
+#   static  – Regeln/Beispiele, wird nie formatiert → system-Nachricht
+#   dynamic – Sitzungsdaten und Nutzereingabe (str.format) → user-Nachricht
+# Session-spezifisches steht so immer hinten, der lange Regelblock ist bei
+# allen Aufrufen derselben Vorlage identisch.
+#
+# record_usage() ordnet die Usage-Angaben des Providers (prompt_tokens,
+# prompt_tokens_details.cached_tokens) der Vorlage zu → Cache-Quote in /metrics.
+
+class PromptTemplate:
+    def __init__(self, name: str, static: str, dynamic: str):
+        self.name = name
+        self.static = static
+        self.dynamic = dynamic
+        self.static_sha = sha256(static.encode("utf-8")).hexdigest()[:12]
+        self.static_tokens = estimate_tokens(static)
+
+    def messages(self, **values) -> list[dict]:
+        return [
+            {"role": "system", "content": self.static},
+            {"role": "user",   "content": self.dynamic.format(**values)},
+        ]
+
+_registry: dict[str, PromptTemplate] = {}
+_by_static: dict[str, str] = {}
+
+def register(name: str, static: str, dynamic: str) -> PromptTemplate:
+    tpl = PromptTemplate(name, static, dynamic)
+    _registry[name] = tpl
+    _by_static[static] = name
+    return tpl
+
+def get(name: str) -> PromptTemplate:
+    return _registry[name]
+
+# -----------------------------------------------------
+# Cache-Quote aus den Usage-Daten des Providers
+# -----------------------------------------------------
+_lock = threading.Lock()
+_usage: dict[str, dict] = {}
+
+def template_name(messages: list[dict]) -> str:
+    """Vorlage anhand der system-Nachricht; "other" für freie Prompts."""
+    first = messages[0].get("content") if messages and messages[0].get("role") == "system" else None
+    return _by_static.get(first, "other") if first else "other"
+
+def record_usage(messages: list[dict], usage) -> None:
+    if usage is None:
+        return
+    name = template_name(messages)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+    with _lock:
+        u = _usage.setdefault(name, {"responses": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                                     "completion_tokens": 0})
+        u["responses"] += 1
+        u["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        u["cached_tokens"] += cached
+        u["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+def _ratio(u: dict) -> float:
+    return round(u["cached_tokens"] / u["prompt_tokens"], 4) if u["prompt_tokens"] else 0.0
+
+def stats() -> dict:
+    with _lock:
+        usage = {name: {**u, "cached_ratio": _ratio(u)} for name, u in _usage.items()}
+    total = {k: sum(u[k] for u in usage.values())
+             for k in ("responses", "prompt_tokens", "cached_tokens", "completion_tokens")}
+    return {"templates": {name: {"static_sha": t.static_sha, "static_tokens": t.static_tokens}
+                          for name, t in _registry.items()},
+            "usage": usage, "cached_ratio": _ratio(total)}
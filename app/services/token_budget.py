@@ -0,0 +1,121 @@
+import importlib.util
+import os
+import threading
+from collections import deque
+
+from fastapi import HTTPException
+
+from app.services import prompt_templates
+from app.services.prompt_context import estimate_tokens
+
+# -----------------------------------------------------
+# Token-Budget vor dem Aufruf (Pre-Flight)
+# -----------------------------------------------------
+# Prompts werden gezählt, bevor sie den Prozess verlassen:
+#   • LLM_PROMPT_BUDGET – effiziente Obergrenze je Aufruf (Prompt-Tokens).
+#     Aufrufer kürzen ihren variablen Teil deterministisch darauf
+#     (Kandidatenliste nach Rang, älteste Bestandszeilen zuerst).
+#   • LLM_CONTEXT_LIMIT – hartes Kontextfenster des kleinsten Modells.
+#     Prompt + max_tokens darüber → 413, ohne Upstream-Aufruf.
+# Gezählt wird mit tiktoken (o200k_base), falls installiert, sonst mit
+# prompt_context.estimate_tokens. Je Aufruf werden Schätzung und die vom
+# Provider gemeldeten prompt_tokens festgehalten (/metrics).
+
+LLM_PROMPT_BUDGET = int(os.getenv("LLM_PROMPT_BUDGET", "8000"))
+LLM_CONTEXT_LIMIT = int(os.getenv("LLM_CONTEXT_LIMIT", "128000"))
+
+_MSG_OVERHEAD = 4       # Rolle/Trenner je Nachricht (OpenAI-Chatformat)
+
+_TIKTOKEN = importlib.util.find_spec("tiktoken") is not None
+_enc = None
+
+class PromptTooLarge(HTTPException):
+    """Prompt passt auch gekürzt nicht ins Kontextfenster."""
+
+    def __init__(self, tokens: int, limit: int):
+        super().__init__(413, f"Anfrage zu groß für das Modell (~{tokens} Tokens, Limit {limit}).")
+        self.tokens = tokens
+
+def count_tokens(text: str) -> int:
+    global _enc
+    if not _TIKTOKEN:
+        return estimate_tokens(text)
+    if _enc is None:
+        import tiktoken
+        _enc = tiktoken.get_encoding("o200k_base")
+    return len(_enc.encode(text or "", disallowed_special=()))
+
+def count_messages(messages: list[dict]) -> int:
+    return sum(count_tokens(m.get("content") or "") + _MSG_OVERHEAD for m in messages) + 2
+
+def available(*fixed: str, max_tokens: int = 0, budget: int | None = None) -> int:
+    """Tokens, die neben den festen Prompt-Teilen für variablen Kontext bleiben."""
+    cap = min(budget or LLM_PROMPT_BUDGET, LLM_CONTEXT_LIMIT - max_tokens)
+    return max(0, cap - sum(count_tokens(t) for t in fixed) - 2 * _MSG_OVERHEAD - 2)
+
+def fit_prefix(items: list, render, limit: int) -> tuple[list, int]:
+    """Längstes Präfix von `items` (nach Rang sortiert), dessen render() ins Limit passt.
+
+    Liefert (Präfix, Anzahl verworfener Einträge); mindestens ein Eintrag bleibt.
+    """
+    if not items or count_tokens(render(items)) <= limit:
+        return items, 0
+    lo, hi = 1, len(items) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(render(items[:mid])) <= limit:
+            lo = mid
+        else:
+            hi = mid - 1
+    return items[:lo], len(items) - lo
+
+def preflight(model: str, messages: list[dict], params: dict) -> int:
+    """Prompt zählen; über dem harten Limit → PromptTooLarge."""
+    tokens = count_messages(messages)
+    if tokens + int(params.get("max_tokens") or 0) > LLM_CONTEXT_LIMIT:
+        _count(prompt_templates.template_name(messages), "rejected")
+        raise PromptTooLarge(tokens, LLM_CONTEXT_LIMIT)
+    return tokens
+
+# -----------------------------------------------------
+# Zähler je Vorlage: geschätzt vs. tatsächlich, Kürzungen
+# -----------------------------------------------------
+_lock = threading.Lock()
+_stats: dict[str, dict] = {}
+_recent: deque = deque(maxlen=100)
+
+def _slot(name: str) -> dict:
+    return _stats.setdefault(name, {"calls": 0, "estimated": 0, "actual": 0, "trimmed": 0,
+                                    "dropped_items": 0, "rejected": 0})
+
+def _count(name: str, key: str, n: int = 1) -> None:
+    with _lock:
+        _slot(name)[key] += n
+
+def trimmed(name: str, dropped: int) -> None:
+    if dropped:
+        with _lock:
+            s = _slot(name)
+            s["trimmed"] += 1
+            s["dropped_items"] += dropped
+
+def record(model: str, messages: list[dict], estimated: int, usage) -> None:
+    """Schätzung neben die prompt_tokens des Providers legen."""
+    actual = getattr(usage, "prompt_tokens", None) if usage is not None else None
+    if actual is None:
+        return
+    name = prompt_templates.template_name(messages)
+    with _lock:
+        s = _slot(name)
+        s["calls"] += 1
+        s["estimated"] += estimated
+        s["actual"] += actual
+        _recent.append({"template": name, "model": model, "estimated": estimated, "actual": actual})
+
+def stats() -> dict:
+    with _lock:
+        per = {n: {**s, "ratio": round(s["actual"] / s["estimated"], 3) if s["estimated"] else None}
+               for n, s in _stats.items()}
+        recent = list(_recent)[-20:]
+    return {"tokenizer": "tiktoken" if _TIKTOKEN else "estimate", "prompt_budget": LLM_PROMPT_BUDGET,
+            "context_limit": LLM_CONTEXT_LIMIT, "templates": per, "recent": recent}
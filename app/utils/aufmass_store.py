@@ -0,0 +1,89 @@
+from hashlib import sha1
+import json
+
+from app.utils.session_manager import session_manager
+
+# -----------------------------------------------------
+# Abgeleitete Aufmaß-Artefakte
+# -----------------------------------------------------
+# Der generierte Aufmaß-Block ist reine Ableitung aus den Elementen und
+# liegt deshalb NICHT in der Session, sondern im Nebendokument
+# "<sid>#aufmass":
+#
+#   {"elements_hash": "<sha1>", "text": "Baugraben 1: …"}
+#
+# Eine neue DXF ändert so weder Revision/ETag der Session noch updated_json
+# oder Patches. Passt elements_hash nicht mehr zu den aktuellen Elementen
+# (Änderung nach der DXF), gilt der Block als nicht vorhanden.
+#
+# Manuelle Zeilen sind Nutzereingaben und bleiben in session["derived"]:
+#
+#   "derived": {"aufmass_override": ["Baugraben 1: …", …]}
+
+_LEGACY_TYPES = ("aufmass", "aufmass_override")
+
+def elements_hash(session: dict) -> str:
+    elems = session.get("elements", [])
+    return sha1(json.dumps(elems, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def migrate_legacy(session: dict) -> None:
+    """Alte Sessions: aufmass_override-Elemente in den derived-Slot verschieben,
+    alte Auto-Blöcke (ohne prüfbaren Hash) verwerfen."""
+    session.get("derived", {}).pop("aufmass", None)
+    elems = session.get("elements") or []
+    if not any((e.get("type", "") or "").lower() in _LEGACY_TYPES for e in elems):
+        return
+    keep = []
+    for e in elems:
+        t = (e.get("type", "") or "").lower()
+        if t == "aufmass_override":
+            if isinstance(e.get("lines"), list):
+                session.setdefault("derived", {})["aufmass_override"] = [
+                    str(x).strip() for x in e["lines"] if str(x).strip()]
+        elif t != "aufmass":
+            keep.append(e)
+    session["elements"] = keep
+
+def get_auto_aufmass(session_id: str, session: dict) -> str | None:
+    """Generierter Block zum aktuellen Elementstand; None, wenn keiner/veraltet."""
+    migrate_legacy(session)
+    data, _ = session_manager.get_aux(session_id, "aufmass")
+    if not data or data.get("elements_hash") != elements_hash(session):
+        return None
+    return data.get("text")
+
+def stored_text(session_id: str) -> str | None:
+    """Zuletzt generierter Block ohne Aktualitätsprüfung (nur für Kennzahlen)."""
+    data, _ = session_manager.get_aux(session_id, "aufmass")
+    return (data or {}).get("text")
+
+def set_auto_aufmass(session_id: str, session: dict, text: str) -> bool:
+    """Speichert den generierten Block; False, wenn sich nichts geändert hat."""
+    migrate_legacy(session)
+    h = elements_hash(session)
+    data, _ = session_manager.get_aux(session_id, "aufmass")
+    if data and data.get("elements_hash") == h and data.get("text") == text:
+        return False
+    # abgeleitet → letzter Schreiber gewinnt, kein CAS nötig
+    session_manager.update_aux(session_id, "aufmass", {"elements_hash": h, "text": text})
+    return True
+
+def get_manual_lines(session: dict) -> list[str] | None:
+    migrate_legacy(session)
+    lines = session.get("derived", {}).get("aufmass_override")
+    if not isinstance(lines, list):
+        return None
+    return [str(x).strip() for x in lines if str(x).strip()]
+
+def set_manual_lines(session: dict, lines: list[str]) -> None:
+    migrate_legacy(session)
+    session.setdefault("derived", {})["aufmass_override"] = [
+        str(x).strip() for x in lines if str(x).strip()
+    ]
+
+def split_lines(text: str) -> list[str]:
+    """Aufmaß-Block in Zeilen; Kopfzeile "Aufmaß:" entfällt."""
+    return [
+        ln.strip() for ln in (text or "").replace("\r", "\n").split("\n")
+        if ln.strip() and not ln.strip().lower().startswith("aufmaß")
+    ]
@@ -0,0 +1,114 @@
+from collections import defaultdict
+from enum import Enum
+from functools import lru_cache
+from typing import Optional
+
+# -----------------------------------------------------
+# Element-Index
+# -----------------------------------------------------
+# Einmal pro Element-Liste in O(n) aufgebaut; danach sind alle Zugriffe
+# (Graben N, Rohre/Oberflächen zu Graben N, Durchstich an Naht N) O(1).
+# Die Session selbst bleibt reines JSON – der Index wird nach jeder
+# Mutation (_normalize_and_reindex) bzw. zu Beginn eines Requests neu
+# gebaut, nicht persistiert.
+
+class Kind(str, Enum):
+    TRENCH  = "baugraben"
+    PIPE    = "rohr"
+    SURFACE = "oberflaechenbefestigung"
+    PASS    = "durchstich"
+    JOIN    = "verbindung"
+    AUFMASS = "aufmass"
+    OTHER   = "sonst"
+
+@lru_cache(maxsize=256)
+def kind_of_type(t: str) -> Kind:
+    # Reihenfolge wie bisher bei den Substring-Prüfungen
+    tt = (t or "").lower()
+    if "baugraben" in tt:
+        return Kind.TRENCH
+    if "rohr" in tt:
+        return Kind.PIPE
+    if "oberflächenbefest" in tt or "oberflaechenbefest" in tt:
+        return Kind.SURFACE
+    if "durchstich" in tt:
+        return Kind.PASS
+    if "verbindung" in tt:
+        return Kind.JOIN
+    if tt in ("aufmass", "aufmass_override"):
+        return Kind.AUFMASS
+    return Kind.OTHER
+
+def kind_of(e: dict) -> Kind:
+    return kind_of_type(e.get("type", "") or "")
+
+def _int(v, default: int = 0) -> int:
+    if v is None or v == "":
+        return default
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
+
+class ElementIndex:
+    def __init__(self, elems: list[dict]):
+        self.elems = elems
+        self.kinds: list[Kind] = []
+        self.positions: dict[Kind, list[int]] = defaultdict(list)
+        self.trench_by_index: dict[int, int] = {}
+        self.pipes_by_trench: dict[int, list[int]] = defaultdict(list)
+        self.surfaces_by_trench: dict[int, list[int]] = defaultdict(list)
+        self.passes_by_between: dict[int, list[int]] = defaultdict(list)
+        self.joins_by_between: dict[int, list[int]] = defaultdict(list)
+        self._passes_have_between = False
+
+        for i, e in enumerate(elems):
+            k = kind_of(e)
+            self.kinds.append(k)
+            self.positions[k].append(i)
+            if k is Kind.TRENCH:
+                self.trench_by_index.setdefault(_int(e.get("trench_index")), i)
+            elif k is Kind.PIPE:
+                self.pipes_by_trench[_int(e.get("for_trench"))].append(i)
+            elif k is Kind.SURFACE:
+                self.surfaces_by_trench[_int(e.get("for_trench"))].append(i)
+            elif k is Kind.PASS:
+                if e.get("between") is not None:
+                    self._passes_have_between = True
+                    self.passes_by_between[_int(e.get("between"), -1)].append(i)
+            elif k is Kind.JOIN:
+                if e.get("between") is not None:
+                    self.joins_by_between[_int(e.get("between"), -1)].append(i)
+
+    # --- Listen je Art ---------------------------------------------------
+    def of_kind(self, kind: Kind) -> list[dict]:
+        return [self.elems[i] for i in self.positions.get(kind, ())]
+
+    def count(self, kind: Kind) -> int:
+        return len(self.positions.get(kind, ()))
+
+    # --- Zugriffe über Referenzfelder -------------------------------------
+    def pipes_for(self, trench: int) -> list[dict]:
+        return [self.elems[i] for i in self.pipes_by_trench.get(trench, ())]
+
+    def first_pipe_for(self, trench: int) -> Optional[dict]:
+        lst = self.pipes_by_trench.get(trench)
+        return self.elems[lst[0]] if lst else None
+
+    def surfaces_for(self, trench: int) -> list[dict]:
+        # Originalreihenfolge; wenn "seq" gesetzt ist, danach sortieren
+        lst = [self.elems[i] for i in self.surfaces_by_trench.get(trench, ())]
+        if any("seq" in s for s in lst):
+            lst = sorted(lst, key=lambda s: int(s.get("seq", 1)))
+        return lst
+
+    def pass_between(self, seam: int) -> Optional[dict]:
+        # bevorzugt Feld 'between', sonst Legacy-Fallback per Listenposition
+        if self._passes_have_between:
+            lst = self.passes_by_between.get(seam)
+            return self.elems[lst[0]] if lst else None
+        passes = self.positions.get(Kind.PASS, [])
+        return self.elems[passes[seam-1]] if 0 <= seam-1 < len(passes) else None
+
+    def join_seams(self) -> set[int]:
+        return {b for b, lst in self.joins_by_between.items() if lst}
@@ -0,0 +1,119 @@
+import json
+import os
+import time
+
+# -----------------------------------------------------
+# Undo/Redo-Historie als Deltas je Revision
+# -----------------------------------------------------
+# Je aufgezeichneter Revision ein eigenes Nebendokument "history:<id>",
+# das genau einmal geschrieben wird: der geänderte Abschnitt der
+# Elementliste (gemeinsamer Anfang/Ende fällt weg), vorher und nachher.
+#
+#   {"at": 2, "old": [{...}], "new": [{...}, {...}]}
+#
+# Das Indexdokument "history" hält nur Metadaten, keine Elemente:
+#
+#   {"undo": [{"id": 7, "rev": 7, "label": "add-element", "ts": …, "n": 4}, …],
+#    "redo": [...]}
+#
+# undo[-1] ist der aktuelle Stand der Session, undo[0] die Grenze (davor
+# kein Undo). Eine Revision kostet damit O(Änderung) statt O(Session).
+# Vor dem Anwenden wird geprüft, ob der Abschnitt noch zum aktuellen Stand
+# passt – sonst verweigert die Route das Undo/Redo, statt falsch zu mischen.
+# Ältere Historien im Pool-Format werden verworfen.
+
+HISTORY_LIMIT = int(os.getenv("SESSION_HISTORY_LIMIT", "50"))
+
+def record_name(rid: int) -> str:
+    return f"history:{rid}"
+
+def delta(old: list[dict], new: list[dict]) -> dict:
+    """Geänderter Abschnitt zwischen zwei Elementlisten."""
+    n = min(len(old), len(new))
+    i = 0
+    while i < n and old[i] == new[i]:
+        i += 1
+    j = 0
+    while j < n - i and old[-1 - j] == new[-1 - j]:
+        j += 1
+    return {"at": i, "old": old[i:len(old) - j], "new": new[i:len(new) - j]}
+
+def apply(elements: list[dict], d: dict | None, reverse: bool = False) -> list[dict] | None:
+    """Delta anwenden (reverse = rückgängig); None, wenn es nicht mehr zum Stand passt."""
+    if d is None:
+        return None
+    at, expect, repl = (d["at"], d["new"], d["old"]) if reverse else (d["at"], d["old"], d["new"])
+    if elements[at:at + len(expect)] != expect:
+        return None
+    return elements[:at] + repl + elements[at + len(expect):]
+
+class RevisionHistory:
+    def __init__(self, data: dict | None = None, limit: int = HISTORY_LIMIT):
+        data = data if data and "pool" not in data else {}
+        self.undo: list[dict] = data.get("undo", [])
+        self.redo: list[dict] = data.get("redo", [])
+        self.limit = max(1, limit)
+        self.dropped: list[int] = []       # Delta-Dokumente, die gelöscht werden können
+        self._before: list[dict] | None = None
+
+    def to_dict(self) -> dict:
+        return {"undo": self.undo, "redo": self.redo}
+
+    # --- Stände ----------------------------------------------------------
+    def begin(self, rev: int, elements: list[dict]) -> None:
+        """Vor einer Mutation: Ausgangsstand merken (Baseline beim ersten Mal)."""
+        if not self.undo:
+            self.undo.append({"id": None, "rev": rev, "label": "start", "ts": time.time(),
+                              "n": len(elements)})
+        self._before = json.loads(json.dumps(elements))
+
+    def delta(self, elements: list[dict]) -> dict:
+        return delta(self._before or [], elements)
+
+    def record(self, rev: int, n: int, label: str) -> None:
+        """Stand `rev` eintragen (Delta liegt unter record_name(rev)); idempotent."""
+        if any(st["id"] == rev for st in self.undo):
+            return
+        st = {"id": rev, "rev": rev, "label": label, "ts": time.time(), "n": n}
+        i = len(self.undo)
+        while i and self.undo[i - 1]["rev"] > rev:    # verspätet eingetragen → nach Revision einsortieren
+            i -= 1
+        self.undo.insert(i, st)
+        self.dropped += [s["id"] for s in self.redo if s["id"] is not None]
+        self.redo.clear()
+        if len(self.undo) > self.limit:
+            self.dropped += [s["id"] for s in self.undo[:-self.limit] if s["id"] is not None]
+            del self.undo[:-self.limit]
+        # der älteste Stand wird nie mehr zurückgenommen – sein Delta ist überflüssig
+        if self.undo[0]["id"] is not None:
+            self.dropped.append(self.undo[0]["id"])
+            self.undo[0]["id"] = None
+
+    def step_undo(self) -> dict | None:
+        """Aktuellen Stand auf den Redo-Stack; liefert ihn (sein Delta ist zurückzunehmen)."""
+        if len(self.undo) < 2:
+            return None
+        self.redo.append(self.undo.pop())
+        return self.redo[-1]
+
+    def step_redo(self) -> dict | None:
+        """Nächsten Stand zurückholen; liefert ihn (sein Delta ist erneut anzuwenden)."""
+        if not self.redo:
+            return None
+        self.undo.append(self.redo.pop())
+        return self.undo[-1]
+
+    def mark_current(self, rev: int) -> None:
+        # nach Undo/Redo: der wiederhergestellte Stand gilt ab dieser Session-Revision
+        if self.undo:
+            self.undo[-1]["rev"] = rev
+
+    def listing(self) -> dict:
+        def row(st, current=False):
+            return {"rev": st["rev"], "label": st["label"], "ts": st["ts"],
+                    "elements": st["n"], "current": current}
+        n = len(self.undo)
+        return {
+            "undo": [row(st, current=(i == n - 1)) for i, st in enumerate(self.undo)],
+            "redo": [row(st) for st in reversed(self.redo)],
+        }
@@ -0,0 +1,110 @@
+import json
+
+# -----------------------------------------------------
+# JSON Patch (RFC 6902) – Erzeugen und Anwenden
+# -----------------------------------------------------
+# Nur die Operationen add / remove / replace werden erzeugt; apply() kann
+# zusätzlich "test". Listen werden über gemeinsamen Präfix/Suffix
+# abgeglichen, damit ein eingefügtes oder gelöschtes Element mitten in
+# "elements" nur eine Operation kostet.
+
+def _esc(key) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+def _unesc(tok: str) -> str:
+    return tok.replace("~1", "/").replace("~0", "~")
+
+def diff(a, b, path: str = "") -> list[dict]:
+    if type(a) is not type(b):
+        return [{"op": "replace", "path": path, "value": b}]
+    if isinstance(a, dict):
+        ops = []
+        for k in a:
+            if k not in b:
+                ops.append({"op": "remove", "path": f"{path}/{_esc(k)}"})
+        for k, v in b.items():
+            if k not in a:
+                ops.append({"op": "add", "path": f"{path}/{_esc(k)}", "value": v})
+            else:
+                ops.extend(diff(a[k], v, f"{path}/{_esc(k)}"))
+        return ops
+    if isinstance(a, list):
+        return _diff_list(a, b, path)
+    if a != b:
+        return [{"op": "replace", "path": path, "value": b}]
+    return []
+
+def _diff_list(a: list, b: list, path: str) -> list[dict]:
+    # gemeinsamen Anfang und gemeinsames Ende abschneiden
+    pre = 0
+    while pre < len(a) and pre < len(b) and a[pre] == b[pre]:
+        pre += 1
+    suf = 0
+    while (suf < len(a) - pre and suf < len(b) - pre
+           and a[len(a) - 1 - suf] == b[len(b) - 1 - suf]):
+        suf += 1
+    mid_a = a[pre:len(a) - suf]
+    mid_b = b[pre:len(b) - suf]
+
+    ops = []
+    common = min(len(mid_a), len(mid_b))
+    for i in range(common):
+        ops.extend(diff(mid_a[i], mid_b[i], f"{path}/{pre + i}"))
+    # überzählige alte Einträge von hinten entfernen (Indizes bleiben gültig)
+    for i in reversed(range(common, len(mid_a))):
+        ops.append({"op": "remove", "path": f"{path}/{pre + i}"})
+    for i in range(common, len(mid_b)):
+        ops.append({"op": "add", "path": f"{path}/{pre + i}", "value": mid_b[i]})
+    return ops
+
+def apply(doc, ops: list[dict]):
+    """Wendet einen Patch auf eine Kopie an und liefert das Ergebnis."""
+    doc = json.loads(json.dumps(doc))
+    for op in ops:
+        doc = _apply_one(doc, op)
+    return doc
+
+def _apply_one(doc, op: dict):
+    path = op["path"]
+    if path == "":
+        if op["op"] in ("add", "replace"):
+            return json.loads(json.dumps(op["value"]))
+        if op["op"] == "test":
+            if doc != op["value"]:
+                raise ValueError("JSON-Patch test fehlgeschlagen: /")
+            return doc
+        raise ValueError(f"Operation {op['op']} auf Wurzel nicht erlaubt")
+
+    toks = [_unesc(t) for t in path.split("/")[1:]]
+    parent = doc
+    for t in toks[:-1]:
+        parent = parent[int(t)] if isinstance(parent, list) else parent[t]
+    last = toks[-1]
+    kind = op["op"]
+
+    if isinstance(parent, list):
+        idx = len(parent) if last == "-" else int(last)
+        if kind == "add":
+            parent.insert(idx, op["value"])
+        elif kind == "remove":
+            del parent[idx]
+        elif kind == "replace":
+            parent[idx] = op["value"]
+        elif kind == "test":
+            if parent[idx] != op["value"]:
+                raise ValueError(f"JSON-Patch test fehlgeschlagen: {path}")
+        else:
+            raise ValueError(f"Unbekannte Operation: {kind}")
+    else:
+        if kind in ("add", "replace"):
+            if kind == "replace" and last not in parent:
+                raise KeyError(path)
+            parent[last] = op["value"]
+        elif kind == "remove":
+            del parent[last]
+        elif kind == "test":
+            if parent.get(last) != op["value"]:
+                raise ValueError(f"JSON-Patch test fehlgeschlagen: {path}")
+        else:
+            raise ValueError(f"Unbekannte Operation: {kind}")
+    return doc
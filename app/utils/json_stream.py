@@ -0,0 +1,61 @@
+import json
+
+# -----------------------------------------------------
+# Inkrementeller JSON-Scanner für gestreamte LLM-Antworten
+# -----------------------------------------------------
+# Die Antwort kommt stückweise. feed() liefert jedes Objekt, sobald seine
+# schließende Klammer da ist – entweder als Wert eines Top-Level-Feldes
+# ("selection": {...}) oder als Eintrag eines Top-Level-Arrays
+# ("new_elements": [{...}, {...}]). Ergebnis jeweils (Feldname, Objekt).
+# Der Rest des Dokuments wird erst am Ende mit json.loads gelesen.
+
+class JsonObjectScanner:
+    def __init__(self):
+        self.buf = ""
+        self._pos = 0
+        self._stack: list[tuple[str, int, str | None]] = []   # (Klammer, Start, Feldname)
+        self._in_str = False
+        self._esc = False
+        self._str_start = 0
+        self._key: str | None = None
+
+    def feed(self, text: str) -> list[tuple[str, dict]]:
+        self.buf += text
+        out = []
+        for i in range(self._pos, len(self.buf)):
+            c = self.buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    if len(self._stack) == 1:
+                        self._key = self.buf[self._str_start:i]
+                continue
+            if c == '"':
+                self._in_str = True
+                self._str_start = i + 1
+            elif c in "{[":
+                self._stack.append((c, i, self._key if len(self._stack) == 1 else None))
+            elif c in "}]" and self._stack:
+                opener, start, key = self._stack.pop()
+                if c == "}" and len(self._stack) == 1:
+                    self._emit(out, key, start, i)                    # Feldwert
+                elif c == "}" and len(self._stack) == 2 and self._stack[1][0] == "[":
+                    self._emit(out, self._stack[1][2], start, i)      # Array-Eintrag
+            elif c == "," and len(self._stack) == 1:
+                self._key = None
+        self._pos = len(self.buf)
+        return out
+
+    def _emit(self, out: list, key: str | None, start: int, end: int) -> None:
+        if key is None:
+            return
+        try:
+            obj = json.loads(self.buf[start:end + 1])
+        except ValueError:
+            return
+        if isinstance(obj, dict):
+            out.append((key, obj))
@@ -0,0 +1,165 @@
+import socket
+import threading
+from urllib.parse import urlparse
+
+# -----------------------------------------------------
+# Minimaler Redis-Client (RESP2)
+# -----------------------------------------------------
+# Nur das, was der Session-Speicher braucht: einzelne Befehle, Pipelines,
+# WATCH/MULTI/EXEC und SUBSCRIBE. Eine Verbindung pro Thread (Starlette-
+# Threadpool), Pub/Sub auf eigener Verbindung. Funktioniert gegen echtes
+# Redis/Valkey ebenso wie gegen app.utils.resp_fake.FakeRedisServer.
+
+class RespError(Exception):
+    """Fehlerantwort des Servers (-ERR …)."""
+
+def _encode(args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for a in args:
+        if isinstance(a, bytes):
+            b = a
+        elif isinstance(a, str):
+            b = a.encode("utf-8")
+        else:
+            b = str(a).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+    return b"".join(out)
+
+def read_reply(rfile):
+    line = rfile.readline()
+    if not line:
+        raise ConnectionError("Verbindung zum Redis-Server geschlossen")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        return RespError(rest.decode("utf-8"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        if n < 0:
+            return None
+        data = rfile.read(n + 2)
+        return data[:-2].decode("utf-8")
+    if kind == b"*":
+        n = int(rest)
+        if n < 0:
+            return None
+        return [read_reply(rfile) for _ in range(n)]
+    raise ConnectionError(f"Unerwartete RESP-Antwort: {line!r}")
+
+class RespConnection:
+    def __init__(self, host: str, port: int, db: int = 0, password: str | None = None,
+                 timeout: float | None = 5.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        if password:
+            self.call("AUTH", password)
+        if db:
+            self.call("SELECT", db)
+
+    def send(self, *commands) -> None:
+        self.sock.sendall(b"".join(_encode(c) for c in commands))
+
+    def read(self):
+        return read_reply(self.rfile)
+
+    def call(self, *args):
+        self.send(args)
+        reply = self.read()
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self) -> None:
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+class RespClient:
+    """Thread-lokale Verbindungen zu einem Server, aufgebaut aus redis://[:pw@]host:port/db."""
+
+    def __init__(self, url: str, timeout: float | None = 5.0):
+        u = urlparse(url)
+        if u.scheme not in ("redis", ""):
+            raise ValueError(f"Nicht unterstützte Redis-URL: {url}")
+        self.host = u.hostname or "localhost"
+        self.port = u.port or 6379
+        self.db = int((u.path or "/0").lstrip("/") or 0)
+        self.password = u.password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connect(self, timeout: float | None = None) -> RespConnection:
+        return RespConnection(self.host, self.port, self.db, self.password,
+                              self.timeout if timeout is None else timeout)
+
+    def _conn(self) -> RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    def _drop(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def call(self, *args):
+        # einmal neu verbinden, falls die Thread-Verbindung inzwischen tot ist
+        for attempt in (0, 1):
+            try:
+                return self._conn().call(*args)
+            except (ConnectionError, OSError):
+                self._drop()
+                if attempt:
+                    raise
+
+    def pipeline(self, *commands) -> list:
+        """Mehrere Befehle in einem Roundtrip; Fehlerantworten werden geworfen."""
+        for attempt in (0, 1):
+            try:
+                conn = self._conn()
+                conn.send(*commands)
+                replies = [conn.read() for _ in commands]
+                break
+            except (ConnectionError, OSError):
+                self._drop()
+                if attempt:
+                    raise
+        for r in replies:
+            if isinstance(r, RespError):
+                raise r
+        return replies
+
+    def transaction(self, watch: str, check, commands) -> tuple | None:
+        """WATCH key → check(conn) → MULTI … EXEC; liefert (check-Ergebnis, EXEC-Antworten).
+
+        None, wenn der Key zwischen WATCH und EXEC geändert wurde.
+
+        check() darf werfen (z. B. SessionConflict); dann wird UNWATCH gesendet.
+        commands ist eine Funktion, die aus dem Ergebnis von check() die Befehle baut.
+        """
+        conn = self._conn()
+        try:
+            conn.call("WATCH", watch)
+            try:
+                state = check(conn)
+            except BaseException:
+                conn.call("UNWATCH")
+                raise
+            cmds = commands(state)
+            conn.send(("MULTI",), *cmds, ("EXEC",))
+            replies = [conn.read() for _ in range(len(cmds) + 2)]
+        except (ConnectionError, OSError):
+            self._drop()
+            raise
+        for r in replies[:-1]:
+            if isinstance(r, RespError):
+                raise r
+        return (state, replies[-1]) if replies[-1] is not None else None
@@ -0,0 +1,234 @@
+import socketserver
+import threading
+import time
+
+from app.utils.resp import RespError, read_reply
+
+# -----------------------------------------------------
+# In-Process-Ersatz für Redis (Tests / lokale Entwicklung)
+# -----------------------------------------------------
+# Spricht echtes RESP über TCP, damit RespClient/RedisBackend unverändert
+# dagegen laufen – inklusive WATCH/MULTI/EXEC und PUBLISH/SUBSCRIBE.
+# Unterstützt nur die Befehle, die der Session-Speicher nutzt.
+#
+#   srv = FakeRedisServer().start()
+#   backend = RedisBackend(srv.url)
+#   …
+#   srv.stop()
+
+def _bulk(v) -> bytes:
+    if v is None:
+        return b"$-1\r\n"
+    b = v.encode("utf-8") if isinstance(v, str) else v
+    return b"$%d\r\n%s\r\n" % (len(b), b)
+
+def _reply(v) -> bytes:
+    if isinstance(v, RespError):
+        return b"-%s\r\n" % str(v).encode("utf-8")
+    if v is True:
+        return b"+OK\r\n"
+    if isinstance(v, int):
+        return b":%d\r\n" % v
+    if isinstance(v, list):
+        return b"*%d\r\n" % len(v) + b"".join(_reply(x) for x in v)
+    if v is ...:
+        return b"*-1\r\n"
+    return _bulk(v)
+
+def _score_bound(v: str) -> tuple[float, bool]:
+    """'(5' → (5, exklusiv); '-inf'/'+inf' erlaubt."""
+    if v.startswith("("):
+        return float(v[1:]), True
+    return float(v), False
+
+
+class _Store:
+    def __init__(self):
+        self.data: dict[str, object] = {}       # str oder dict (Hash / Sorted Set)
+        self.expires: dict[str, float] = {}
+        self.versions: dict[str, int] = {}      # für WATCH
+        self.subscribers: dict[str, set] = {}
+        self.lock = threading.RLock()
+
+    def _touch(self, key: str) -> None:
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _alive(self, key: str) -> bool:
+        exp = self.expires.get(key)
+        if exp is not None and exp <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+            self._touch(key)
+        return key in self.data
+
+    def execute(self, conn, args: list[str]):
+        cmd = args[0].upper()
+        a = args[1:]
+        if cmd == "PING":
+            return a[0] if a else "PONG"
+        if cmd in ("SELECT", "AUTH", "CLIENT"):
+            return True
+        if cmd == "GET":
+            return self.data.get(a[0]) if self._alive(a[0]) else None
+        if cmd == "SET":
+            self.data[a[0]] = a[1]
+            self.expires.pop(a[0], None)
+            self._touch(a[0])
+            return True
+        if cmd == "DEL":
+            n = 0
+            for k in a:
+                if self._alive(k):
+                    del self.data[k]
+                    self.expires.pop(k, None)
+                    self._touch(k)
+                    n += 1
+            return n
+        if cmd == "EXISTS":
+            return sum(1 for k in a if self._alive(k))
+        if cmd == "HGET":
+            h = self.data.get(a[0]) if self._alive(a[0]) else None
+            return h.get(a[1]) if h else None
+        if cmd == "HMGET":
+            h = self.data.get(a[0]) if self._alive(a[0]) else None
+            return [h.get(f) if h else None for f in a[1:]]
+        if cmd == "HSET":
+            h = self.data.get(a[0]) if self._alive(a[0]) else None
+            if h is None:
+                h = self.data[a[0]] = {}
+            added = 0
+            for f, v in zip(a[1::2], a[2::2]):
+                added += f not in h
+                h[f] = v
+            self._touch(a[0])
+            return added
+        if cmd == "ZADD":
+            z = self.data.get(a[0]) if self._alive(a[0]) else None
+            if z is None:
+                z = self.data[a[0]] = {}
+            added = 0
+            for score, member in zip(a[1::2], a[2::2]):
+                added += member not in z
+                z[member] = float(score)
+            self._touch(a[0])
+            return added
+        if cmd == "ZRANGEBYSCORE":
+            z = self.data.get(a[0]) if self._alive(a[0]) else None
+            lo, hi = _score_bound(a[1]), _score_bound(a[2])
+            return [m for m, sc in sorted((z or {}).items(), key=lambda kv: kv[1])
+                    if (sc > lo[0] if lo[1] else sc >= lo[0]) and (sc < hi[0] if hi[1] else sc <= hi[0])]
+        if cmd == "EXPIRE":
+            if not self._alive(a[0]):
+                return 0
+            self.expires[a[0]] = time.monotonic() + int(a[1])
+            return 1
+        if cmd == "DBSIZE":
+            return sum(1 for k in list(self.data) if self._alive(k))
+        if cmd == "FLUSHALL":
+            for k in list(self.data):
+                self._touch(k)
+            self.data.clear()
+            self.expires.clear()
+            return True
+        if cmd == "PUBLISH":
+            subs = list(self.subscribers.get(a[0], ()))
+            for s in subs:
+                s.push(["message", a[0], a[1]])
+            return len(subs)
+        return RespError(f"ERR unknown command '{args[0]}'")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.store: _Store = self.server.store
+        self.watched: dict[str, int] = {}
+        self.queued: list | None = None
+        self.channels: set[str] = set()
+        self.wlock = threading.Lock()
+
+    def push(self, msg) -> None:
+        try:
+            with self.wlock:
+                self.wfile.write(_reply(msg))
+                self.wfile.flush()
+        except OSError:
+            pass
+
+    def handle(self):
+        try:
+            while True:
+                args = read_reply(self.rfile)
+                if not isinstance(args, list) or not args:
+                    break
+                self.push(self._dispatch(args))
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            with self.store.lock:
+                for ch in self.channels:
+                    self.store.subscribers.get(ch, set()).discard(self)
+
+    def _dispatch(self, args: list[str]):
+        cmd = args[0].upper()
+        st = self.store
+        with st.lock:
+            if cmd == "SUBSCRIBE":
+                for ch in args[1:]:
+                    st.subscribers.setdefault(ch, set()).add(self)
+                    self.channels.add(ch)
+                # je Kanal eine Bestätigung; die letzte geht über push() in handle()
+                for i, ch in enumerate(args[1:-1], 1):
+                    self.push(["subscribe", ch, i])
+                return ["subscribe", args[-1], len(self.channels)]
+            if cmd == "WATCH":
+                for k in args[1:]:
+                    self.watched[k] = st.versions.get(k, 0)
+                return True
+            if cmd == "UNWATCH":
+                self.watched.clear()
+                return True
+            if cmd == "MULTI":
+                self.queued = []
+                return True
+            if cmd == "DISCARD":
+                self.queued = None
+                self.watched.clear()
+                return True
+            if cmd == "EXEC":
+                queued, self.queued = self.queued, None
+                dirty = any(st.versions.get(k, 0) != v for k, v in self.watched.items())
+                self.watched.clear()
+                if queued is None:
+                    return RespError("ERR EXEC without MULTI")
+                if dirty:
+                    return ...
+                return [st.execute(self, q) for q in queued]
+            if self.queued is not None:
+                self.queued.append(args)
+                return "QUEUED"
+            return st.execute(self, args)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.store = _Store()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "FakeRedisServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-redis", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
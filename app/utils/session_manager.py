@@ -1,20 +1,705 @@
 from fastapi import HTTPException
-import uuid
+from collections import OrderedDict, deque
+import json
+import logging
+import os
+import sqlite3
 import threading
 import time
+import uuid
+
+from app.utils import json_patch
+from app.utils.resp import RespClient
+
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------
+# Revisionen / Optimistic Concurrency
+# -----------------------------------------------------
+class SessionConflict(HTTPException):
+    """Session wurde zwischen Lesen und Schreiben verändert (Compare-and-Swap fehlgeschlagen)."""
+
+    def __init__(self, current_rev: int, status_code: int = 409):
+        super().__init__(
+            status_code,
+            f"Session wurde zwischenzeitlich geändert (aktuelle Revision {current_rev}) – bitte neu laden.",
+            headers={"ETag": etag(current_rev)},
+        )
+        self.current_rev = current_rev
+
+def etag(rev: int) -> str:
+    return f'"{rev}"'
+
+def parse_etag(value: str | None) -> int | None:
+    """'"7"', 'W/"7"' oder '7' → 7; leer/'*' → None."""
+    if not value:
+        return None
+    v = value.strip()
+    if v == "*":
+        return None
+    if v.startswith("W/"):
+        v = v[2:]
+    try:
+        return int(v.strip('"'))
+    except ValueError:
+        raise HTTPException(400, f"Ungültiger If-Match-Header: {value}")
+
+# -----------------------------------------------------
+# Begrenzter Speicher: Idle-TTL + LRU mit Byte-Budget
+# -----------------------------------------------------
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_MAX_BYTES   = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_CACHE_BYTES = int(os.getenv("SESSION_CACHE_BYTES", str(64 * 1024 * 1024)))
+# max. Revisionsabstand, für den ?since= einen Patch statt der ganzen Session liefert
+SESSION_DELTA_LIMIT = int(os.getenv("SESSION_DELTA_LIMIT", "50"))
+# nach so vielen Ereignissen wird der volle Stand (Snapshot) neu geschrieben
+SESSION_SNAPSHOT_EVERY = max(1, int(os.getenv("SESSION_SNAPSHOT_EVERY", "20")))
+# MemoryBackend: so viele Ereignisse je Session bleiben im Prozess (mind. SESSION_DELTA_LIMIT)
+SESSION_MEMORY_EVENTS = max(SESSION_DELTA_LIMIT, int(os.getenv("SESSION_MEMORY_EVENTS", "200")))
+
+_ENTRY_OVERHEAD = 200   # grobe Schätzung: Dict-Slot, Tupel, str-Header
+
+class BoundedStore:
+    """sid -> (rev, payload); verdrängt nach Leerlaufzeit und bei Überschreitung des Byte-Budgets.
+
+    Reihenfolge = letzter Zugriff (älteste vorne), daher sind TTL- und LRU-Verdrängung
+    jeweils ein popitem() vom Anfang. 0 schaltet die jeweilige Grenze ab.
+    Mehrfach gespeicherte identische payload-Objekte (Forks) zählen nur einmal.
+    charge() rechnet einem Eintrag Zusatzbytes zu (z. B. sein Ereignis-Log).
+    """
+
+    def __init__(self, max_bytes: int = 0, ttl: float = 0, on_evict=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._items: OrderedDict[str, tuple[int, str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._refs: dict[int, int] = {}    # id(payload) -> Anzahl Einträge
+        self._extra: dict[str, int] = {}   # sid -> Zusatzbytes (charge)
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evicted_ttl": 0, "evicted_lru": 0}
+
+    def _account(self, payload: str, delta: int) -> None:
+        n = self._refs.get(id(payload), 0) + delta
+        if n:
+            self._refs[id(payload)] = n
+        else:
+            self._refs.pop(id(payload), None)
+        # Text nur beim ersten bzw. letzten Verweis zählen, Verwaltungsaufwand immer
+        first_or_last = (delta > 0 and n == 1) or (delta < 0 and n == 0)
+        self.bytes += delta * (_ENTRY_OVERHEAD + (len(payload) if first_or_last else 0))
+
+    def get(self, sid: str):
+        with self._lock:
+            self._expire(time.monotonic())
+            item = self._items.get(sid)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self._items[sid] = (item[0], item[1], time.monotonic())
+            self._items.move_to_end(sid)
+            return item[0], item[1]
+
+    def put(self, sid: str, rev: int, payload: str) -> None:
+        with self._lock:
+            old = self._items.pop(sid, None)
+            if old is not None:
+                self._account(old[1], -1)
+            self._items[sid] = (rev, payload, time.monotonic())
+            self._account(payload, +1)
+            self._expire(time.monotonic())
+            while self.max_bytes and self.bytes > self.max_bytes and len(self._items) > 1:
+                self._evict("evicted_lru")
+
+    def charge(self, sid: str, nbytes: int) -> None:
+        with self._lock:
+            if sid not in self._items:
+                return
+            self._extra[sid] = self._extra.get(sid, 0) + nbytes
+            self.bytes += nbytes
+            while self.max_bytes and self.bytes > self.max_bytes and len(self._items) > 1:
+                self._evict("evicted_lru")
+
+    def pop(self, sid: str) -> None:
+        with self._lock:
+            old = self._items.pop(sid, None)
+            if old is not None:
+                self._account(old[1], -1)
+                self.bytes -= self._extra.pop(sid, 0)
+
+    def invalidate(self, sid: str, rev: int) -> None:
+        """Eintrag verwerfen, außer er hat bereits genau diese Revision (eigener Schreibvorgang)."""
+        with self._lock:
+            item = self._items.get(sid)
+            if item is not None and item[0] != rev:
+                del self._items[sid]
+                self._account(item[1], -1)
+                self.bytes -= self._extra.pop(sid, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._refs.clear()
+            self._extra.clear()
+            self.bytes = 0
+
+    def _expire(self, now: float) -> None:
+        if not self.ttl:
+            return
+        while self._items:
+            ts = next(iter(self._items.values()))[2]
+            if now - ts <= self.ttl:
+                break
+            self._evict("evicted_ttl")
+
+    def _evict(self, counter: str) -> None:
+        sid, old = self._items.popitem(last=False)
+        self._account(old[1], -1)
+        self.bytes -= self._extra.pop(sid, 0)
+        self.stats[counter] += 1
+        if self.on_evict is not None:
+            self.on_evict(sid)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self.bytes,
+                    "max_bytes": self.max_bytes, "ttl_seconds": self.ttl, **self.stats}
+
+# -----------------------------------------------------
+# Storage-Backends
+# -----------------------------------------------------
+# Ein Backend speichert pro Session (rev, payload) – payload ist das
+# JSON-serialisierte Session-Dict, rev zählt bei jedem Schreiben hoch.
+# Die Revision erlaubt dem SessionManager, seinen Read-Cache billig
+# gegen den Speicher zu prüfen (mehrere Worker teilen sich die Datei).
+#
+# Ereignis-Log: jede Session-Änderung wird als Ereignis
+#   {"rev", "ts", "kind", "input", "patch"}   (patch = RFC 6902 zum Vorstand)
+# angehängt. append() schreibt nur das Ereignis und die neue Revision; der
+# volle Stand (Snapshot) wird lediglich alle SESSION_SNAPSHOT_EVERY Ereignisse
+# neu geschrieben. load() = Snapshot + Replay der Ereignisse danach.
+# Ereignisse werden nie überschrieben (Audit-Trail, z. B. bei Rechnungsfragen).
+
+def _event_json(event: dict | None, rev: int) -> str | None:
+    return json.dumps({**event, "rev": rev}, ensure_ascii=False) if event else None
+
+def _replay(payload: str, events: list[str]) -> str:
+    doc = json.loads(payload)
+    for ev in events:
+        doc = json_patch.apply(doc, json.loads(ev)["patch"])
+    return json.dumps(doc, ensure_ascii=False)
+
+class MemoryBackend:
+    """Prozesslokaler Speicher (geht beim Neustart verloren).
+
+    Da es hier keinen zweiten Speicher gibt, gelten TTL und Byte-Budget direkt
+    für die Sessions selbst: verdrängte Sessions sind danach unbekannt.
+    Das Ereignis-Log zählt mit ins Byte-Budget, liegt bereits geparst vor und
+    behält je Session nur die letzten SESSION_MEMORY_EVENTS Einträge – ältere
+    Revisionen lassen sich hier nicht mehr rekonstruieren (replay → None).
+    """
+
+    def __init__(self, max_bytes: int = SESSION_MAX_BYTES, ttl: float = SESSION_TTL_SECONDS,
+                 max_events: int = SESSION_MEMORY_EVENTS):
+        self.max_events = max_events
+        self._events: dict[str, deque[tuple[dict, int]]] = {}    # sid -> (Ereignis, Bytes)
+        self._data = BoundedStore(max_bytes=max_bytes, ttl=ttl,
+                                  on_evict=lambda sid: self._events.pop(sid, None))
+        self._lock = threading.Lock()
+
+    def load(self, sid: str):
+        return self._data.get(sid)
+
+    def revision(self, sid: str):
+        entry = self._data.get(sid)
+        return entry[0] if entry else None
+
+    def save(self, sid: str, payload: str, expected_rev: int | None = None,
+             event: dict | None = None) -> int:
+        with self._lock:
+            entry = self._data.get(sid)
+            current = entry[0] if entry else 0
+            if expected_rev is not None and expected_rev != current:
+                raise SessionConflict(current)
+            rev = current + 1
+            self._data.put(sid, rev, payload)
+            if event:
+                size = len(_event_json(event, rev))
+                log = self._events.setdefault(sid, deque())
+                log.append(({**event, "rev": rev}, size))
+                while len(log) > self.max_events:
+                    size -= log.popleft()[1]
+                self._data.charge(sid, size)
+            return rev
+
+    def append(self, sid: str, expected_rev: int, event: dict, payload: str) -> int:
+        # im Prozess gibt es nichts zu persistieren – der volle Stand liegt ohnehin vor
+        return self.save(sid, payload, expected_rev, event)
+
+    def events(self, sid: str, since: int = 0, until: int | None = None) -> list[dict]:
+        # geparste Ereignisse (nur lesen!) – die anderen Backends liefern JSON-Strings
+        until = until if until is not None else 1 << 62
+        return [e for e, _ in self._events.get(sid, ()) if since < e["rev"] <= until]
+
+    def delete(self, sid: str) -> None:
+        self._data.pop(sid)
+        self._events.pop(sid, None)
+
+    def stats(self) -> dict:
+        return self._data.snapshot()
+
+
+class SQLiteBackend:
+    """SQLite im WAL-Modus: überlebt Neustarts, mehrere Worker auf einem Host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " sid TEXT PRIMARY KEY,"
+            " rev INTEGER NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " snap_rev INTEGER)"
+        )
+        # ältere Datenbanken: Spalte nachrüsten (NULL = Snapshot ist aktuell)
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(sessions)")}
+        if "snap_rev" not in cols:
+            conn.execute("ALTER TABLE sessions ADD COLUMN snap_rev INTEGER")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_events ("
+            " sid TEXT NOT NULL,"
+            " rev INTEGER NOT NULL,"
+            " event TEXT NOT NULL,"
+            " PRIMARY KEY (sid, rev))"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # eine Verbindung pro Thread (Starlette-Threadpool)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid: str):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT rev, payload, snap_rev FROM sessions WHERE sid = ?", (sid,)
+        ).fetchone()
+        if not row:
+            return None
+        rev, payload, snap = row
+        if snap is None or snap == rev:
+            return rev, payload
+        return rev, _replay(payload, self.events(sid, snap, rev))
+
+    def revision(self, sid: str):
+        row = self._conn().execute(
+            "SELECT rev FROM sessions WHERE sid = ?", (sid,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid: str, payload: str, expected_rev: int | None = None,
+             event: dict | None = None) -> int:
+        return self._write(sid, expected_rev, event, payload, snapshot=True)
+
+    def append(self, sid: str, expected_rev: int, event: dict, payload: str) -> int:
+        return self._write(sid, expected_rev, event, payload, snapshot=False)
 
+    def _write(self, sid, expected_rev, event, payload, snapshot: bool) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT rev, snap_rev FROM sessions WHERE sid = ?", (sid,)).fetchone()
+            current = row[0] if row else 0
+            if expected_rev is not None and expected_rev != current:
+                raise SessionConflict(current)
+            rev = current + 1
+            snap = row[1] if row and row[1] is not None else current
+            if snapshot or not row or rev - snap >= SESSION_SNAPSHOT_EVERY:
+                conn.execute(
+                    "INSERT INTO sessions (sid, rev, payload, snap_rev) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(sid) DO UPDATE SET rev = excluded.rev, payload = excluded.payload,"
+                    " snap_rev = excluded.snap_rev",
+                    (sid, rev, payload, rev),
+                )
+            else:
+                # O(Änderung): nur Revision hochzählen, Ereignis anhängen
+                conn.execute("UPDATE sessions SET rev = ?, snap_rev = ? WHERE sid = ?", (rev, snap, sid))
+            if event:
+                conn.execute("INSERT INTO session_events (sid, rev, event) VALUES (?, ?, ?)",
+                             (sid, rev, _event_json(event, rev)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rev
+
+    def events(self, sid: str, since: int = 0, until: int | None = None) -> list[str]:
+        rows = self._conn().execute(
+            "SELECT event FROM session_events WHERE sid = ? AND rev > ? AND rev <= ? ORDER BY rev",
+            (sid, since, until if until is not None else 1 << 62),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def delete(self, sid: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        conn.execute("DELETE FROM session_events WHERE sid = ?", (sid,))
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        row = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM sessions").fetchone()
+        ev = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(event)), 0) FROM session_events").fetchone()
+        return {"entries": row[0], "bytes": row[1], "events": ev[0], "event_bytes": ev[1]}
+
+
+class RedisBackend:
+    """Geteilter Speicher über das Redis-Protokoll (Redis/Valkey oder resp_fake).
+
+    Pro Session ein Hash {rev, payload, snap} plus ein Sorted Set
+    "<key>:events" (Score = rev); CAS per WATCH/MULTI/EXEC. Jeder
+    Schreibvorgang publiziert "<rev> <key>" auf einem Kanal – darüber verwerfen
+    alle Worker ihren lokalen Read-Cache (siehe SessionManager), statt vor
+    jedem Lesen die Revision abzufragen.
+    """
+
+    def __init__(self, url: str, prefix: str = "aiarch:session:", ttl: float = SESSION_TTL_SECONDS):
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self.channel = prefix + "invalidate"
+        self.ttl = int(ttl)
+        self._listeners = []
+        self._subscribed = threading.Event()
+        self._stats = {"published": 0, "received": 0, "reconnects": 0}
+
+    def _key(self, sid: str) -> str:
+        return self.prefix + sid
+
+    def _expire(self, key: str) -> list:
+        # Idle-TTL: Lesen und Schreiben verlängern Session und Ereignisse
+        return [("EXPIRE", key, self.ttl), ("EXPIRE", key + ":events", self.ttl)] if self.ttl else []
+
+    def load(self, sid: str):
+        key = self._key(sid)
+        rev, payload, snap = self.client.pipeline(("HMGET", key, "rev", "payload", "snap"),
+                                                  *self._expire(key))[0]
+        if rev is None:
+            return None
+        rev = int(rev)
+        if snap is None or int(snap) == rev:
+            return rev, payload
+        return rev, _replay(payload, self.events(sid, int(snap), rev))
+
+    def revision(self, sid: str):
+        rev = self.client.call("HGET", self._key(sid), "rev")
+        return int(rev) if rev is not None else None
+
+    def save(self, sid: str, payload: str, expected_rev: int | None = None,
+             event: dict | None = None) -> int:
+        return self._write(sid, expected_rev, event, payload, snapshot=True)
+
+    def append(self, sid: str, expected_rev: int, event: dict, payload: str) -> int:
+        return self._write(sid, expected_rev, event, payload, snapshot=False)
+
+    def _write(self, sid, expected_rev, event, payload, snapshot: bool) -> int:
+        key = self._key(sid)
+
+        def check(conn):
+            cur, snap = conn.call("HMGET", key, "rev", "snap")
+            current = int(cur) if cur is not None else 0
+            if expected_rev is not None and expected_rev != current:
+                raise SessionConflict(current)
+            snap = int(snap) if snap is not None else current
+            full = snapshot or cur is None or current + 1 - snap >= SESSION_SNAPSHOT_EVERY
+            return current + 1, full
+
+        def commands(state):
+            rev, full = state
+            if full:
+                cmds = [("HSET", key, "rev", rev, "payload", payload, "snap", rev)]
+            else:
+                cmds = [("HSET", key, "rev", rev)]   # O(Änderung): Ereignis statt Vollstand
+            if event:
+                cmds.append(("ZADD", key + ":events", rev, _event_json(event, rev)))
+            cmds += self._expire(key)
+            cmds.append(("PUBLISH", self.channel, f"{rev} {sid}"))
+            return cmds
+
+        while True:
+            result = self.client.transaction(key, check, commands)
+            if result is not None:
+                self._stats["published"] += 1
+                return result[0][0]
+            # Key wurde zwischen WATCH und EXEC geändert → neu prüfen (ggf. Konflikt)
+
+    def events(self, sid: str, since: int = 0, until: int | None = None) -> list[str]:
+        return self.client.call("ZRANGEBYSCORE", self._key(sid) + ":events", f"({since}",
+                                until if until is not None else "+inf")
+
+    def delete(self, sid: str) -> None:
+        key = self._key(sid)
+        self.client.pipeline(("DEL", key, key + ":events"), ("PUBLISH", self.channel, f"0 {sid}"))
+
+    # --- Pub/Sub-Invalidierung ---------------------------------------------
+    def on_invalidate(self, fn) -> None:
+        """fn(sid, rev) je fremdem/eigenem Schreibvorgang; fn(None, None) = alles verwerfen."""
+        self._listeners.append(fn)
+        if len(self._listeners) == 1:
+            threading.Thread(target=self._listen, name="session-invalidate", daemon=True).start()
+            self._subscribed.wait(timeout=5)
+
+    @property
+    def invalidation_live(self) -> bool:
+        return self._subscribed.is_set()
+
+    def _notify(self, sid, rev) -> None:
+        for fn in self._listeners:
+            fn(sid, rev)
+
+    def _listen(self) -> None:
+        delay = 0.5
+        while True:
+            conn = None
+            try:
+                conn = self.client.connect(timeout=None)
+                conn.send(("SUBSCRIBE", self.channel))
+                conn.read()
+                # während der Lücke verpasste Nachrichten → lokalen Cache komplett verwerfen
+                self._notify(None, None)
+                self._subscribed.set()
+                delay = 0.5
+                while True:
+                    msg = conn.read()
+                    if isinstance(msg, list) and len(msg) == 3 and msg[0] == "message":
+                        rev, _, sid = msg[2].partition(" ")
+                        self._stats["received"] += 1
+                        self._notify(sid, int(rev))
+            except (ConnectionError, OSError, ValueError) as e:
+                log.warning("Session-Invalidierung unterbrochen: %s", e)
+            finally:
+                self._subscribed.clear()
+                if conn is not None:
+                    conn.close()
+            self._stats["reconnects"] += 1
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+
+    def stats(self) -> dict:
+        return {"entries": self.client.call("DBSIZE"), "invalidation_live": self.invalidation_live,
+                **self._stats}
+
+
+def _backend_from_env():
+    kind = os.getenv("SESSION_BACKEND", "memory").lower()
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("SESSION_DB_PATH", "temp/sessions.db"))
+    if kind == "redis":
+        return RedisBackend(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"))
+    raise RuntimeError(f"Unbekanntes SESSION_BACKEND: {kind}")
+
+# -----------------------------------------------------
+# SessionManager
+# -----------------------------------------------------
 class SessionManager:
-    _store: dict[str, dict] = {} 
+    def __init__(self, backend=None):
+        self.backend = backend or _backend_from_env()
+        # Hot-Cache: sid -> (rev, payload); gültig solange rev == Backend-rev.
+        # Beim MemoryBackend liegen die Daten bereits im Prozess – kein zweiter Cache.
+        self._cache = None if isinstance(self.backend, MemoryBackend) else \
+            BoundedStore(max_bytes=SESSION_CACHE_BYTES, ttl=SESSION_TTL_SECONDS)
+        # Backends mit Push-Invalidierung (Redis): Cache gilt ohne Revisionsabfrage,
+        # solange das Abo steht; _inval_seq erkennt Invalidierungen während eines Ladevorgangs.
+        self._inval_seq = 0
+        if self._cache is not None and hasattr(self.backend, "on_invalidate"):
+            self.backend.on_invalidate(self._invalidate)
 
     def create_session(self):
         sid = str(uuid.uuid4())
-        self._store[sid] = {"elements": []}
+        self.update_session(sid, {"elements": []}, event="create")
         return {"session_id": sid}
 
+    def fork_session(self, sid: str, at: int | None = None) -> dict | None:
+        """Neue Session mit dem Stand von `sid` (optional Revision `at`); None, wenn nicht vorhanden.
+
+        Copy-on-write: der Fork verweist auf denselben payload-String wie die Eltern-
+        Session (im Prozess also kein zweites Exemplar) und sein Log beginnt mit einem
+        "fork"-Ereignis ohne Patch. Eigene Daten entstehen erst mit der ersten Änderung.
+        """
+        entry = self._load(sid)
+        if entry is None:
+            return None
+        rev, payload = entry
+        if at is not None and at != rev:
+            doc = self.replay(sid, at) if 0 < at < rev else None
+            if doc is None:
+                return None
+            rev, payload = at, json.dumps(doc, ensure_ascii=False)
+        child = str(uuid.uuid4())
+        ev = {"ts": time.time(), "kind": "fork", "input": {"parent": sid, "parent_rev": rev}, "patch": []}
+        seq = self._inval_seq
+        crev = self.backend.save(child, payload, 0, ev)
+        self._cache_put(child, crev, payload, seq)
+        return {"session_id": child, "parent": sid, "parent_rev": rev}
+
     def get_session(self, sid: str):
-        return self._store.setdefault(sid, {"elements": []})
+        """Session oder None – unbekannte IDs legen nichts mehr an."""
+        return self.get_session_rev(sid)[0]
+
+    def get_session_rev(self, sid: str, if_match: str | None = None, *, create: bool = False):
+        """Liefert (session, rev). Mit if_match wird die Revision vorab geprüft (412).
+
+        create=True (schreibende Endpunkte): unbekannte ID → leere Session mit rev 0,
+        gespeichert wird sie erst durch update_session(..., expected_rev=0).
+        """
+        entry = self._load(sid)
+        if entry is None:
+            if not create:
+                return None, None
+            data, rev = {"elements": []}, 0
+        else:
+            # jede Anfrage bekommt eine eigene Kopie – der Cache bleibt unverändert
+            rev, data = entry[0], json.loads(entry[1])
+        expected = parse_etag(if_match)
+        if expected is not None and expected != rev:
+            raise SessionConflict(rev, status_code=412)
+        return data, rev
+
+    def update_session(self, sid: str, data: dict, expected_rev: int | None = None,
+                       event: str = "write", inputs: dict | None = None) -> int:
+        """Schreibt die Session; mit expected_rev nur, wenn sich nichts geändert hat.
+
+        event/inputs landen im Ereignis-Log (Art der Änderung, auslösende Eingabe).
+        """
+        payload = json.dumps(data, ensure_ascii=False)
+        ev = {"ts": time.time(), "kind": event, "input": inputs or {}}
+        old = self._load(sid)
+        seq = self._inval_seq
+        if old is None:
+            ev["patch"] = [{"op": "replace", "path": "", "value": data}]
+            rev = self.backend.save(sid, payload, expected_rev, ev)
+        else:
+            base = old[0] if expected_rev is None else expected_rev
+            if base != old[0]:
+                raise SessionConflict(old[0])
+            ev["patch"] = json_patch.diff(json.loads(old[1]), data)
+            try:
+                rev = self.backend.append(sid, base, ev, payload)
+            except SessionConflict:
+                if expected_rev is not None:
+                    raise
+                # unbedingtes Schreiben, Vorstand war veraltet → voller Stand statt Diff
+                ev["patch"] = [{"op": "replace", "path": "", "value": data}]
+                rev = self.backend.save(sid, payload, None, ev)
+        self._cache_put(sid, rev, payload, seq)
+        return rev
+
+    def _save(self, key: str, payload: str, expected_rev: int | None = None) -> int:
+        seq = self._inval_seq
+        rev = self.backend.save(key, payload, expected_rev)
+        self._cache_put(key, rev, payload, seq)
+        return rev
+
+    def _cache_put(self, key: str, rev: int, payload: str, seq: int) -> None:
+        if self._cache is None:
+            return
+        if seq == self._inval_seq:
+            self._cache.put(key, rev, payload)
+        else:
+            self._cache.pop(key)   # parallel invalidiert – evtl. schon überholt
+
+    # --- Ereignis-Log ------------------------------------------------------
+    def events(self, sid: str, since: int = 0, until: int | None = None) -> list[dict]:
+        return [e if isinstance(e, dict) else json.loads(e) for e in self.backend.events(sid, since, until)]
+
+    def patch_since(self, sid: str, since: int, rev: int) -> list[dict] | None:
+        """Zusammengesetzter Patch von Revision `since` bis `rev`; None, wenn nicht (mehr) vorhanden."""
+        if since == rev:
+            return []
+        if since > rev or rev - since > SESSION_DELTA_LIMIT:
+            return None
+        evs = self.events(sid, since, rev)
+        if [e["rev"] for e in evs] != list(range(since + 1, rev + 1)):
+            return None
+        return [op for e in evs for op in e["patch"]]
+
+    def replay(self, sid: str, rev: int) -> dict | None:
+        """Stand zur Revision `rev` aus dem Log rekonstruieren; None, wenn das Log lückenhaft ist."""
+        evs = self.events(sid, 0, rev)
+        if not evs or [e["rev"] for e in evs] != list(range(1, rev + 1)):
+            return None
+        doc = None
+        for e in evs:
+            if e["kind"] == "fork":
+                doc = self.replay(e["input"]["parent"], e["input"]["parent_rev"])
+                if doc is None:
+                    return None
+                continue
+            doc = json_patch.apply(doc, e["patch"])
+        return doc
+
+    # --- Nebendokumente einer Session (z. B. Historie) unter "<sid>#<name>" ---
+    def get_aux(self, sid: str, name: str):
+        """Liefert (data, rev); (None, 0), wenn es das Dokument noch nicht gibt."""
+        entry = self._load(f"{sid}#{name}")
+        return (json.loads(entry[1]), entry[0]) if entry else (None, 0)
+
+    def update_aux(self, sid: str, name: str, data: dict, expected_rev: int | None = None) -> int:
+        return self._save(f"{sid}#{name}", json.dumps(data, ensure_ascii=False), expected_rev)
+
+    def delete_aux(self, sid: str, name: str) -> None:
+        key = f"{sid}#{name}"
+        self.backend.delete(key)
+        if self._cache is not None:
+            self._cache.pop(key)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "store": self.backend.stats(),
+            "cache": self._cache.snapshot() if self._cache is not None else None,
+        }
+
+    def _invalidate(self, sid: str | None, rev: int | None) -> None:
+        self._inval_seq += 1
+        if sid is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate(sid, rev)
 
-    def update_session(self, sid: str, data: dict):
-        self._store[sid] = data
+    def _load(self, sid: str):
+        if self._cache is None:
+            return self.backend.load(sid)
+        if getattr(self.backend, "invalidation_live", False):
+            cached = self._cache.get(sid)
+            if cached:
+                return cached
+            seq = self._inval_seq
+            entry = self.backend.load(sid)
+            if entry is not None and seq == self._inval_seq:
+                self._cache.put(sid, *entry)
+            return entry
+        rev = self.backend.revision(sid)
+        if rev is None:
+            self._cache.pop(sid)
+            return None
+        cached = self._cache.get(sid)
+        if cached and cached[0] == rev:
+            return cached
+        entry = self.backend.load(sid)
+        if entry is not None:
+            self._cache.put(sid, *entry)
+        return entry
 
-session_manager = SessionManager()
\ No newline at end of file
+session_manager = SessionManager()
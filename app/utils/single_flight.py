@@ -0,0 +1,42 @@
+import asyncio
+
+# -----------------------------------------------------
+# Single-Flight: gleichzeitige identische Aufrufe teilen sich ein Ergebnis
+# -----------------------------------------------------
+# Der erste Aufruf zu einem Schlüssel startet die Arbeit als Task, alle
+# weiteren, die eintreffen, solange sie läuft, warten auf denselben Task
+# (Ergebnis oder Exception). Danach ist der Schlüssel wieder frei – es ist
+# kein Cache.
+#
+# Bricht der erste Aufrufer ab (Client weg), läuft der Task für die übrigen
+# weiter (shield). Nur innerhalb eines Prozesses und einer Event-Loop.
+
+class SingleFlight:
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.stats = {"leaders": 0, "shared": 0}
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def do(self, key: str, fn):
+        """fn() → Awaitable; liefert (Ergebnis, shared)."""
+        task = self._tasks.get(key)
+        shared = task is not None and task.get_loop() is asyncio.get_running_loop()
+        if shared:
+            self.stats["shared"] += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            self.stats["leaders"] += 1
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        return await asyncio.shield(task), shared
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()        # als abgeholt markieren, falls niemand mehr wartet
+
+    def snapshot(self) -> dict:
+        return {"in_flight": self.in_flight(), **self.stats}
@@ -1,18 +1,21 @@
 from __future__ import annotations
 
-from fastapi import FastAPI, Body, HTTPException  
+from fastapi import FastAPI, Body, HTTPException, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from ezdxf.enums import const
 
 import ezdxf
+import logging
 import os
 import uuid
 import json
 import re
+import time
+from hashlib import sha256
 
 from dotenv import load_dotenv
-from openai import OpenAI
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -22,33 +25,29 @@ from app.cad.surface import draw_surface_top_segments, draw_surface_top, registe
 from app.cad.passages import register_layers as reg_pass, draw_pass_front
 
 from app.services.lv_matcher import best_matches_batch, parse_aufmass
+from app.services import prompt_context, prompt_templates, instruction_parser
+from app.services.llm_cache import llm_cache
+from app.services import llm_client, llm_resilience, llm_tracing, model_router, token_budget
+from app.services.llm_limiter import limiter
 from app.invoices.builder import make_invoice
 from app.routes import billing_routes
 from app.routes import lv_routes
 # from app.routes import payment_routes
 
-from app.utils.session_manager import session_manager
-
-from langsmith.wrappers import wrap_openai
+from app.utils.session_manager import session_manager, etag, SessionConflict
+from app.utils import aufmass_store
+from app.utils.element_index import ElementIndex, Kind, kind_of, kind_of_type
+from app.utils import history
+from app.utils.history import RevisionHistory
+from app.utils.json_stream import JsonObjectScanner
+from app.utils.single_flight import SingleFlight
 
 app = FastAPI()
+log = logging.getLogger(__name__)
 
 # Lädt automatisch die .env-Datei aus dem aktuellen Verzeichnis
 load_dotenv()
 
-# Langsmith-key
-os.environ["LANGSMITH_TRACING"] = "true"
-os.environ["LANGSMITH_ENDPOINT"] = "https://api.smith.langchain.com"
-os.getenv("LANGSMITH_API_KEY")
-os.getenv("LANGSMITH_PROJECT")
-os.environ["LANGSMITH_DEBUG"] = "true"
-
-# OpenAI-Key
-client = wrap_openai(OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://openrouter.ai/api/v1",
-))
-
 # CORS, falls nötig
 app.add_middleware(
     CORSMiddleware,
@@ -56,6 +55,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"], 
+    expose_headers=["ETag", "X-Context-Tokens-Saved"],
 )
 
 class MatchRequest(BaseModel):
@@ -76,19 +76,13 @@ app.include_router(lv_routes.router, tags=["LV"])
 # -----------------------------------------------------
 # START HELPER ADD-MODE
 # -----------------------------------------------------
-def _surfaces_for_trench(all_surfaces, trench_idx_1based: int):
-    # keep original order; if "seq" is set, sort by it
-    lst = [s for s in all_surfaces if int(s.get("for_trench", 0)) == trench_idx_1based]
-    if any("seq" in s for s in lst):
-        lst = sorted(lst, key=lambda s: int(s.get("seq", 1)))
-    return lst
-
-def _normalize_and_reindex(session: dict) -> None:
+def _normalize_and_reindex(session: dict) -> ElementIndex:
+    aufmass_store.migrate_legacy(session)
     elems = session.setdefault("elements", [])
-    def tnorm(e): return e.get("type", "").lower()
 
     # ... Baugräben reindizieren wie gehabt ...
-    trenches = [e for e in elems if "baugraben" in tnorm(e)]
+    kinds = [kind_of(e) for e in elems]
+    trenches = [e for e, k in zip(elems, kinds) if k is Kind.TRENCH]
     old_idx = [int(e.get("trench_index", i+1)) for i, e in enumerate(trenches)]
     idx_map = {}
     for new_i, (bg, old_i) in enumerate(zip(trenches, old_idx), start=1):
@@ -100,10 +94,8 @@ def _normalize_and_reindex(session: dict) -> None:
     pass_buffer = []   # Durchstiche ohne 'between' sammeln
     join_buffer = []   # Verbindungen ohne 'between' (z. B. group) sammeln
 
-    for e in elems:
-        tt = tnorm(e)
-
-        if "baugraben" in tt:
+    for e, k in zip(elems, kinds):
+        if k is Kind.TRENCH:
             # GOK normalisieren
             if "gok" not in e or e["gok"] in (None, ""):
                 e["gok"] = 0.0
@@ -114,7 +106,7 @@ def _normalize_and_reindex(session: dict) -> None:
             # nur Nicht-Baugräben bereinigen
             e.pop("trench_index", None)
 
-        if "rohr" in tt or "oberflächenbefest" in tt or "oberflaechenbefest" in tt:
+        if k is Kind.PIPE or k is Kind.SURFACE:
             ref = int(e.get("for_trench", 0))
             if ref in idx_map:
                 e["for_trench"] = idx_map[ref]
@@ -123,7 +115,7 @@ def _normalize_and_reindex(session: dict) -> None:
                 e["for_trench"] = N
                 keep.append(e)
             # sonst verwerfen
-        elif "durchstich" in tt:
+        elif k is Kind.PASS:
             b = e.get("between")
             if b is not None:
                 b = int(b or 0)
@@ -134,7 +126,7 @@ def _normalize_and_reindex(session: dict) -> None:
             else:
                 # später nummerieren
                 pass_buffer.append(e)
-        elif "verbindung" in tt:
+        elif k is Kind.JOIN:
             # bevorzugt 'between'; alternativ 'group' → expandieren
             if "between" in e and e["between"] is not None:
                 b = int(e.get("between") or 0)
@@ -167,7 +159,7 @@ def _normalize_and_reindex(session: dict) -> None:
         # sonst verwerfen (mehr Durchstiche als Nahtstellen)
 
     # Oberflächen-seq wie gehabt ...
-    surfaces = [e for e in keep if ("oberflächenbefest" in tnorm(e) or "oberflaechenbefest" in tnorm(e))]
+    surfaces = [e for e in keep if kind_of(e) is Kind.SURFACE]
     from collections import defaultdict
     buckets = defaultdict(list)
     for s in surfaces:
@@ -178,7 +170,7 @@ def _normalize_and_reindex(session: dict) -> None:
             s["seq"] = k
 
     # --- Max. 1 Durchstich pro Nahtstelle (zwischen N und N+1) behalten ---
-    pass_idxs = [i for i, e in enumerate(keep) if "durchstich" in tnorm(e)]
+    pass_idxs = [i for i, e in enumerate(keep) if kind_of(e) is Kind.PASS]
     seen_between = set()
     # von hinten nach vorn: den letzten Eintrag je 'between' behalten
     for i in reversed(pass_idxs):
@@ -193,9 +185,9 @@ def _normalize_and_reindex(session: dict) -> None:
             seen_between.add(b)
 
     # --- Verbindungen deduplizieren; wenn es einen Durchstich an derselben Naht gibt, hat dieser Vorrang ---
-    join_idxs = [i for i, e in enumerate(keep) if "verbindung" in tnorm(e)]
+    join_idxs = [i for i, e in enumerate(keep) if kind_of(e) is Kind.JOIN]
     join_seen = set()
-    pass_seams = {int(e.get("between", 0) or 0) for e in keep if "durchstich" in tnorm(e)}
+    pass_seams = {int(e.get("between", 0) or 0) for e in keep if kind_of(e) is Kind.PASS}
     for i in reversed(join_idxs):
         b = int(keep[i].get("between", 0) or 0)
         if not (1 <= b < N):
@@ -207,52 +199,26 @@ def _normalize_and_reindex(session: dict) -> None:
             join_seen.add(b)
 
     session["elements"] = keep
+    return ElementIndex(keep)
 
-def _pipes_for_trench(all_pipes, idx: int):
-    return [p for p in all_pipes if int(p.get("for_trench", 0)) == idx]
-
-def _first_pipe_for_trench(all_pipes, idx: int):
-    lst = _pipes_for_trench(all_pipes, idx)
-    return lst[0] if lst else None
-
-def _pass_for_between(all_passes, idx: int) -> Optional[dict]:
-    # bevorzugt neues Feld 'between', sonst Legacy-Fallback per Listenposition
-    by_between = [p for p in all_passes if p.get("between") is not None]
-    if by_between:
-        for p in by_between:
-            if int(p.get("between", 0)) == idx:
-                return p
-        return None
-    # Legacy: gleicher Listenindex wie linker Graben
-    return all_passes[idx-1] if 0 <= idx-1 < len(all_passes) else None
-
-def _tnorm(e: dict) -> str:
-    return e.get("type", "").lower()
-
-def _find_target_index_by_selection(elems: list[dict], sel: dict) -> Optional[int]:
+def _find_target_index_by_selection(ix: ElementIndex, sel: dict) -> Optional[int]:
     """sel = {type, trench_index? | for_trench? | between?, seq?}"""
-    t = (sel.get("type") or "").lower()
-
-    def is_surface(x): 
-        tx = _tnorm(x)
-        return ("oberflächenbefest" in tx) or ("oberflaechenbefest" in tx)
+    elems = ix.elems
+    k = kind_of_type(sel.get("type") or "")
 
-    if "baugraben" in t:
+    if k is Kind.TRENCH:
         ti = int(sel.get("trench_index", 0))
-        for i, e in enumerate(elems):
-            if "baugraben" in _tnorm(e) and int(e.get("trench_index", 0)) == ti:
-                return i
-        return None
+        return ix.trench_by_index.get(ti)
 
-    if "rohr" in t:
+    if k is Kind.PIPE:
         ft = int(sel.get("for_trench", 0))
-        cand = [i for i, e in enumerate(elems) if ("rohr" in _tnorm(e)) and int(e.get("for_trench", 0)) == ft]
+        cand = ix.pipes_by_trench.get(ft)
         return cand[0] if cand else None
 
-    if is_surface({"type": sel.get("type", "")}):
+    if k is Kind.SURFACE:
         ft = int(sel.get("for_trench", 0))
         seq = sel.get("seq", None)
-        cand = [(i, e) for i, e in enumerate(elems) if is_surface(e) and int(e.get("for_trench", 0)) == ft]
+        cand = [(i, elems[i]) for i in ix.surfaces_by_trench.get(ft, ())]
         if not cand:
             return None
         if seq is not None:
@@ -264,32 +230,28 @@ def _find_target_index_by_selection(elems: list[dict], sel: dict) -> Optional[in
         cand.sort(key=lambda p: int(p[1].get("seq", 10**9)))
         return cand[0][0]
 
-    if "durchstich" in t:
+    if k is Kind.PASS:
+        idxs = ix.positions.get(Kind.PASS, [])
         # Bevorzugt 'between' (zwischen N und N+1)
         if "between" in sel and sel["between"] is not None:
-            b = int(sel["between"])
-            cand = [i for i, e in enumerate(elems) if ("durchstich" in _tnorm(e)) and int(e.get("between", -1)) == b]
+            cand = ix.passes_by_between.get(int(sel["between"]))
             if cand:
                 return cand[0]
         # Legacy: n-ter Durchstich in Dokumentreihenfolge (falls explizit ordinal adressiert)
         if "ordinal" in sel and sel["ordinal"] is not None:
-            k = int(sel["ordinal"])
-            idxs = [i for i, e in enumerate(elems) if "durchstich" in _tnorm(e)]
-            if 1 <= k <= len(idxs):
-                return idxs[k-1]
+            n = int(sel["ordinal"])
+            if 1 <= n <= len(idxs):
+                return idxs[n-1]
         # Fallback: erster vorhandener Durchstich
-        idxs = [i for i, e in enumerate(elems) if "durchstich" in _tnorm(e)]
         return idxs[0] if idxs else None
 
-    if "verbindung" in t:
+    if k is Kind.JOIN:
         if "between" in sel and sel["between"] is not None:
-            b = int(sel["between"])
-            cand = [i for i, e in enumerate(elems)
-                    if ("verbindung" in _tnorm(e)) and int(e.get("between", -1)) == b]
+            cand = ix.joins_by_between.get(int(sel["between"]))
             if cand:
                 return cand[0]
         # Fallback: erste Verbindung
-        idxs = [i for i, e in enumerate(elems) if "verbindung" in _tnorm(e)]
+        idxs = ix.positions.get(Kind.JOIN, [])
         return idxs[0] if idxs else None
 
     return None
@@ -365,23 +327,12 @@ def _append_surface_segments_aufmass(
         remaining = max(0.0, remaining - seg_len)
 
 def _get_manual_aufmass_lines(session: dict) -> Optional[list[str]]:
-    elems = session.get("elements", [])
-    # jüngsten Override nehmen
-    for e in reversed(elems):
-        if (e.get("type","").lower() == "aufmass_override"
-            and isinstance(e.get("lines"), list)):
-            # trimmen + leere raus
-            return [str(x).strip() for x in e["lines"] if str(x).strip()]
-    return None
+    # Override liegt im derived-Slot (nicht mehr in "elements")
+    return aufmass_store.get_manual_lines(session)
 
 def _set_manual_aufmass_lines(session: dict, lines: list[str]) -> None:
-    # vorhandene Overrides entfernen (wir halten genau einen)
-    elems = session.setdefault("elements", [])
-    elems[:] = [e for e in elems if (e.get("type","").lower() != "aufmass_override")]
-    elems.append({
-        "type": "aufmass_override",
-        "lines": [str(x).strip() for x in lines if str(x).strip()],
-    })
+    # genau ein Override je Session
+    aufmass_store.set_manual_lines(session, lines)
 # -----------------------------------------------------
 # END HELPER ADD-MODE
 # -----------------------------------------------------
@@ -495,35 +446,33 @@ def _coerce_updates(upd: dict) -> dict:
     return out
 
 # --- Heuristik: wenn Selection unvollständig/uneindeutig -------------------
-def _resolve_selection_heuristic(elems: list[dict], sel: dict) -> Optional[int]:
-    t = _normalize_type_aliases(sel.get("type",""))
-    tn = t.lower()
-
-    def matches(i,e):
-        et = e.get("type","").lower()
-        if tn == "baugraben":
-            if "baugraben" not in et: return False
+def _resolve_selection_heuristic(ix: ElementIndex, sel: dict) -> Optional[int]:
+    elems = ix.elems
+    k = kind_of_type(_normalize_type_aliases(sel.get("type","")))
+
+    def matches(i):
+        e = elems[i]
+        if k is Kind.TRENCH:
             ti = sel.get("trench_index")
             return (ti is None) or (int(e.get("trench_index",0)) == int(ti))
-        if tn == "rohr":
-            if "rohr" not in et: return False
+        if k is Kind.PIPE:
             ft = sel.get("for_trench")
             return (ft is None) or (int(e.get("for_trench",0)) == int(ft))
-        if "oberflächenbefest" in tn or "oberflaechenbefest" in tn:
-            if ("oberflächenbefest" not in et) and ("oberflaechenbefest" not in et): return False
+        if k is Kind.SURFACE:
             ft = sel.get("for_trench"); seq = sel.get("seq")
             ok = True
             if ft is not None: ok &= int(e.get("for_trench",0)) == int(ft)
             if seq is not None: ok &= int(e.get("seq",0) or 0) == int(seq)
             return ok
-        if tn == "durchstich":
-            if "durchstich" not in et: return False
+        if k is Kind.PASS:
             b = sel.get("between")
             if b is None: return True
             return int(e.get("between", -1)) == int(b)
         return False
 
-    cand = [i for i,e in enumerate(elems) if matches(i,e)]
+    # nur Elemente der passenden Art prüfen
+    by_type = ix.positions.get(k if k in (Kind.TRENCH, Kind.PIPE, Kind.PASS) else Kind.SURFACE, [])
+    cand = [i for i in by_type if matches(i)]
     if len(cand) == 1:
         return cand[0]
     if len(cand) > 1:
@@ -531,28 +480,19 @@ def _resolve_selection_heuristic(elems: list[dict], sel: dict) -> Optional[int]:
         return cand[-1]
 
     # Fallback: Typ alleine
-    def typ(i,e):
-        et = e.get("type","").lower()
-        if tn == "baugraben": return "baugraben" in et
-        if tn == "rohr": return "rohr" in et
-        if tn == "durchstich": return "durchstich" in et
-        return ("oberflächenbefest" in et) or ("oberflaechenbefest" in et)
-
-    cand = [i for i,e in enumerate(elems) if typ(i,e)]
-    if len(cand) == 1:
-        return cand[0]
-    if len(cand) > 1:
-        return cand[-1]
+    if len(by_type) == 1:
+        return by_type[0]
+    if len(by_type) > 1:
+        return by_type[-1]
     return None
 
-def _build_edit_context(session: dict) -> str:
-    elems = session.get("elements", [])
-    def tnorm(e): return (e.get("type","") or "").lower()
+def _build_edit_context(session: dict, ix: Optional[ElementIndex] = None) -> str:
+    ix = ix or ElementIndex(session.get("elements", []))
 
-    trenches = [e for e in elems if "baugraben" in tnorm(e)]
-    pipes    = [e for e in elems if "rohr" in tnorm(e)]
-    passes   = [e for e in elems if "durchstich" in tnorm(e)]
-    surfs    = [e for e in elems if ("oberflächenbefest" in tnorm(e) or "oberflaechenbefest" in tnorm(e))]
+    trenches = ix.of_kind(Kind.TRENCH)
+    pipes    = ix.of_kind(Kind.PIPE)
+    passes   = ix.of_kind(Kind.PASS)
+    surfs    = ix.of_kind(Kind.SURFACE)
 
     from collections import defaultdict
     surf_idx = defaultdict(list)
@@ -594,6 +534,261 @@ def _coerce_updates(upd: dict) -> dict:
 # END HELPER GEFÄLLE
 # -----------------------------------------------------
 
+# -----------------------------------------------------
+# START HELPER HISTORIE (Undo/Redo)
+# -----------------------------------------------------
+HISTORY_RETRIES = int(os.getenv("SESSION_HISTORY_RETRIES", "10"))
+
+def _load_history(session_id: str, session: dict, rev: int) -> tuple[RevisionHistory, int]:
+    data, hrev = session_manager.get_aux(session_id, "history")
+    hist = RevisionHistory(data)
+    hist.begin(rev, session.get("elements", []))
+    return hist, hrev
+
+def _save_history(session_id: str, hist: RevisionHistory, hrev: int, apply) -> None:
+    # Die Session ist bereits geschrieben und maßgeblich; der Index ist klein –
+    # bei Konflikt neu laden und den Schritt erneut anwenden
+    for _ in range(HISTORY_RETRIES):
+        try:
+            session_manager.update_aux(session_id, "history", hist.to_dict(), expected_rev=hrev)
+            break
+        except SessionConflict:
+            data, hrev = session_manager.get_aux(session_id, "history")
+            hist = RevisionHistory(data)
+            apply(hist)
+    else:
+        # Lücke im Index: Undo/Redo darüber hinweg verweigert die Prüfung in history.apply
+        log.error("Historie von Session %s nach %d Konflikten nicht gespeichert",
+                  session_id, HISTORY_RETRIES)
+        return
+    for rid in hist.dropped:
+        session_manager.delete_aux(session_id, history.record_name(rid))
+
+def _commit(session_id: str, session: dict, rev: int, response: Response | None,
+            hist: RevisionHistory, hrev: int, label: str, inputs: dict | None = None) -> int:
+    """Session per CAS speichern (Ereignis `label`), ETag setzen, Stand in die Historie aufnehmen.
+
+    response=None bei Streams – dort geht der ETag mit dem result-Ereignis raus.
+    """
+    rev = session_manager.update_session(session_id, session, expected_rev=rev,
+                                         event=label, inputs=inputs)
+    if response is not None:
+        response.headers["ETag"] = etag(rev)
+    elements = session.get("elements", [])
+    # Revision gehört nach erfolgreichem CAS nur uns → Delta ohne CAS, genau einmal
+    session_manager.update_aux(session_id, history.record_name(rev), hist.delta(elements))
+    record = lambda h: h.record(rev, len(elements), label)
+    record(hist)
+    _save_history(session_id, hist, hrev, record)
+    return rev
+
+def _reply(session_id: str, session: dict, rev: int, since: Optional[int], **fields) -> dict:
+    """Antwort mit ganzer Session oder – mit ?since=<rev> – nur dem JSON Patch (RFC 6902)."""
+    if since is not None:
+        patch = session_manager.patch_since(session_id, since, rev)
+        if patch is not None:
+            return {"status": "ok", "base_rev": since, "rev": rev, "patch": patch, **fields}
+    # kein Delta möglich (zu alt / unbekannt) → vollständiger Stand
+    return {"status": "ok", "rev": rev, "updated_json": session, **fields}
+# -----------------------------------------------------
+# END HELPER HISTORIE
+# -----------------------------------------------------
+
+# -----------------------------------------------------
+# START HELPER IDEMPOTENZ (Single-Flight + Idempotency-Key)
+# -----------------------------------------------------
+# Doppelklicks, Frontend-Retries, mehrere Tabs: dieselbe Mutation auf
+# denselben Sessionstand wird nur einmal ausgeführt.
+#   • gleichzeitig: Schlüssel Session + Revision + Endpunkt + normalisierte
+#     Eingabe → Single-Flight, alle Anfragen bekommen das Ergebnis der ersten
+#   • Header Idempotency-Key: Revision + Antwortfelder werden im Neben-
+#     dokument "idempotency" der Session gemerkt. Eine Wiederholung liefert
+#     die ursprüngliche Antwort (Idempotent-Replayed: true), auch wenn ihr
+#     If-Match inzwischen veraltet ist. Gleicher Key, andere Eingabe → 422.
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS    = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100"))    # je Session
+
+_mutations = SingleFlight()
+_idem_stats = {"replayed": 0, "rejected": 0}
+
+def _norm_input(v):
+    if isinstance(v, str):
+        return " ".join(v.split()).casefold()
+    if isinstance(v, list):
+        return [_norm_input(x) for x in v]
+    return v
+
+def _fingerprint(label: str, inputs: dict) -> str:
+    raw = json.dumps({"label": label, **{k: _norm_input(v) for k, v in inputs.items()}},
+                     sort_keys=True, ensure_ascii=False)
+    return sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def _idempotent_replay(session_id: str, key: str, label: str, inputs: dict,
+                       since: Optional[int]) -> dict | None:
+    """Gemerkte Antwort zu `key` neu aufbauen; None, wenn unbekannt oder abgelaufen."""
+    data, _ = session_manager.get_aux(session_id, "idempotency")
+    rec = (data or {}).get(key)
+    if rec is None or time.time() - rec["ts"] > IDEMPOTENCY_TTL_SECONDS:
+        return None
+    if rec["fp"] != _fingerprint(label, inputs):
+        _idem_stats["rejected"] += 1
+        raise HTTPException(422, "Idempotency-Key wurde bereits für eine andere Anfrage verwendet.")
+    session, rev = session_manager.get_session_rev(session_id)
+    state = session if rev == rec["rev"] else session_manager.replay(session_id, rec["rev"])
+    if state is not None:
+        rev = rec["rev"]
+    _idem_stats["replayed"] += 1
+    # Log lückenhaft → aktueller Stand
+    return _reply(session_id, state if state is not None else session, rev, since, **rec["fields"])
+
+def _remember_idempotent(session_id: str, key: str, label: str, inputs: dict, rev: int,
+                         fields: dict) -> None:
+    now = time.time()
+    for _ in range(3):
+        data, arev = session_manager.get_aux(session_id, "idempotency")
+        recs = {k: r for k, r in (data or {}).items() if now - r["ts"] <= IDEMPOTENCY_TTL_SECONDS}
+        recs[key] = {"fp": _fingerprint(label, inputs), "rev": rev, "fields": fields, "ts": now}
+        recs = dict(sorted(recs.items(), key=lambda kv: kv[1]["ts"])[-IDEMPOTENCY_MAX_KEYS:])
+        try:
+            session_manager.update_aux(session_id, "idempotency", recs, expected_rev=arev)
+            return
+        except SessionConflict:
+            continue
+
+async def _mutate(session_id: str, label: str, inputs: dict, since: Optional[int],
+                  if_match: Optional[str], idempotency_key: Optional[str], response: Response,
+                  run) -> dict:
+    """Mutation einmalig ausführen (Single-Flight, Idempotency-Key) und beantworten.
+
+    run(session, rev) → (session, neue rev, Antwortfelder); die Antwort (Patch
+    seit ?since= oder ganzer Stand) baut jede Anfrage für sich.
+    """
+    if idempotency_key:
+        replay = await run_in_threadpool(_idempotent_replay, session_id, idempotency_key, label,
+                                         inputs, since)
+        if replay is not None:
+            response.headers["ETag"] = etag(replay["rev"])
+            response.headers["Idempotent-Replayed"] = "true"
+            return replay
+
+    session, rev = await run_in_threadpool(session_manager.get_session_rev, session_id, if_match,
+                                           create=True)
+    fp = _fingerprint(label, inputs)
+    key = f"{session_id}|key|{idempotency_key}" if idempotency_key else f"{session_id}|{rev}|{fp}"
+
+    async def leader():
+        out = await run(session, rev)
+        if idempotency_key:
+            await run_in_threadpool(_remember_idempotent, session_id, idempotency_key, label,
+                                    inputs, out[1], out[2])
+        return out, fp
+
+    ((session, rev, fields), leader_fp), shared = await _mutations.do(key, leader)
+    if leader_fp != fp:
+        # gleicher Idempotency-Key, gleichzeitig mit anderer Eingabe
+        _idem_stats["rejected"] += 1
+        raise HTTPException(422, "Idempotency-Key wurde bereits für eine andere Anfrage verwendet.")
+    response.headers["ETag"] = etag(rev)
+    if shared:
+        response.headers["X-Coalesced"] = "true"
+    return await run_in_threadpool(_reply, session_id, session, rev, since, **fields)
+# -----------------------------------------------------
+# END HELPER IDEMPOTENZ
+# -----------------------------------------------------
+
+# -----------------------------------------------------
+# START HELPER MODELL-ROUTER
+# -----------------------------------------------------
+async def _routed_json(task: str, text: str, messages: list[dict], llm: dict, accept=None) -> dict:
+    """LLM-Aufruf auf der vom Router gewählten Stufe, Antwort als JSON.
+
+    accept(data) prüft die Antwort: False oder HTTPException (4xx) → einmal mit
+    der genauen Stufe wiederholen. Auf der letzten Stufe gilt False als brauchbar,
+    die HTTPException wird weitergereicht.
+    """
+    route = model_router.route(task, text)
+    while True:
+        content = await model_router.complete(route, messages=messages, **llm)
+        try:
+            data = json.loads(content)
+            if not isinstance(data, dict):
+                raise ValueError("Antwort ist kein JSON-Objekt")
+            ok = accept(data) if accept else True
+        except (ValueError, HTTPException) as e:
+            err, ok = e, False
+        else:
+            err = None
+        model_router.outcome(route, bool(ok))
+        nxt = None if ok else model_router.escalate(route)
+        if nxt is None:
+            if isinstance(err, HTTPException):
+                raise err
+            if err is not None:
+                raise HTTPException(500, f"Fehler ChatGPT: {err}")
+            return data
+        route = nxt
+# -----------------------------------------------------
+# END HELPER MODELL-ROUTER
+# -----------------------------------------------------
+
+# -----------------------------------------------------
+# START HELPER STREAMING (SSE)
+# -----------------------------------------------------
+# Ereignisse der /…/stream-Endpunkte:
+#   delta    {"text": …}      Rohausgabe des Modells
+#   element  {…}              neues Element (add), sobald sein Objekt geschlossen ist
+#   selection / set {…}       Zielauswahl bzw. Änderungen (edit)
+#   retry    {"tier": …}      Antwort unbrauchbar, genaue Stufe fragt neu –
+#                             bisherige delta-Texte verwerfen (add)
+#   result   wie die normale Antwort (Patch mit ?since=, sonst updated_json)
+#            plus "etag" – der ETag-Header ist beim Commit längst gesendet
+#   error    {"status", "detail"}
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class _BadOutput(HTTPException):
+    """Gestreamte Modellausgabe ist kein lesbares JSON."""
+
+    def __init__(self, exc: Exception):
+        super().__init__(500, f"Fehler ChatGPT: {exc}")
+
+async def _stream_llm(route, messages: list[dict], llm: dict, events: dict, out: dict, prep=None):
+    """Modellausgabe als SSE weiterreichen; das fertige JSON landet in `out`.
+
+    events = Feldname → Ereignisname für Objekte, die vorab gemeldet werden.
+    Kein Stufenwechsel – Teile der Antwort sind schon beim Client.
+    """
+    scanner = JsonObjectScanner()
+    parts = []
+    t0 = time.monotonic()
+    async for piece in llm_client.stream_completion(messages=messages, model=route.model, **llm):
+        parts.append(piece)
+        yield _sse("delta", {"text": piece})
+        for key, obj in scanner.feed(piece):
+            if key in events:
+                yield _sse(events[key], prep(obj) if prep else obj)
+    model_router.observe(route, time.monotonic() - t0)
+    try:
+        out.update(json.loads("".join(parts)))
+    except ValueError as e:
+        model_router.outcome(route, False)
+        raise _BadOutput(e)
+
+async def _sse_guard(gen):
+    # Fehler nach Stream-Beginn können keinen HTTP-Status mehr setzen → error-Ereignis
+    try:
+        async for chunk in gen:
+            yield chunk
+    except HTTPException as e:
+        yield _sse("error", {"status": e.status_code, "detail": e.detail})
+    except Exception as e:
+        yield _sse("error", {"status": 500, "detail": str(e)})
+# -----------------------------------------------------
+# END HELPER STREAMING
+# -----------------------------------------------------
+
 # -----------------------------------------------------
 # 1) START SESSION
 # -----------------------------------------------------
@@ -606,12 +801,36 @@ def start_session():
     """
     return session_manager.create_session()
 
+@app.post("/fork-session")
+def fork_session(session_id: str, response: Response, at: Optional[int] = None):
+    """Variante anlegen: neue Session mit demselben Stand, ohne LLM-Aufrufe (copy-on-write)."""
+    fork = session_manager.fork_session(session_id, at)
+    if fork is None:
+        raise HTTPException(404, "Session oder Revision unbekannt")
+    response.headers["ETag"] = etag(1)
+    return fork
+
 @app.get("/session")
-def get_session(session_id: str):
-    session = session_manager.get_session(session_id)
+def get_session(session_id: str, response: Response, since: Optional[int] = None):
+    session, rev = session_manager.get_session_rev(session_id)
     if session is None:
         raise HTTPException(status_code=404, detail="Session unknown")
-    return session
+    response.headers["ETag"] = etag(rev)
+    if since is None:
+        return session
+    return _reply(session_id, session, rev, since)
+
+@app.get("/metrics")
+def get_metrics():
+    """Laufzeit-Zähler (Session-Speicher, Verdrängungen …)."""
+    return {"sessions": session_manager.stats(), "prompt_context": prompt_context.stats(),
+            "prompt_templates": prompt_templates.stats(),
+            "add_parser": instruction_parser.stats(), "llm_cache": llm_cache.snapshot(),
+            "llm_client": llm_client.stats(), "llm_limiter": limiter.snapshot(),
+            "llm_resilience": llm_resilience.snapshot(), "llm_tracing": llm_tracing.stats(),
+            "model_router": model_router.stats(),
+            "mutations": {**_mutations.snapshot(), **_idem_stats},
+            "token_budget": token_budget.stats()}
 
 @app.get("/get-aufmass-lines")
 def get_aufmass_lines(session_id: str):
@@ -624,42 +843,25 @@ def get_aufmass_lines(session_id: str):
     if manual:
         return {"lines": manual}
 
-    # 2) sonst letzten "aufmass"-Block (Auto) in Zeilen aufsplitten
-    elems = session.get("elements", [])
-    last_auto = next(
-        (e for e in reversed(elems) if (e.get("type","").lower() == "aufmass")),
-        None
-    )
-    text = (last_auto or {}).get("text", "") or ""
-    # Header "Aufmaß:" entfernen und echte Zeilen liefern
-    lines = [
-        ln.strip() for ln in text.replace("\r","\n").split("\n")
-        if ln.strip() and not ln.strip().lower().startswith("aufmaß")
-    ]
-    return {"lines": lines}
+    # 2) sonst generierten Aufmaß-Block (Auto) in Zeilen aufsplitten
+    text = aufmass_store.get_auto_aufmass(session_id, session) or ""
+    return {"lines": aufmass_store.split_lines(text)}
 
 @app.post("/set-aufmass-lines")
-def set_aufmass_lines(req: AufmassLinesRequest):
-    session = session_manager.get_session(req.session_id)
-    if session is None:
-        raise HTTPException(404, "Session unknown")
+def set_aufmass_lines(req: AufmassLinesRequest, response: Response,
+                      if_match: Optional[str] = Header(None)):
+    session, rev = session_manager.get_session_rev(req.session_id, if_match, create=True)
 
     _set_manual_aufmass_lines(session, req.lines)
-    session_manager.update_session(req.session_id, session)
+    rev = session_manager.update_session(req.session_id, session, expected_rev=rev,
+                                         event="set-aufmass", inputs={"lines": req.lines})
+    response.headers["ETag"] = etag(rev)
     return {"status": "ok"}
 
 # -----------------------------------------------------
 # ADD ELEMENT
 # -----------------------------------------------------
-@app.post("/add-element")
-def add_element(session_id: str, description: str = Body(..., embed=True)):
-    session = session_manager.get_session(session_id)
-    if session is None:
-        raise HTTPException(status_code=404, detail="Session unknown")
-    
-    current_json = session
-
-    prompt = f"""
+_ADD_STATIC = """\
 Du bist eine reine JSON-API und darfst ausschließlich gültiges JSON
 (keine Kommentare, kein Markdown) zurückgeben.
 
@@ -705,13 +907,13 @@ ROHR-REGELN (Pflicht)
     „komplette Länge“, „volle Länge“)
 • Beispiel 1:
   „Zeichne Druckrohr mit Länge 6 m in BG 1, DN150.“
-  → {{"type":"Rohr","for_trench":1,"diameter":0.15,"length":6.0}}
+  → {"type":"Rohr","for_trench":1,"diameter":0.15,"length":6.0}
 • Beispiel 2:
   „Zeichne Druckrohr mit 6 m Länge und Versatz 2 m in BG 2.“
-  → {{"type":"Rohr","for_trench":2,"diameter":0.15,"length":6.0,"offset":2.0}}
+  → {"type":"Rohr","for_trench":2,"diameter":0.15,"length":6.0,"offset":2.0}
 • Beispiel 3:
   „Zeichne Druckrohr über die gesamte Länge in BG 1, DN200.“
-  → {{"type":"Rohr","for_trench":1,"diameter":0.20,"full_span":true}}
+  → {"type":"Rohr","for_trench":1,"diameter":0.20,"full_span":true}
 
 ────────────────────────────────────────────
 SETZE trench_index NUR BEI BAUGRABEN
@@ -720,9 +922,9 @@ SETZE trench_index NUR BEI BAUGRABEN
   grundsätzlich weglassen.
 • Ordinalzahlen („zweiter Baugraben“ …) wirken nur auf Baugräben.
 • Beispiel (RICHTIG)
-    {{ "type":"Rohr", "diameter":0.15 }}          # kein Index
+    { "type":"Rohr", "diameter":0.15 }          # kein Index
 • Beispiel (FALSCH – wird verworfen)
-    {{ "type":"Rohr", "diameter":0.15, "trench_index":2 }}
+    { "type":"Rohr", "diameter":0.15, "trench_index":2 }
 
 ────────────────────────────────────────────
 GELÄNDEOBERKANTE (GOK)
@@ -748,8 +950,8 @@ MEHRERE OBERFLÄCHEN PRO BAUGRABEN (STUFUNG)
      Oberfläche 2: Randzone 0,5, (Rest), Material: Gehwegplatten."
   ⇒
   [
-    {{"type":"Oberflächenbefestigung","for_trench":1,"seq":1,"offset":0.2,"length":5.0,"material":"Mosaiksteine"}},
-    {{"type":"Oberflächenbefestigung","for_trench":1,"seq":2,"offset":0.5,           "material":"Gehwegplatten"}}
+    {"type":"Oberflächenbefestigung","for_trench":1,"seq":1,"offset":0.2,"length":5.0,"material":"Mosaiksteine"},
+    {"type":"Oberflächenbefestigung","for_trench":1,"seq":2,"offset":0.5,           "material":"Gehwegplatten"}
   ]
 
 ────────────────────────────────────────────
@@ -762,7 +964,7 @@ DURCHSTICH-REGEL
 • Der Durchstich liegt immer zwischen dem benachbarten Baugraben N und N+1.
 • Formulierungen wie „Verbinde Baugraben X und Y mit Durchstich …“
   → Prüfe: |X−Y| == 1 (benachbart). Falls ja:
-     {{ "type":"Durchstich", "length": <L>, "between": min(X, Y) }}.
+     { "type":"Durchstich", "length": <L>, "between": min(X, Y) }.
     Falls nein: Erzeuge **kein** Element und schreibe in "answer",
     dass nur benachbarte Baugräben erlaubt sind.
 • Sätze im Perfekt/Präteritum („… wurde erstellt“, „… ist erstellt“)
@@ -770,22 +972,22 @@ DURCHSTICH-REGEL
 
 Beispiel A:
   "Verbinde Baugraben 1 und 2 mit Durchstich l=2"
-→ {{ "type":"Durchstich", "length":2.0, "between":1 }}
+→ { "type":"Durchstich", "length":2.0, "between":1 }
 
 Beispiel B:
   "Ein Durchstich mit einer Länge von 3 Metern wurde zwischen dem zweiten und dritten Baugraben erstellt."
-→ {{ "type":"Durchstich", "length":3.0, "between":2 }}
+→ { "type":"Durchstich", "length":3.0, "between":2 }
 
 ────────────────────────────────────────────
 VERBINDUNG OHNE DURCHSTICH
 ────────────────────────────────────────────
 • Verwende type="Verbindung", wenn Baugräben ohne Durchstich verbunden werden sollen.
 • Adressierung:
-    – Verbindung zwischen BG N und N+1:  {{"type":"Verbindung","between": N}}
+    – Verbindung zwischen BG N und N+1:  {"type":"Verbindung","between": N}
     – Liste: „Verbinde Baugraben 1, 2 und 3“
         → erzeuge zwei Objekte:
-           {{"type":"Verbindung","between":1}},
-           {{"type":"Verbindung","between":2}}
+           {"type":"Verbindung","between":1},
+           {"type":"Verbindung","between":2}
 • Es sind nur benachbarte Gräben erlaubt (|X−Y|==1). Nicht-benachbarte Paare werden ignoriert.
 • Verbindungen sind exklusiv: Falls an derselben Naht ein Durchstich existiert, hat der Durchstich Vorrang.
 • Verbindungen erzeugen KEINE Aufmaß-Zeilen.
@@ -798,7 +1000,7 @@ GEFÄLLE (optional)
 • Wenn depth_left/right gesetzt sind, MUSS "depth" = max(depth_left, depth_right) im Objekt stehen.
 Beispiel:
   „Baugraben 5x5m, Tiefe links 1,10 m, rechts 1,03 m“
-→ {{ "type":"Baugraben","length":5,"width":5,"depth_left":1.10,"depth_right":1.03,"depth":1.10 }}
+→ { "type":"Baugraben","length":5,"width":5,"depth_left":1.10,"depth_right":1.03,"depth":1.10 }
 
 ────────────────────────────────────────────
 MEHRERE OBJEKTE IN EINEM SATZ
@@ -848,9 +1050,9 @@ Wir arbeiten mit diesem JSON-Schema, wobei bei
 * Oberflächenbefestigung  ⇒  material + offset Pflicht sind,
 * Durchstich ⇒ length ist Pflicht; width nicht verwenden.
 
-{{
+{
   "elements": [
-    {{
+    {
       "type": "string",  # Baugraben | Rohr | Oberflächenbefestigung | Durchstich | Verbindung
       "trench_index": 0, # NUR bei Baugraben
       "for_trench": 0,   # NUR bei Nicht-Baugraben (1-basiger Verweis)
@@ -867,13 +1069,10 @@ Wir arbeiten mit diesem JSON-Schema, wobei bei
       "offset":   0.0,
       "pattern":  "",      # nur für Durchstich (Schraffur-Name)
       "gok":      0.0 
-    }}
+    }
   ],
   "answer": ""
-}}
-
-Aktuelles JSON:
-{json.dumps(current_json, indent=2)}
+}
 
 ────────────────────────────────────────────
 AUFGABE
@@ -882,7 +1081,7 @@ ACHTUNG:
 - Alle Maße in Metern.
 - „DN150“ o. Ä. wird als diameter = 0.15 erkannt.
 
-• Lies "{description}".
+• Lies die EINGABE (Nutzernachricht).
 • Erzeuge **genau so viele neue Objekte, wie die Beschreibung erfordert**.
   – Fehlt eine Stückzahl ⇒ 1 Objekt  
   – Stückzahl N ⇒ N Objekte  
@@ -895,49 +1094,216 @@ ACHTUNG:
 ────────────────────────────────────────────
 ANTWORTFORMAT  (genau so!)
 ────────────────────────────────────────────
-{{
+{
   "new_elements": [  ...NEUE Objekte...  ],
   "answer": "<max. 2 Sätze>"
-}}
+}
 """
 
-    resp = client.chat.completions.create(
-        model            = "qwen/qwen3-coder",
-        response_format  = {"type": "json_object"},
-        temperature      = 0.0,
-        max_tokens       = 500,
-        messages = [
-            {"role": "system", "content": "You are a JSON API."},
-            {"role": "user",   "content": prompt},
-        ],
-    )
-    new_json = json.loads(resp.choices[0].message.content)
+_PROMPT_ADD = prompt_templates.register("add-element", static=_ADD_STATIC, dynamic="""\
+BESTAND (kompakt):
+{context}
+
+EINGABE: "{description}"
+""")
+
+_ADD_LLM = dict(timeout=60, response_format={"type": "json_object"}, temperature=0.0,
+                max_tokens=500)      # Modell wählt model_router
+
+def _add_messages(current_json: dict, ix: ElementIndex, description: str, response: Response,
+                  aufmass: str | None = None, max_tokens: int = _ADD_LLM["max_tokens"]) -> list[dict]:
+    context = prompt_context.build_add_context(current_json, ix)
+    room = token_budget.available(_ADD_STATIC, _PROMPT_ADD.dynamic, description,
+                                  max_tokens=max_tokens)
+    if token_budget.count_tokens(context) > room:
+        # große Session: älteste Baugräben nur noch zusammengefasst
+        full_lines = context.count("\n")
+        context = prompt_context.build_add_context(current_json, ix, max_tokens=room,
+                                                   count=token_budget.count_tokens)
+        token_budget.trimmed(_PROMPT_ADD.name, max(0, full_lines - context.count("\n")))
+    saving = prompt_context.record_saving(current_json, context, aufmass=aufmass,
+                                          count=token_budget.count_tokens)
+    response.headers["X-Context-Tokens-Saved"] = str(saving["tokens_saved"])
+
+    return _PROMPT_ADD.messages(context=context, description=description)
+
+async def _llm_new_elements(session_id: str, current_json: dict, ix: ElementIndex, description: str,
+                            response: Response) -> dict:
+    aufmass = await run_in_threadpool(aufmass_store.stored_text, session_id)
+    # leere Element-Liste von der schnellen Stufe → genaue Stufe fragen
+    return await _routed_json("add", description,
+                              _add_messages(current_json, ix, description, response, aufmass),
+                              _ADD_LLM, accept=_has_new_elements)
+
+def _has_new_elements(new_json: dict) -> bool:
+    return bool(new_json.get("new_elements") or new_json.get("elements"))
+
+def _prep_new_element(el: dict) -> dict:
+    if kind_of(el) is Kind.TRENCH:
+        if "gok" not in el or el["gok"] is None or el["gok"] == "":
+            el["gok"] = 0.0
+        else:
+            mv = _num_to_meters(el["gok"])
+            el["gok"] = mv if mv is not None else 0.0
+    return el
 
+def _new_elements(new_json: dict) -> list:
     added = new_json.get("new_elements") or new_json.get("elements") or []
-
+    if not isinstance(added, list):
+        raise HTTPException(400, "Antwort enthielt keine Element-Liste")
     for el in added:
-        t = (el.get("type","") or "").lower()
-        if "baugraben" in t:
-            if "gok" not in el or el["gok"] is None or el["gok"] == "":
-                el["gok"] = 0.0
-            else:
-                mv = _num_to_meters(el["gok"])
-                el["gok"] = mv if mv is not None else 0.0
-
-        if not isinstance(added, list):
-            raise HTTPException(400, "Antwort enthielt keine Element-Liste")
+        _prep_new_element(el)
+    return added
 
+def _apply_add(current_json: dict, new_json: dict) -> None:
     # ⑤ Session aktualisieren
-    current_json["elements"].extend(added)
+    current_json["elements"].extend(_new_elements(new_json))
     _normalize_and_reindex(current_json)
-    session_manager.update_session(session_id, current_json)
+
+@app.post("/add-element")
+async def add_element(session_id: str, response: Response, description: str = Body(..., embed=True),
+                      since: Optional[int] = None,
+                      if_match: Optional[str] = Header(None),
+                      idempotency_key: Optional[str] = Header(None)):
+    # Session-I/O (SQLite/Redis) blockiert – im Threadpool, LLM-Aufruf dagegen async
+    async def run(current_json: dict, rev: int):
+        hist, hrev = await run_in_threadpool(_load_history, session_id, current_json, rev)
+        ix = ElementIndex(current_json.setdefault("elements", []))
+
+        # Standardformulierungen lokal parsen, sonst LLM
+        new_json = instruction_parser.parse_add(description, ix)
+        if new_json is None:
+            new_json = await _llm_new_elements(session_id, current_json, ix, description, response)
+
+        _apply_add(current_json, new_json)
+        rev = await run_in_threadpool(_commit, session_id, current_json, rev, response, hist, hrev,
+                                      "add-element", {"description": description})
+        return current_json, rev, {"answer": new_json.get("answer", "")}
 
     # Dann an den Client beides zurücksenden
-    return {
-        "status"      : "ok",
-        "updated_json": current_json,
-        "answer"      : new_json.get("answer", "")
-    }
+    return await _mutate(session_id, "add-element", {"description": description}, since, if_match,
+                         idempotency_key, response, run)
+
+@app.post("/add-element/stream")
+async def add_element_stream(session_id: str, description: str = Body(..., embed=True),
+                             since: Optional[int] = None,
+                             if_match: Optional[str] = Header(None)):
+    """Wie /add-element, aber als Server-Sent Events: jedes Element, sobald es fertig ist."""
+    session, rev = await run_in_threadpool(session_manager.get_session_rev, session_id, if_match,
+                                           create=True)
+    hist, hrev = await run_in_threadpool(_load_history, session_id, session, rev)
+    ix = ElementIndex(session.setdefault("elements", []))
+    local = instruction_parser.parse_add(description, ix)
+
+    async def events():
+        new_json = local or {}
+        if local is not None:
+            for el in local["new_elements"]:
+                yield _sse("element", _prep_new_element(el))
+        else:
+            route = model_router.route("add", description)
+            while True:
+                new_json.clear()
+                sent, failed = False, None
+                try:
+                    async for chunk in _stream_llm(route, messages, _ADD_LLM,
+                                                   {"new_elements": "element", "elements": "element"},
+                                                   new_json, prep=_prep_new_element):
+                        sent = sent or chunk.startswith("event: element")
+                        yield chunk
+                except _BadOutput as e:
+                    failed = e
+                if failed is None:
+                    model_router.outcome(route, _has_new_elements(new_json))
+                    if _has_new_elements(new_json):
+                        break
+                # wie /add-element: einmal die genaue Stufe – solange kein Element raus ist
+                nxt = None if sent else model_router.escalate(route)
+                if nxt is None:
+                    # kein Commit: eine leere Revision wäre nur Rauschen in ETag und Historie
+                    raise failed or HTTPException(422, "Keine Elemente erkannt – nichts angelegt.")
+                yield _sse("retry", {"tier": nxt.tier})
+                route = nxt
+        _apply_add(session, new_json)
+        new_rev = await run_in_threadpool(_commit, session_id, session, rev, None, hist, hrev,
+                                          "add-element", {"description": description})
+        yield _sse("result", await run_in_threadpool(_reply, session_id, session, new_rev, since,
+                                                     etag=etag(new_rev),
+                                                     answer=new_json.get("answer", "")))
+
+    resp = StreamingResponse(_sse_guard(events()), media_type="text/event-stream",
+                             headers=_SSE_HEADERS)
+    if local is None:
+        aufmass = await run_in_threadpool(aufmass_store.stored_text, session_id)
+        messages = _add_messages(session, ix, description, resp, aufmass)
+    return resp
+
+ADD_BULK_MAX_ITEMS = int(os.getenv("ADD_BULK_MAX_ITEMS", "15"))   # Einträge je LLM-Aufruf
+
+def _bulk_description(items: list[str]) -> str:
+    lines = "\n".join(f"{i}. {d}" for i, d in enumerate(items, start=1))
+    return ("Mehrere Einträge – der Reihe nach anlegen, spätere dürfen sich auf frühere "
+            f"beziehen:\n{lines}")
+
+@app.post("/add-element/bulk")
+async def add_element_bulk(session_id: str, response: Response,
+                           descriptions: List[str] = Body(..., embed=True),
+                           since: Optional[int] = None,
+                           if_match: Optional[str] = Header(None),
+                           idempotency_key: Optional[str] = Header(None)):
+    """Mehrere Beschreibungen (z. B. von einem Aufmaßblatt) in einem Schritt anlegen.
+
+    Standardformulierungen lokal, der Rest gebündelt in möglichst wenigen
+    LLM-Aufrufen; am Ende einmal normalisieren und einmal speichern.
+    """
+    items = [d for d in descriptions if d and d.strip()]
+    if not items:
+        raise HTTPException(400, "Keine Beschreibungen übergeben.")
+    return await _mutate(session_id, "add-elements", {"descriptions": items}, since, if_match,
+                         idempotency_key, response,
+                         lambda session, rev: _add_bulk(session_id, session, rev, items, response))
+
+async def _add_bulk(session_id: str, session: dict, rev: int, items: list[str],
+                    response: Response) -> tuple[dict, int, dict]:
+    hist, hrev = await run_in_threadpool(_load_history, session_id, session, rev)
+    session.setdefault("elements", [])
+
+    answers, local_hits, llm_calls = [], 0, 0
+    aufmass = None
+    i = 0
+    while i < len(items):
+        # _normalize_and_reindex ersetzt die Liste → jedes Mal frisch holen
+        ix = ElementIndex(session["elements"])
+        local = instruction_parser.parse_add(items[i], ix)
+        if local is not None:
+            session["elements"].extend(_new_elements(local))
+            answers.append(local["answer"])
+            local_hits += 1
+            i += 1
+            continue
+
+        # ab hier ein Block für das LLM – Reihenfolge bleibt erhalten
+        chunk = items[i:i + ADD_BULK_MAX_ITEMS]
+        text = chunk[0] if len(chunk) == 1 else _bulk_description(chunk)
+        llm = {**_ADD_LLM, "timeout": 90, "max_tokens": 300 * len(chunk) + 200}
+        if not llm_calls:
+            aufmass = await run_in_threadpool(aufmass_store.stored_text, session_id)
+        new_json = await _routed_json(
+            "add", text, _add_messages(session, ix, text, response, aufmass, llm["max_tokens"]),
+            llm, accept=_has_new_elements,
+        )
+        session["elements"].extend(_new_elements(new_json))
+        answers.append(new_json.get("answer", ""))
+        llm_calls += 1
+        i += len(chunk)
+        if i < len(items):
+            _normalize_and_reindex(session)     # Indizes für die folgenden Einträge
+
+    _normalize_and_reindex(session)
+    rev = await run_in_threadpool(_commit, session_id, session, rev, response, hist, hrev,
+                                  "add-elements", {"descriptions": items})
+    return session, rev, {"answer": " ".join(a for a in answers if a), "items": len(items),
+                          "local": local_hits, "llm_calls": llm_calls}
 
 # -----------------------------------------------------
 #  DXF generieren und Session aktualisieren
@@ -953,13 +1319,8 @@ def generate_dxf_by_session(session_id: str):
         # 2) DXF + Aufmaß erzeugen ---------------------
         dxf_file, aufmass_txt = _generate_dxf_intern(session)
 
-        # 3) Aufmaß in die Session einhängen -----------
-        session.setdefault("elements", [])
-        session["elements"].append({
-            "type": "aufmass",
-            "text": aufmass_txt,
-        })
-        session_manager.update_session(session_id, session)
+        # 3) Aufmaß als Nebendokument ablegen – Session/Revision bleiben unverändert
+        aufmass_store.set_auto_aufmass(session_id, session, aufmass_txt)
 
         # 4) Datei zurückgeben -------------------------
         return FileResponse(
@@ -968,6 +1329,8 @@ def generate_dxf_by_session(session_id: str):
             filename=os.path.basename(dxf_file),
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, f"DXF-Fehler: {e}")
 
@@ -986,20 +1349,13 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
     doc.header["$PSLTSCALE"] = 0
     doc.header["$PLINEGEN"] = 1.0
 
-    # ---------- Elemente vorsortieren ----------
-    trenches, pipes, surfaces, passes, joins = [], [], [], [], []
-    for el in parsed_json.get("elements", []):
-        t = el.get("type", "").lower()
-        if "baugraben"           in t: trenches.append(el)
-        elif "rohr"              in t: pipes.append(el)
-        elif "oberflächenbefest" in t: surfaces.append(el)
-        elif "durchstich"        in t: passes.append(el)
-        elif "verbindung"        in t: joins.append(el)
-
-    join_set = {int(j.get("between", 0) or 0) for j in joins if j.get("between") is not None}
+    # ---------- Elemente indizieren (einmal O(n), danach O(1)-Zugriffe) ----------
+    ix = ElementIndex(parsed_json.get("elements", []))
+    trenches = ix.of_kind(Kind.TRENCH)
+    join_set = ix.join_seams()
 
     def _has_link_between(seam_1based: int) -> bool:
-        return (_pass_for_between(passes, seam_1based) is not None) or (seam_1based in join_set)
+        return (ix.pass_between(seam_1based) is not None) or (seam_1based in join_set)
 
     if not trenches:
         raise HTTPException(400, "Kein Baugraben vorhanden – bitte zuerst /add-element benutzen.")
@@ -1089,7 +1445,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
     # Hilfsfunktion am Anfang von _generate_dxf_intern definieren (oder lokal im Block):
     def _is_join_only(seam_idx: int) -> bool:
         # True, wenn an Naht seam_idx nur "Verbindung" existiert (kein Durchstich)
-        return (seam_idx in join_set) and (_pass_for_between(passes, seam_idx) is None)
+        return (seam_idx in join_set) and (ix.pass_between(seam_idx) is None)
 
     def _pipe_full_and_want(pipe: dict):
         full = str(pipe.get("full_span", "")).lower() in ("true","1","yes")
@@ -1249,7 +1605,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
         x_start = trench_origin_x.get(i, cursor_x)
 
         # Gibt es direkt rechts von BG i einen Durchstich?
-        pas = _pass_for_between(passes, i+1)
+        pas = ix.pass_between(i+1)
         has_neighbor = (i+1 < len(trenches))
         merge_next = has_neighbor and _has_link_between(i+1)
 
@@ -1287,7 +1643,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
                 drawn_top.add(i+1)
 
             # Rohr: ebenfalls vom individuellen Bottom-Offset starten
-            pipe = _first_pipe_for_trench(pipes, i+1)
+            pipe = ix.first_pipe_for(i+1)
             if pipe:
                 d = float(pipe.get("diameter", 0) or 0)
                 if d > 0 and (i+1) not in drawn_pipe:
@@ -1310,7 +1666,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
                         drawn_pipe.add(i+1)
 
             # Oberflächen je Graben nur einmal
-            seg_list = _surfaces_for_trench(surfaces, i+1)
+            seg_list = ix.surfaces_for(i+1)
             if seg_list and (i+1) not in drawn_surface:
                 if any(float(s.get("length", 0) or 0) > 0 for s in seg_list):
                     draw_surface_top_segments(
@@ -1364,8 +1720,8 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
         T2_ref, T2_L, T2_R = _depths(bg2)
 
         # Gibt es an der Naht nur eine Verbindung (ohne Durchstich)?
-        join_only = (_pass_for_between(passes, i+1) is None) and ((i+1) in join_set)
-        pas = None if join_only else _pass_for_between(passes, i+1)
+        join_only = (ix.pass_between(i+1) is None) and ((i+1) in join_set)
+        pas = None if join_only else ix.pass_between(i+1)
         if not join_only and (not pas or "length" not in pas):
             raise HTTPException(400, "Durchstich ohne Länge (erwarte Feld 'length').")
         p_w  = 0.0 if join_only else float(pas["length"])
@@ -1444,7 +1800,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
         # -----------------------------
         # Oberflächen (einmal je BG, an der Naht nur bei Verbindung clippen)
         # -----------------------------
-        seg_list_L = _surfaces_for_trench(surfaces, i+1)
+        seg_list_L = ix.surfaces_for(i+1)
         if seg_list_L and (i+1) not in drawn_surface:
             if any(float(s.get("length", 0) or 0) > 0 for s in seg_list_L):
                 draw_surface_top_segments(
@@ -1479,7 +1835,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
                     )
             drawn_surface.add(i+1)
 
-        seg_list_R = _surfaces_for_trench(surfaces, i+2)
+        seg_list_R = ix.surfaces_for(i+2)
         if seg_list_R and (i+2) not in drawn_surface:
             if any(float(s.get("length", 0) or 0) > 0 for s in seg_list_R):
                 draw_surface_top_segments(
@@ -1859,7 +2215,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
                     if seam in join_set:
                         last_idx = idx + 1
                         continue
-                    p_next = _pass_for_between(passes, seam)
+                    p_next = ix.pass_between(seam)
                     if p_next is not None:
                         L_span += float(p_next["length"])
                         last_idx = idx + 1
@@ -1870,7 +2226,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
             # ein "voll durchgehendes" Rohr aus dem Cluster herausfischen
             pipe_src = None
             for k in range(i, last_idx + 1):
-                cand = _first_pipe_for_trench(pipes, k + 1)
+                cand = ix.first_pipe_for(k + 1)
                 if cand:
                     full, _ = _pipe_full_and_want(cand)
                     if full:
@@ -1897,7 +2253,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
                         if k < last_idx:
                             seam = k + 1
                             if seam not in join_set:
-                                p_between = _pass_for_between(passes, seam)
+                                p_between = ix.pass_between(seam)
                                 if p_between is not None:
                                     pw = float(p_between.get("length", 0) or 0.0)
                                     if pw > 1e-9:
@@ -1923,7 +2279,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
                             drawn_pipe.add(k + 1)
 
         # Einzelrohre links/rechts (falls nötig)
-        pipeL = _first_pipe_for_trench(pipes, i+1)
+        pipeL = ix.first_pipe_for(i+1)
         if pipeL and (i+1) not in drawn_pipe:
             dL = float(pipeL.get("diameter", 0) or 0)
             if dL > 0:
@@ -1943,7 +2299,7 @@ def _generate_dxf_intern(parsed_json) -> tuple[str, str]:
                     aufmass.append(f"Rohr {i+1}: l={effL} m  Ø={dL} m" + (f"  Versatz={offL} m" if offL else ""))
                     drawn_pipe.add(i+1)
 
-        pipeR = _first_pipe_for_trench(pipes, i+2)
+        pipeR = ix.first_pipe_for(i+2)
         if pipeR and (i+2) not in drawn_pipe:
             dR = float(pipeR.get("diameter", 0) or 0)
             if dR > 0:
@@ -2044,109 +2400,103 @@ def _explicit_trench_from_instruction(instr: str) -> int | None:
     m = _BG_IDX_RE.search(instr or "")
     return int(m.group(1)) if m else None
 
-@app.post("/edit-element")
-def edit_element(session_id: str, instruction: str = Body(..., embed=True)):
-    session = session_manager.get_session(session_id)
-    if session is None:
-        raise HTTPException(404, "Session unknown")
+_EDIT_STATIC = """\
+Du bist eine JSON-API und darfst AUSSCHLIESSLICH gültiges JSON liefern.
 
-    prompt = f"""
-    Du bist eine JSON-API und darfst AUSSCHLIESSLICH gültiges JSON liefern.
-
-    ANWEISUNG: {instruction!r}
-
-    KONTEXT (Bestand):
-    {_build_edit_context(session)}
-
-    ZIEL
-    • Bestimme GENAU EIN Zielobjekt und die zu ändernden Felder.
-    • Wenn die Anweisung „links“/„rechts“ enthält, ändere NUR das zugehörige Feld:
-    – links  → set.depth_left
-    – rechts → set.depth_right
-    Setze „depth“ NICHT zusätzlich; das System berücksichtigt die größte Tiefe intern.
-    • Formulierungen mit „weitere Tiefe“ / „zusätzliche Tiefe“ sind KEINE neuen Objekte,
-    sondern ein Feld-Update (z. B. set.depth_right = …).
-    • GOK (Geländeoberkante): negative/positive Werte in m sind zulässig.
-
-    BEISPIELE (sehr wichtig)
-    Eingabe: "Füge zum ersten Baugraben eine weitere Tiefe rechts mit 1,50 m hinzu."
-    Antwort:
-    {{
-    "selection": {{ "type": "Baugraben", "trench_index": 1 }},
-    "set": {{ "depth_right": 1.5 }},
-    "answer": "Tiefe rechts bei Baugraben 1 auf 1,50 m gesetzt."
-    }}
-    Eingabe: "Ändere bei Bg3 GOK auf -0,3"
-    Antwort:
-    {{
-    "selection": {{ "type": "Baugraben", "trench_index": 3 }},
-    "set": {{ "gok": -0.3 }},
-    "answer": "GOK bei Baugraben 3 auf -0,30 m gesetzt."
-    }}
-    Eingabe: "Setze bei Bg2 GOK auf -0,30 m"
-    Antwort:
-    {{
-    "selection": {{ "type": "Baugraben", "trench_index": 2 }},
-    "set": {{ "gok": -0.30 }},
-    "answer": "GOK bei Baugraben 2 auf -0,30 m gesetzt."
-    }}
-
-    ADRESSIERUNG
-    • Typen: "Baugraben" | "Rohr" | "Oberflächenbefestigung" | "Durchstich".
-    • Baugraben N        → selection.trench_index = N (1-basiert).
-    • Rohr im/zu Baugraben N → selection.for_trench = N.
-    • Oberflächenbefestigung im/zu Baugraben N → selection.for_trench=N, optional selection.seq=M.
-    • Durchstich zwischen Baugraben N und N+1 → selection.between = N.
-    • Synonyme verstehen: „BG“, „Graben“, „Druckrohr“, „Oberfläche“, „Gehwegplatten“, „Pflaster“, etc.
-
-    FALLBACKS
-    • Wenn die Anweisung keinen Index nennt und genau EIN passendes Objekt existiert,
-    adressiere dieses.
-    • Wenn mehrere existieren und kein Index genannt wird, wähle das zuletzt angelegte.
-
-    WAS NICHT TUN
-    • KEINE neuen Elemente hinzufügen oder löschen.
-    • KEIN 'trench_index' bei Nicht-Baugraben setzen.
-
-    ERLAUBTE ÄNDERUNGEN
-    length | width | depth | depth_left | depth_right | gok | diameter | material | offset | pattern
-    • „DN300“ o. ä. → diameter = 0.30 (Meter).
-    • Komma-/Punktwerte und Einheiten mm/cm/m korrekt interpretieren.
-
-    ANTWORT (exakt):
-    {{
-    "selection": {{
-        "type": "Baugraben | Rohr | Oberflächenbefestigung | Durchstich",
-        "trench_index": 0,
-        "for_trench": 0,
-        "seq": 0,
-        "between": 0,
-        "ordinal": 0
-    }},
-    "set": {{}},
-    "answer": "kurz auf Deutsch"
-    }}
-    """
+ZIEL
+• Bestimme GENAU EIN Zielobjekt und die zu ändernden Felder.
+• Wenn die Anweisung „links“/„rechts“ enthält, ändere NUR das zugehörige Feld:
+– links  → set.depth_left
+– rechts → set.depth_right
+Setze „depth“ NICHT zusätzlich; das System berücksichtigt die größte Tiefe intern.
+• Formulierungen mit „weitere Tiefe“ / „zusätzliche Tiefe“ sind KEINE neuen Objekte,
+sondern ein Feld-Update (z. B. set.depth_right = …).
+• GOK (Geländeoberkante): negative/positive Werte in m sind zulässig.
+
+BEISPIELE (sehr wichtig)
+Eingabe: "Füge zum ersten Baugraben eine weitere Tiefe rechts mit 1,50 m hinzu."
+Antwort:
+{
+"selection": { "type": "Baugraben", "trench_index": 1 },
+"set": { "depth_right": 1.5 },
+"answer": "Tiefe rechts bei Baugraben 1 auf 1,50 m gesetzt."
+}
+Eingabe: "Ändere bei Bg3 GOK auf -0,3"
+Antwort:
+{
+"selection": { "type": "Baugraben", "trench_index": 3 },
+"set": { "gok": -0.3 },
+"answer": "GOK bei Baugraben 3 auf -0,30 m gesetzt."
+}
+Eingabe: "Setze bei Bg2 GOK auf -0,30 m"
+Antwort:
+{
+"selection": { "type": "Baugraben", "trench_index": 2 },
+"set": { "gok": -0.30 },
+"answer": "GOK bei Baugraben 2 auf -0,30 m gesetzt."
+}
 
-    try:
-        response = client.chat.completions.create(
-            model="qwen/qwen3-coder",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": "You are a JSON API."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=400,
-            temperature=0.0,
-        )
-        data = json.loads(response.choices[0].message.content)
-    except Exception as e:
-        raise HTTPException(500, f"Fehler ChatGPT: {e}")
+ADRESSIERUNG
+• Typen: "Baugraben" | "Rohr" | "Oberflächenbefestigung" | "Durchstich".
+• Baugraben N        → selection.trench_index = N (1-basiert).
+• Rohr im/zu Baugraben N → selection.for_trench = N.
+• Oberflächenbefestigung im/zu Baugraben N → selection.for_trench=N, optional selection.seq=M.
+• Durchstich zwischen Baugraben N und N+1 → selection.between = N.
+• Synonyme verstehen: „BG“, „Graben“, „Druckrohr“, „Oberfläche“, „Gehwegplatten“, „Pflaster“, etc.
+
+FALLBACKS
+• Wenn die Anweisung keinen Index nennt und genau EIN passendes Objekt existiert,
+adressiere dieses.
+• Wenn mehrere existieren und kein Index genannt wird, wähle das zuletzt angelegte.
+
+WAS NICHT TUN
+• KEINE neuen Elemente hinzufügen oder löschen.
+• KEIN 'trench_index' bei Nicht-Baugraben setzen.
+
+ERLAUBTE ÄNDERUNGEN
+length | width | depth | depth_left | depth_right | gok | diameter | material | offset | pattern
+• „DN300“ o. ä. → diameter = 0.30 (Meter).
+• Komma-/Punktwerte und Einheiten mm/cm/m korrekt interpretieren.
+
+ANTWORT (exakt):
+{
+"selection": {
+    "type": "Baugraben | Rohr | Oberflächenbefestigung | Durchstich",
+    "trench_index": 0,
+    "for_trench": 0,
+    "seq": 0,
+    "between": 0,
+    "ordinal": 0
+},
+"set": {},
+"answer": "kurz auf Deutsch"
+}
+"""
+
+_PROMPT_EDIT = prompt_templates.register("edit-element", static=_EDIT_STATIC, dynamic="""\
+ANWEISUNG: {instruction}
 
+KONTEXT (Bestand):
+{context}
+""")
+
+_EDIT_LLM = dict(timeout=45, response_format={"type": "json_object"}, max_tokens=400,
+                 temperature=0.0)     # Modell wählt model_router
+
+def _edit_messages(session: dict, ix: ElementIndex, instruction: str) -> list[dict]:
+    return _PROMPT_EDIT.messages(instruction=repr(instruction), context=_build_edit_context(session, ix))
+
+def _has_selection(data: dict) -> bool:
+    sel = data.get("selection")
+    return isinstance(sel, dict) and bool(sel.get("type"))
+
+def _resolve_edit(ix: ElementIndex, data: dict, instruction: str) -> tuple[int, dict]:
+    """Zielelement und normalisierte Änderungen bestimmen – ändert nichts."""
     sel = data.get("selection") or {}
     updates_raw = data.get("set") or {}
     if not isinstance(sel, dict) or not sel.get("type"):
         raise HTTPException(400, "Ungültige LLM-Antwort: selection fehlt/leer.")
+    sel = dict(sel)
 
     # 1) Normalisieren
     sel["type"] = _normalize_type_aliases(sel["type"])
@@ -2162,8 +2512,7 @@ def edit_element(session_id: str, instruction: str = Body(..., embed=True)):
         updates["gok"] = 0.0
 
     # 2) Ziel finden (LLM-Auswahl → Backend-Heuristik als Fallback)
-    elems = session.setdefault("elements", [])
-    count_trenches = sum(1 for e in elems if (e.get("type","") or "").lower().startswith("baugraben"))
+    count_trenches = ix.count(Kind.TRENCH)
 
     # Harte Validierung: es muss existieren
     if sel.get("type","").lower().startswith("baugraben"):
@@ -2171,42 +2520,76 @@ def edit_element(session_id: str, instruction: str = Body(..., embed=True)):
         if ti < 1 or ti > count_trenches:
             raise HTTPException(404, f"Baugraben {ti} existiert nicht (1..{count_trenches}).")
 
-    idx = _find_target_index_by_selection(elems, sel)
+    idx = _find_target_index_by_selection(ix, sel)
     if idx is None:
-        idx = _resolve_selection_heuristic(elems, sel)
+        idx = _resolve_selection_heuristic(ix, sel)
     if idx is None:
         raise HTTPException(404, f"Zielobjekt nicht gefunden für selection={sel}")
+    return idx, updates
 
-    # 3) Patch anwenden
-    _apply_update(elems[idx], updates)
+def _apply_edit(session: dict, ix: ElementIndex, data: dict, instruction: str) -> None:
+    """LLM-Auswahl (selection/set) auf das Zielelement anwenden."""
+    idx, updates = _resolve_edit(ix, data, instruction)
+    _apply_update(ix.elems[idx], updates)
 
-    # 4) Normalisieren + speichern
-    _normalize_and_reindex(session)
-    session_manager.update_session(session_id, session)
-
-    return {
-        "status": "ok",
-        "updated_json": session,
-        "answer": data.get("answer", "")
-    }
+@app.post("/edit-element")
+async def edit_element(session_id: str, response: Response, instruction: str = Body(..., embed=True),
+                       since: Optional[int] = None,
+                       if_match: Optional[str] = Header(None),
+                       idempotency_key: Optional[str] = Header(None)):
+    async def run(session: dict, rev: int):
+        ix = ElementIndex(session.setdefault("elements", []))
+        hist, hrev = await run_in_threadpool(_load_history, session_id, session, rev)
+
+        # eskaliert wird nur bei unbrauchbarer Ausgabe; ein Ziel, das es nicht
+        # gibt, ist ein Fehler der Anweisung und kommt direkt zurück
+        data = await _routed_json("edit", instruction, _edit_messages(session, ix, instruction),
+                                  _EDIT_LLM, accept=_has_selection)
+        _apply_edit(session, ix, data, instruction)
+
+        # 4) Normalisieren + speichern
+        _normalize_and_reindex(session)
+        rev = await run_in_threadpool(_commit, session_id, session, rev, response, hist, hrev,
+                                      "edit-element", {"instruction": instruction})
+        return session, rev, {"answer": data.get("answer", "")}
+
+    return await _mutate(session_id, "edit-element", {"instruction": instruction}, since, if_match,
+                         idempotency_key, response, run)
+
+@app.post("/edit-element/stream")
+async def edit_element_stream(session_id: str, instruction: str = Body(..., embed=True),
+                              since: Optional[int] = None,
+                              if_match: Optional[str] = Header(None)):
+    """Wie /edit-element, aber als Server-Sent Events (Auswahl + Änderungen vorab)."""
+    session, rev = await run_in_threadpool(session_manager.get_session_rev, session_id, if_match,
+                                           create=True)
+    ix = ElementIndex(session.setdefault("elements", []))
+    hist, hrev = await run_in_threadpool(_load_history, session_id, session, rev)
+
+    async def events():
+        data: dict = {}
+        route = model_router.route("edit", instruction)
+        async for chunk in _stream_llm(route, _edit_messages(session, ix, instruction), _EDIT_LLM,
+                                       {"selection": "selection", "set": "set"}, data):
+            yield chunk
+        model_router.outcome(route, _has_selection(data))
+        _apply_edit(session, ix, data, instruction)
+        _normalize_and_reindex(session)
+        new_rev = await run_in_threadpool(_commit, session_id, session, rev, None, hist, hrev,
+                                          "edit-element", {"instruction": instruction})
+        yield _sse("result", await run_in_threadpool(_reply, session_id, session, new_rev, since,
+                                                     etag=etag(new_rev),
+                                                     answer=data.get("answer", "")))
+
+    return StreamingResponse(_sse_guard(events()), media_type="text/event-stream",
+                             headers=_SSE_HEADERS)
 
 # -----------------------------------------------------
 # Delete Element (robust, single + bulk)
 # -----------------------------------------------------
-@app.post("/remove-element")
-def remove_element(session_id: str, instruction: str = Body(..., embed=True)):
-    session = session_manager.get_session(session_id)
-    if session is None:
-        raise HTTPException(404, "Session unknown")
-
-    prompt = f"""
+_REMOVE_STATIC = """\
 Du bist eine JSON-API und gibst AUSSCHLIESSLICH gültiges JSON zurück.
 
-ANWEISUNG: {instruction!r}
-
-KONTEXT (Bestand – komprimiert):
-{_build_edit_context(session)}
-
 ZIEL
 • Bestimme, welches Objekt (oder welche Menge) zu löschen ist.
 • Nutze Synonyme: „BG“/„Graben“ → Baugraben, „Druckrohr“/„Leitung“ → Rohr,
@@ -2240,41 +2623,54 @@ MODUS
 BEISPIELE
 Eingabe: "Lösche GOK bei Bg2"
 Antwort:
-{{
-  "selection": {{ "type": "Baugraben", "trench_index": 2 }},
+{
+  "selection": { "type": "Baugraben", "trench_index": 2 },
   "mode": "reset_gok",
   "answer": "GOK bei Baugraben 2 auf 0,00 m zurückgesetzt."
-}}
+}
 
 ANTWORTFORMAT (exakt so!):
-{{
-  "selection": {{
+{
+  "selection": {
     "type": "Baugraben | Rohr | Oberflächenbefestigung | Durchstich | Verbindung",
     "trench_index": 0,
     "for_trench": 0,
     "seq": 0,
     "between": 0,
     "ordinal": 0
-  }},
+  },
   "mode": "single" | "bulk",
   "answer": "kurz auf Deutsch"
-}}
+}
 """
 
-    try:
-        response = client.chat.completions.create(
-            model="qwen/qwen3-coder",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": "You are a JSON API."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=400,
-            temperature=0.0,
-        )
-        data = json.loads(response.choices[0].message.content)
-    except Exception as e:
-        raise HTTPException(500, f"Fehler ChatGPT: {e}")
+_PROMPT_REMOVE = prompt_templates.register("remove-element", static=_REMOVE_STATIC, dynamic="""\
+ANWEISUNG: {instruction}
+
+KONTEXT (Bestand – komprimiert):
+{context}
+""")
+
+@app.post("/remove-element")
+async def remove_element(session_id: str, response: Response, instruction: str = Body(..., embed=True),
+                         since: Optional[int] = None,
+                         if_match: Optional[str] = Header(None),
+                         idempotency_key: Optional[str] = Header(None)):
+    return await _mutate(session_id, "remove-element", {"instruction": instruction}, since, if_match,
+                         idempotency_key, response,
+                         lambda session, rev: _remove(session_id, session, rev, instruction, response))
+
+async def _remove(session_id: str, session: dict, rev: int, instruction: str,
+                  response: Response) -> tuple[dict, int, dict]:
+    ix = ElementIndex(session.setdefault("elements", []))
+    hist, hrev = await run_in_threadpool(_load_history, session_id, session, rev)
+
+    data = await _routed_json(
+        "remove", instruction,
+        _PROMPT_REMOVE.messages(instruction=repr(instruction),
+                                context=_build_edit_context(session, ix)),
+        _EDIT_LLM, accept=_has_selection,
+    )
 
     sel = data.get("selection") or {}
     if not isinstance(sel, dict) or not sel.get("type"):
@@ -2286,28 +2682,28 @@ ANTWORTFORMAT (exakt so!):
     if mode not in ("single", "bulk", "reset_gok"):
         mode = "single"
 
-    elems = session.setdefault("elements", [])
+    elems = ix.elems
 
     # Hilfsfilter: passt Element zu selection?
     def _matches_bulk(e: dict, s: dict) -> bool:
-        et = (e.get("type","") or "").lower()
-        if et in ("aufmass", "aufmass_override"):  # nie löschen
+        ek = kind_of(e)
+        if ek is Kind.AUFMASS:  # nie löschen
             return False
 
-        t = (s.get("type","") or "").lower()
+        k = kind_of_type(s.get("type","") or "")
 
-        if "baugraben" in t:
-            if "baugraben" not in et: return False
+        if k is Kind.TRENCH:
+            if ek is not Kind.TRENCH: return False
             ti = s.get("trench_index", None)
             return (ti is None) or (int(e.get("trench_index",0)) == int(ti))
 
-        if "rohr" in t:
-            if "rohr" not in et: return False
+        if k is Kind.PIPE:
+            if ek is not Kind.PIPE: return False
             ft = s.get("for_trench", None)
             return (ft is None) or (int(e.get("for_trench",0)) == int(ft))
 
-        if ("oberflächenbefest" in t) or ("oberflaechenbefest" in t):
-            if ("oberflächenbefest" not in et) and ("oberflaechenbefest" not in et):
+        if k is Kind.SURFACE:
+            if ek is not Kind.SURFACE:
                 return False
             ft = s.get("for_trench", None)
             seq = s.get("seq", None)
@@ -2316,14 +2712,14 @@ ANTWORTFORMAT (exakt so!):
             if seq is not None: ok &= int(e.get("seq",0) or 0) == int(seq)
             return ok
 
-        if "durchstich" in t:
-            if "durchstich" not in et: return False
+        if k is Kind.PASS:
+            if ek is not Kind.PASS: return False
             b = s.get("between", None)
             # „ordinal“ verwenden wir nur im single-Modus; für bulk ist es egal.
             return (b is None) or (int(e.get("between", -1)) == int(b))
 
-        if "verbindung" in t:
-            if "verbindung" not in et: return False
+        if k is Kind.JOIN:
+            if ek is not Kind.JOIN: return False
             b = s.get("between", None)
             return (b is None) or (int(e.get("between", -1)) == int(b))
 
@@ -2341,27 +2737,26 @@ ANTWORTFORMAT (exakt so!):
     # 2) Löschen
     # --- Aktion: reset_gok VOR den Löschzweigen behandeln ---
     if mode == "reset_gok":
-        idx = _find_target_index_by_selection(elems, sel)
+        idx = _find_target_index_by_selection(ix, sel)
         if idx is None:
-            idx = _resolve_selection_heuristic(elems, sel)
+            idx = _resolve_selection_heuristic(ix, sel)
         if idx is None:
             raise HTTPException(404, f"Zielobjekt nicht gefunden für selection={sel}")
 
-        if (elems[idx].get("type","") or "").lower().startswith("baugraben"):
+        if kind_of(elems[idx]) is Kind.TRENCH:
             elems[idx]["gok"] = 0.0
         else:
             raise HTTPException(400, "GOK-Reset ist nur für Baugräben zulässig.")
 
     # --- 2) Löschen ---
     elif mode == "single":
-        idx = _find_target_index_by_selection(elems, sel)
+        idx = _find_target_index_by_selection(ix, sel)
         if idx is None:
-            idx = _resolve_selection_heuristic(elems, sel)
+            idx = _resolve_selection_heuristic(ix, sel)
         if idx is None:
             raise HTTPException(404, f"Zielobjekt nicht gefunden für selection={sel}")
 
-        t_low = (elems[idx].get("type","") or "").lower()
-        if t_low in ("aufmass", "aufmass_override"):
+        if kind_of(elems[idx]) is Kind.AUFMASS:
             raise HTTPException(400, "Dieses Element ist nicht löschbar.")
 
         del elems[idx]
@@ -2377,16 +2772,84 @@ ANTWORTFORMAT (exakt so!):
 
     # 3) Normalisieren + speichern
     _normalize_and_reindex(session)
-    session_manager.update_session(session_id, session)
+    rev = await run_in_threadpool(_commit, session_id, session, rev, response, hist, hrev,
+                                  "remove-element", {"instruction": instruction})
 
     # Hinweis: Antwort vom LLM ist rein „sprachlich“
-    return {
-        "status": "ok",
-        "deleted": deleted,
+    return session, rev, {"deleted": deleted, "answer": data.get("answer", "")}
 
-        "updated_json": session,
-        "answer": data.get("answer", "")
-    }
+# -----------------------------------------------------
+# Undo / Redo / Revisionen
+# -----------------------------------------------------
+def _step_history(session_id: str, response: Response, if_match: Optional[str], direction: str,
+                  since: Optional[int] = None):
+    session, rev = session_manager.get_session_rev(session_id, if_match)
+    if session is None:
+        raise HTTPException(404, "Session unknown")
+    data, hrev = session_manager.get_aux(session_id, "history")
+    hist = RevisionHistory(data)
+
+    undo = direction == "undo"
+    entry = hist.step_undo() if undo else hist.step_redo()
+    if entry is None:
+        what = "rückgängig zu machen" if undo else "wiederherzustellen"
+        raise HTTPException(409, f"Nichts {what}.")
+
+    d, _ = session_manager.get_aux(session_id, history.record_name(entry["id"]))
+    elements = history.apply(session.get("elements", []), d, reverse=undo)
+    if elements is None:
+        raise HTTPException(409, "Historie passt nicht mehr zum aktuellen Stand.")
+    label = hist.undo[-1]["label"]
+
+    session["elements"] = elements
+    rev = session_manager.update_session(session_id, session, expected_rev=rev, event=direction,
+                                         inputs={"restored": label})
+    response.headers["ETag"] = etag(rev)
+
+    def step(h: RevisionHistory) -> None:
+        top = (h.undo if undo else h.redo)[-1:]
+        if top and top[0]["id"] == entry["id"]:
+            h.step_undo() if undo else h.step_redo()
+            h.mark_current(rev)
+
+    hist.mark_current(rev)
+    _save_history(session_id, hist, hrev, step)
+
+    return _reply(session_id, session, rev, since, answer=f"Stand „{label}“ wiederhergestellt.")
+
+@app.post("/undo")
+def undo(session_id: str, response: Response, if_match: Optional[str] = Header(None),
+         since: Optional[int] = None):
+    return _step_history(session_id, response, if_match, "undo", since)
+
+@app.post("/redo")
+def redo(session_id: str, response: Response, if_match: Optional[str] = Header(None),
+         since: Optional[int] = None):
+    return _step_history(session_id, response, if_match, "redo", since)
+
+@app.get("/revisions")
+def revisions(session_id: str, response: Response):
+    session, rev = session_manager.get_session_rev(session_id)
+    if session is None:
+        raise HTTPException(404, "Session unknown")
+    data, _ = session_manager.get_aux(session_id, "history")
+    response.headers["ETag"] = etag(rev)
+    return {"rev": rev, **RevisionHistory(data).listing()}
+
+@app.get("/session-log")
+def session_log(session_id: str, response: Response, since: int = 0, at: Optional[int] = None):
+    """Audit-Trail: Ereignisse nach Revision `since`; mit `at` zusätzlich der Stand zu dieser Revision."""
+    session, rev = session_manager.get_session_rev(session_id)
+    if session is None:
+        raise HTTPException(404, "Session unknown")
+    response.headers["ETag"] = etag(rev)
+    out = {"rev": rev, "events": session_manager.events(session_id, since)}
+    if at is not None:
+        state = session_manager.replay(session_id, at) if 0 < at <= rev else None
+        if state is None:
+            raise HTTPException(404, f"Revision {at} ist im Log nicht vollständig vorhanden.")
+        out["session"] = state
+    return out
 
 # -----------------------------------------------------
 # Generate Invoice